@@ -99,6 +99,20 @@ class ConversationController extends Controller
         
         if ($success) {
             $this->db->logAction($_SESSION['user_id'] ?? 0, $_SESSION['user'], 'AI_STATUS_CHANGE', "Alterou status da IA para '$status' na conversa $conversationId");
+
+            // Avisa o worker Python local na hora; os demais workers veem o
+            // conversation_state_version incrementado por setConversationAiStatus
+            $conversation = $this->db->getConversationById($conversationId);
+            if ($conversation) {
+                $ch = curl_init("http://localhost:3000/whatsapp/internal_invalidate_state");
+                curl_setopt($ch, CURLOPT_POST, 1);
+                curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode(['to' => $conversation['user_id']]));
+                curl_setopt($ch, CURLOPT_HTTPHEADER, ['Content-Type: application/json']);
+                curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
+                curl_setopt($ch, CURLOPT_TIMEOUT, 2);
+                curl_exec($ch); // Falha aqui não é fatal: o contador de versão cobre o caso
+                curl_close($ch);
+            }
         }
 
         echo json_encode(['success' => $success, 'status' => $status]);
@@ -105,7 +105,7 @@ class DashboardController extends Controller
         // ── 5. Totais gerais ────────────────────────────────────────────────────
         $totalContacts = (int)$this->pdo->query("SELECT COUNT(*) FROM conversations")->fetchColumn();
         $totalMessages = (int)$this->pdo->query("SELECT COUNT(*) FROM messages WHERE sender = 'user'")->fetchColumn();
-        $activeToday   = (int)$this->pdo->query("SELECT COUNT(DISTINCT conversation_id) FROM messages WHERE date(created_at) = date('now')")->fetchColumn();
+        $activeToday   = (int)$this->pdo->query("SELECT COUNT(DISTINCT conversation_id) FROM messages WHERE created_at >= date('now')")->fetchColumn();
 
         $this->view('dashboard/index', [
             'contactsByDay' => $contactsByDay,
@@ -241,8 +241,21 @@ class Database
 
     public function setConversationAiStatus($conversationId, $status)
     {
-        $stmt = $this->pdo->prepare("UPDATE conversations SET ai_status = ? WHERE id = ?");
-        return $stmt->execute([$status, $conversationId]);
+        // Incrementa conversation_state_version na mesma transação: todos os
+        // workers do serviço Python descartam o ai_status em cache (ver
+        // ConversationStateCache.check_version em core/repositories.py)
+        $this->pdo->beginTransaction();
+        try {
+            $stmt = $this->pdo->prepare("UPDATE conversations SET ai_status = ? WHERE id = ?");
+            $stmt->execute([$status, $conversationId]);
+            $this->pdo->exec("INSERT INTO system_settings (key, value, updated_at) VALUES ('conversation_state_version', '1', CURRENT_TIMESTAMP)
+                ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1, updated_at = CURRENT_TIMESTAMP");
+            $this->pdo->commit();
+            return true;
+        } catch (PDOException $e) {
+            $this->pdo->rollBack();
+            return false;
+        }
     }
 
     public function updateConversationAnalysis($conversationId, $sentiment, $topic)
@@ -0,0 +1,73 @@
+"""
+Leitura e divisão em chunks dos documentos da base de conhecimento.
+
+Módulo leve de propósito: importa só a stdlib e, sob demanda, os readers do
+agno — nada de core.config, banco ou main.py. O KnowledgeIngestor roda cada
+documento em um processo novo (`python -m agents.chunking ARQUIVO`, via
+read_chunks_in_subprocess): o PDFReader usa CPU de verdade e um PDF
+problemático não derruba o servidor. Não usamos multiprocessing: com fork,
+o filho herda locks de outras threads (logging, LanceDB) e pode travar; com
+spawn/forkserver, cada worker reexecuta o __main__ — o startup inteiro do
+main.py.
+"""
+
+import os
+import pickle
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# (conteúdo, nome, meta_data) — tuplas simples atravessam o pickle do processo filho
+Chunk = Tuple[str, str, Dict[str, Any]]
+
+# Diretório de src/python, para o `-m agents.chunking` achar o pacote
+_SOURCE_ROOT = Path(__file__).resolve().parent.parent
+
+
+def chunker_for(path: Path) -> str:
+    """Reader/chunking configuration used for path; a change re-indexes the file."""
+    return "PDFReader(chunk=True)" if path.suffix.lower() == ".pdf" else "TextReader(chunk=True)"
+
+
+def read_chunks(path_str: str) -> List[Chunk]:
+    """Parses and chunks one document in the current process."""
+    path = Path(path_str)
+    # Mantenha em sincronia com chunker_for
+    if path.suffix.lower() == ".pdf":
+        from agno.knowledge.reader.pdf_reader import PDFReader
+        reader = PDFReader(chunk=True)
+    else:
+        from agno.knowledge.reader.text_reader import TextReader
+        reader = TextReader(chunk=True)
+    documents = reader.read(path, name=path.name)
+    return [(doc.content, doc.name or path.name, dict(doc.meta_data or {})) for doc in documents if doc.content]
+
+
+def read_chunks_in_subprocess(path_str: str, timeout: Optional[float] = None) -> List[Chunk]:
+    """Runs read_chunks in a fresh interpreter (see the module docstring). Raises RuntimeError on failure."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(_SOURCE_ROOT), os.environ.get("PYTHONPATH")]))}
+    proc = subprocess.run(
+        [sys.executable, "-m", "agents.chunking", path_str],
+        cwd=_SOURCE_ROOT,
+        env=env,
+        capture_output=True,
+        timeout=timeout,
+    )
+    if proc.returncode != 0:
+        detail = proc.stderr.decode("utf-8", "replace").strip().splitlines()
+        raise RuntimeError(detail[-1] if detail else f"chunking exited with code {proc.returncode}")
+    return pickle.loads(proc.stdout)
+
+
+def _main(path_str: str) -> None:
+    # O stdout carrega o pickle: qualquer print/log dos readers vai para o stderr
+    out = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    with out:
+        pickle.dump(read_chunks(path_str), out, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+if __name__ == "__main__":
+    _main(sys.argv[1])
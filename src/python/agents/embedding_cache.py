@@ -0,0 +1,186 @@
+"""
+Cache persistente de embeddings da base de conhecimento.
+
+O mesmo PDF costuma estar anexado a vários agentes, e o chat de teste do
+dashboard (chat_agent.py) reindexa os documentos a cada conversa: cada
+caminho embutia de novo chunks idênticos. Aqui o vetor fica guardado por
+(embedder, dimensões, sha256 do texto do chunk) e é consultado pelo
+IngestionEmbedder antes de chamar o embedder real — em agents.factory e em
+chat_agent.py.
+
+Fica num arquivo SQLite próprio (EMBEDDING_CACHE_PATH), fora do banco do
+dashboard: os vetores são grandes e não são dados da aplicação. Vetores são
+gravados como float32. Acima de EMBEDDING_CACHE_MAX_ENTRIES, os menos usados
+recentemente são removidos.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from core.config import DB_BUSY_TIMEOUT_MS, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_PATH
+
+# Limite de parâmetros por consulta (SQLITE_MAX_VARIABLE_NUMBER antigo é 999)
+_QUERY_CHUNK = 500
+# A remoção desce até esta fração do limite, para não rodar a cada insert
+_EVICT_TO = 0.9
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS embedding_cache (
+        embedder_id TEXT NOT NULL,
+        dimensions INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        vector BLOB NOT NULL,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL,
+        PRIMARY KEY (embedder_id, dimensions, sha256)
+    );
+    CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used_at);
+"""
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _encode(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _decode(blob: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    """(embedder id, dimensions, sha256 of the chunk text) -> embedding, in a local SQLite file."""
+
+    def __init__(self, path: Path = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max(max_entries, 1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._entries: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=DB_BUSY_TIMEOUT_MS / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            with self._lock:
+                if self._entries is None:
+                    self._entries = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        return conn
+
+    def get_many(self, embedder_id: str, dimensions: Optional[int], texts: Iterable[str]) -> Dict[str, List[float]]:
+        """Cached vectors for the texts that have one, keyed by text."""
+        by_hash: Dict[str, str] = {text_sha256(text): text for text in texts}
+        if not by_hash:
+            return {}
+        found: Dict[str, List[float]] = {}
+        try:
+            conn = self._conn()
+            hashes = list(by_hash)
+            for start in range(0, len(hashes), _QUERY_CHUNK):
+                chunk = hashes[start:start + _QUERY_CHUNK]
+                rows = conn.execute(
+                    f"""
+                    SELECT sha256, vector FROM embedding_cache
+                    WHERE embedder_id = ? AND dimensions = ? AND sha256 IN ({",".join("?" * len(chunk))})
+                    """,
+                    (embedder_id, dimensions or 0, *chunk),
+                ).fetchall()
+                for sha, blob in rows:
+                    found[by_hash[sha]] = _decode(blob)
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embedding_cache SET last_used_at = ? WHERE embedder_id = ? AND dimensions = ? AND sha256 = ?",
+                    [(now, embedder_id, dimensions or 0, text_sha256(text)) for text in found],
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error reading embedding cache: {e}")
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(by_hash) - len(found)
+        return found
+
+    def put_many(self, embedder_id: str, dimensions: Optional[int], vectors: Dict[str, List[float]]) -> None:
+        """Stores text -> vector pairs; evicts the least recently used entries above max_entries."""
+        if not vectors:
+            return
+        try:
+            conn = self._conn()
+            now = time.time()
+            before = conn.total_changes
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO embedding_cache (embedder_id, dimensions, sha256, vector, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (embedder_id, dimensions or 0, text_sha256(text), _encode(vector), now, now)
+                    for text, vector in vectors.items()
+                    if vector
+                ],
+            )
+            conn.commit()
+            added = conn.total_changes - before
+            with self._lock:
+                self.writes += added
+                self._entries = (self._entries or 0) + added
+                over = self._entries > self.max_entries
+            if over:
+                self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"Error writing embedding cache: {e}")
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # Recontagem: outros processos (chat_agent.py) também gravam no arquivo
+        entries = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        excess = entries - int(self.max_entries * _EVICT_TO)
+        if entries > self.max_entries and excess > 0:
+            conn.execute(
+                """
+                DELETE FROM embedding_cache WHERE rowid IN (
+                    SELECT rowid FROM embedding_cache ORDER BY last_used_at LIMIT ?
+                )
+                """,
+                (excess,),
+            )
+            conn.commit()
+            entries -= excess
+            with self._lock:
+                self.evictions += excess
+        with self._lock:
+            self._entries = entries
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,339 @@
+"""
+Embedders usados na ingestão da base de conhecimento.
+
+O LanceDb do agno gera o embedding de cada documento dentro do insert(), um
+request por chunk. O IngestionEmbedder envolve o embedder real: a ingestão
+chama prepare() com os textos de um arquivo inteiro, que são embutidos em
+lotes (KB_EMBED_BATCH_SIZE) antes do insert; durante o insert, cada
+get_embedding_and_usage só retira o vetor já calculado.
+
+Com um EmbeddingCache (agents/embedding_cache.py), chunks já embutidos antes
+— por outro agente, outra tabela ou outra execução do chat_agent.py — saem
+do cache sem chamar a API. O cache só é usado pelo prepare(): o mesmo
+embedder serve as buscas do LanceDb, e o texto de cada pergunta do usuário
+vai direto ao embedder real — sem uma escrita no SQLite por busca e sem
+disputar EMBEDDING_CACHE_MAX_ENTRIES com os chunks dos documentos.
+
+Os lotes de um arquivo vão ao embedder em paralelo pelo EmbedRequestPool
+(KB_EMBED_CONCURRENCY chamadas simultâneas no processo inteiro). Um 429
+pausa todas as chamadas com backoff exponencial; 5xx e lotes que voltam
+incompletos são repetidos só naquele lote. O FakeEmbedder gera vetores
+determinísticos sem rede (KB_EMBEDDER=fake), para testes e benchmarks.
+"""
+
+import asyncio
+import hashlib
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from agno.knowledge.embedder.base import Embedder
+
+from core.config import (
+    KB_EMBED_BACKOFF_BASE,
+    KB_EMBED_BACKOFF_MAX,
+    KB_EMBED_BATCH_SIZE,
+    KB_EMBED_CONCURRENCY,
+    KB_EMBED_MAX_ATTEMPTS,
+)
+
+from .embedding_cache import EmbeddingCache
+
+Usage = Optional[Dict]
+BatchResult = Tuple[List[List[float]], List[Usage]]
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class IncompleteBatchError(Exception):
+    """The embedder returned fewer (or empty) vectors than texts in the batch."""
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    # google-genai (APIError.code), httpx/requests (response.status_code) e o FakeEmbedder
+    for value in (
+        getattr(error, "code", None),
+        getattr(error, "status_code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+    ):
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return _status_code(error) == 429 or "RESOURCE_EXHAUSTED" in str(error)
+
+
+class EmbedRequestPool:
+    """Runs batch embedding requests with bounded concurrency, retries and a shared rate-limit backoff."""
+
+    def __init__(
+        self,
+        concurrency: int = KB_EMBED_CONCURRENCY,
+        max_attempts: int = KB_EMBED_MAX_ATTEMPTS,
+        backoff_base: float = KB_EMBED_BACKOFF_BASE,
+        backoff_max: float = KB_EMBED_BACKOFF_MAX,
+    ):
+        self.concurrency = max(concurrency, 1)
+        self.max_attempts = max(max_attempts, 1)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Instante até o qual ninguém chama o embedder (último 429)
+        self._resume_at = 0.0
+
+        self.requests = 0
+        self.chunks = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self._seconds = 0.0
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="kb-embed")
+            return self._executor
+
+    def run(self, embed_batch: Callable[[List[str]], BatchResult], batches: List[List[str]]) -> Iterator[Tuple[List[str], List[List[float]], List[Usage]]]:
+        """
+        Embeds the batches concurrently and yields (batch, embeddings, usages)
+        in order. Batches that still fail after retrying are skipped and the
+        first error is raised at the end, after the others were yielded.
+        """
+        if not batches:
+            return
+        started = time.perf_counter()
+        pool = self._pool()
+        futures = [pool.submit(self._request, embed_batch, batch) for batch in batches]
+        error: Optional[Exception] = None
+        try:
+            for batch, future in zip(batches, futures):
+                try:
+                    embeddings, usages = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                yield batch, embeddings, usages
+        finally:
+            for future in futures:
+                future.cancel()
+            with self._lock:
+                self._seconds += time.perf_counter() - started
+        if error is not None:
+            raise error
+
+    def _request(self, embed_batch: Callable[[List[str]], BatchResult], batch: List[str]) -> BatchResult:
+        attempt = 0
+        while True:
+            self._wait_backoff()
+            attempt += 1
+            try:
+                embeddings, usages = embed_batch(batch)
+                # O GeminiEmbedder do agno devolve vetor vazio quando a chamada falha
+                if len(embeddings) != len(batch) or not all(embeddings):
+                    raise IncompleteBatchError(f"{sum(1 for e in embeddings if e)} of {len(batch)} embeddings returned")
+            except Exception as e:
+                rate_limited = is_rate_limited(e)
+                transient = rate_limited or isinstance(e, (IncompleteBatchError, ConnectionError, TimeoutError)) or _status_code(e) in _RETRY_STATUS
+                if attempt >= self.max_attempts or not transient:
+                    with self._lock:
+                        self.failed += 1
+                    raise
+                delay = min(self.backoff_base * (2 ** (attempt - 1)), self.backoff_max) * random.uniform(0.75, 1.25)
+                with self._lock:
+                    self.retries += 1
+                    if rate_limited:
+                        # Cota estourada vale para todos: as outras chamadas também esperam
+                        self.rate_limited += 1
+                        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                print(f"Embedding batch of {len(batch)} failed (attempt {attempt}/{self.max_attempts}), retrying in {delay:.1f}s: {e}")
+                if not rate_limited:
+                    time.sleep(delay)
+                continue
+            with self._lock:
+                self.requests += 1
+                self.chunks += len(batch)
+            return embeddings, usages
+
+    def _wait_backoff(self) -> None:
+        while True:
+            with self._lock:
+                wait = self._resume_at - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "requests": self.requests,
+                "chunks": self.chunks,
+                "avg_batch_size": round(self.chunks / self.requests, 1) if self.requests else None,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "failed_batches": self.failed,
+                "seconds": round(self._seconds, 3),
+                "chunks_per_second": round(self.chunks / self._seconds, 1) if self._seconds else None,
+            }
+
+
+embed_request_pool = EmbedRequestPool()
+
+
+@dataclass
+class IngestionEmbedder(Embedder):
+    """Wraps an embedder so ingestion can embed a whole file in batches before LanceDb.insert."""
+
+    inner: Optional[Embedder] = None
+    embed_batch_size: int = KB_EMBED_BATCH_SIZE
+    cache: Optional[EmbeddingCache] = None
+    pool: EmbedRequestPool = field(default=embed_request_pool, repr=False)
+    _prepared: Dict[str, Tuple[List[float], Usage]] = field(default_factory=dict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self):
+        if self.inner is None:
+            raise ValueError("IngestionEmbedder needs an inner embedder")
+        # O LanceDb monta o schema da tabela a partir de embedder.dimensions
+        self.dimensions = self.inner.dimensions
+
+    @property
+    def embedder_id(self) -> str:
+        """Identifies the real embedding model (e.g. "GeminiEmbedder:gemini-embedding-001")."""
+        model = getattr(self.inner, "id", None)
+        return f"{type(self.inner).__name__}:{model}" if model else type(self.inner).__name__
+
+    # ------------------------------------------------------------------
+    # Ingestão
+    # ------------------------------------------------------------------
+
+    def prepare(self, texts: List[str]) -> int:
+        """Embeds texts in batches and keeps the vectors for the next insert. Returns the number embedded."""
+        with self._lock:
+            missing = list(dict.fromkeys(t for t in texts if t not in self._prepared))
+        if self.cache is not None and missing:
+            cached = self.cache.get_many(self.embedder_id, self.dimensions, missing)
+            with self._lock:
+                for text, embedding in cached.items():
+                    self._prepared[text] = (embedding, None)
+            missing = [t for t in missing if t not in cached]
+        size = max(self.embed_batch_size, 1)
+        batches = [missing[start:start + size] for start in range(0, len(missing), size)]
+        for batch, embeddings, usages in self.pool.run(self._embed_batch, batches):
+            with self._lock:
+                for text, embedding, usage in zip(batch, embeddings, usages):
+                    self._prepared[text] = (embedding, usage)
+            if self.cache is not None:
+                self.cache.put_many(self.embedder_id, self.dimensions, dict(zip(batch, embeddings)))
+        return len(missing)
+
+    def discard(self, texts: List[str]) -> None:
+        """Drops prepared vectors that were not consumed (failed insert)."""
+        with self._lock:
+            for text in texts:
+                self._prepared.pop(text, None)
+
+    def _embed_batch(self, texts: List[str]) -> BatchResult:
+        batch_call = getattr(self.inner, "get_embeddings_batch_and_usage", None)
+        if batch_call is not None:
+            try:
+                return batch_call(texts)
+            except NotImplementedError:
+                pass
+        pairs = [self.inner.get_embedding_and_usage(text) for text in texts]
+        return [p[0] for p in pairs], [p[1] for p in pairs]
+
+    # ------------------------------------------------------------------
+    # Interface do agno
+    # ------------------------------------------------------------------
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Usage]:
+        with self._lock:
+            prepared = self._prepared.pop(text, None)
+        if prepared is not None:
+            return prepared
+        # Fora da ingestão (busca): sem cache, ver o docstring do módulo
+        return self.inner.get_embedding_and_usage(text)
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embedding_and_usage(text)[0]
+
+    async def async_get_embedding_and_usage(self, text: str) -> Tuple[List[float], Usage]:
+        with self._lock:
+            prepared = self._prepared.pop(text, None)
+        if prepared is not None:
+            return prepared
+        return await self.inner.async_get_embedding_and_usage(text)
+
+    async def async_get_embedding(self, text: str) -> List[float]:
+        return (await self.async_get_embedding_and_usage(text))[0]
+
+
+class FakeRateLimitError(Exception):
+    """429 raised by FakeEmbedder when rate_limit_every is set."""
+
+    code = 429
+
+
+@dataclass
+class FakeEmbedder(Embedder):
+    """
+    Deterministic offline embedder: each vector is derived from the sha256 of
+    the text (same text, same vector). latency simulates the round trip of
+    one request; rate_limit_every makes every Nth request fail with a 429.
+    """
+
+    id: str = "fake"
+    dimensions: int = 1536
+    latency: float = 0.0
+    rate_limit_every: int = 0
+    requests: int = field(default=0, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def vector(self, text: str) -> List[float]:
+        digest = hashlib.shake_256(text.encode("utf-8")).digest(self.dimensions * 2)
+        values = [int.from_bytes(digest[i:i + 2], "little") / 32767.5 - 1.0 for i in range(0, len(digest), 2)]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def _count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+            limited = self.rate_limit_every and self.requests % self.rate_limit_every == 0
+        if limited:
+            raise FakeRateLimitError("429 RESOURCE_EXHAUSTED (fake)")
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Usage]:
+        self._count_request()
+        time.sleep(self.latency)
+        return self.vector(text), None
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embedding_and_usage(text)[0]
+
+    def get_embeddings_batch_and_usage(self, texts: List[str]) -> BatchResult:
+        self._count_request()
+        time.sleep(self.latency)
+        return [self.vector(text) for text in texts], [None] * len(texts)
+
+    async def async_get_embedding_and_usage(self, text: str) -> Tuple[List[float], Usage]:
+        self._count_request()
+        await asyncio.sleep(self.latency)
+        return self.vector(text), None
+
+    async def async_get_embedding(self, text: str) -> List[float]:
+        return (await self.async_get_embedding_and_usage(text))[0]
@@ -1,26 +1,22 @@
 import sys
+from functools import partial
 from typing import List, Optional, Any, Dict
 from pathlib import Path
 
 from agno.agent import Agent
-from agno.knowledge.knowledge import Knowledge
-from agno.vectordb.lancedb import LanceDb, SearchType
-from agno.knowledge.embedder.google import GeminiEmbedder
-
-# Import readers safely
-try:
-    from agno.knowledge.reader.pdf_reader import PDFReader
-except ImportError:
-    PDFReader = None
-try:
-    from agno.knowledge.reader.text_reader import TextReader
-except ImportError:
-    TextReader = None
-
-from core.config import PROJECT_ROOT, VECTOR_DB_PATH
+
+# LanceDb, Knowledge, GeminiEmbedder e os readers são importados onde a base
+# de conhecimento é aberta: no modo lazy, só na primeira delegação
+
+from core.config import AGENT_LOADING_MODE, KB_EMBEDDER, KB_INGESTION_MODE, PROJECT_ROOT, VECTOR_DB_PATH
 from core.models import get_model
 from core.repositories import AgentRepository
 
+from .embedding_cache import embedding_cache
+from .embeddings import FakeEmbedder, IngestionEmbedder
+from .ingestion import SUPPORTED_SUFFIXES, KnowledgeJob, knowledge_ingestor
+from .lazy import LazyKnowledgeAgent
+
 def load_knowledge_base(kb_path_str: str) -> Optional[Any]:
     """Loads a knowledge base from a file path."""
     if not kb_path_str:
@@ -35,6 +31,19 @@ def load_knowledge_base(kb_path_str: str) -> Optional[Any]:
         print(f"Warning: Knowledge base file not found at {kb_path}")
         return None
 
+    from agno.knowledge.knowledge import Knowledge
+    from agno.vectordb.lancedb import LanceDb, SearchType
+
+    # Import readers safely
+    try:
+        from agno.knowledge.reader.pdf_reader import PDFReader
+    except ImportError:
+        PDFReader = None
+    try:
+        from agno.knowledge.reader.text_reader import TextReader
+    except ImportError:
+        TextReader = None
+
     try:
         # Initialize VectorDB
         vector_db = LanceDb(
@@ -68,11 +77,13 @@ def load_knowledge_base(kb_path_str: str) -> Optional[Any]:
         return None
 
 def load_agents() -> List[Agent]:
-    """Loads agents from the database and initializes them."""
+    """Loads agents from the database and initializes them (knowledge opens on first run in lazy mode)."""
     agents = []
-    
+    lazy = AGENT_LOADING_MODE == "lazy"
+
     agent_rows = AgentRepository.get_production_agents()
-    
+    documents = AgentRepository.get_documents_by_agent()
+
     for agent_data in agent_rows:
         print(f"Loading agent: {agent_data['subject']} ({agent_data['type']})")
 
@@ -87,65 +98,109 @@ def load_agents() -> List[Agent]:
         if agent_data.get('details'):
             instructions.append(f"Additional details: {agent_data['details']}")
 
-        # Load Knowledge Base
-        knowledge_base = None
-        kb_files = []
-        
-        # 1. Fetch from agent_documents table
-        kb_files.extend(AgentRepository.get_agent_documents(agent_data['id']))
+        # 1. Documents from the agent_documents table
+        kb_files = list(documents.get(agent_data['id'], []))
 
         # 2. Check legacy column for backward compatibility
         if agent_data.get('knowledge_base') and agent_data['knowledge_base'] not in kb_files:
              kb_files.append(agent_data['knowledge_base'])
 
-        if kb_files:
-            # Create one KnowledgeBase per agent if files exist
-            vector_db = LanceDb(
-                table_name=f"kb_agent_{agent_data['id']}",
-                uri=str(VECTOR_DB_PATH),
-                search_type=SearchType.hybrid,
-                embedder=GeminiEmbedder(),
-            )
-            knowledge_base = Knowledge(vector_db=vector_db, max_results=3)
-            
-            for kb_file in kb_files:
-                kb_path = PROJECT_ROOT / "public" / "uploads" / kb_file
-                # Fallback to older path if not in uploads/
-                if not kb_path.exists():
-                     kb_path = PROJECT_ROOT / kb_file
-                
-                if kb_path.exists():
-                    # Pre-check to skip expensive PDF parsing if already in DB
-                    if vector_db.exists() and (vector_db.name_exists(str(kb_path)) or vector_db.name_exists(kb_path.name)):
-                        print(f"  - Document already in DB (skipping load): {kb_file}")
-                        continue
-                        
-                    print(f"  - Adding document: {kb_file}")
-                    if kb_path.suffix.lower() == '.pdf':
-                        if PDFReader:
-                            knowledge_base.add_content(path=str(kb_path), reader=PDFReader(chunk=True), skip_if_exists=True)
-                    elif kb_path.suffix.lower() in ['.txt', '.md', '.html']:
-                         if TextReader:
-                            knowledge_base.add_content(path=str(kb_path), reader=TextReader(chunk=True), skip_if_exists=True)
-                else:
-                    print(f"  - Warning: Document not found: {kb_file}")
-
         # Initialize Agno Agent
         try:
             # Use helper to get model based on agent type ('Fast' or 'Slow')
             agent_type = agent_data.get('type', 'fast').lower()
             agentModel = get_model(agent_type)
-            
-            agent = Agent(
+
+            agent = LazyKnowledgeAgent(
                 model=agentModel,
                 description=f"Agent for {agent_data['subject']}",
                 role=role,
                 instructions=instructions,
-                knowledge=knowledge_base,
                 markdown=True,
+                knowledge_loader=partial(_open_knowledge, agent_data['id'], kb_files, start=True) if lazy and kb_files else None,
             )
             agents.append(agent)
         except Exception as e:
             print(f"  - Error initializing agent object: {e}")
+            continue
+
+        if kb_files and not lazy:
+            _open_knowledge(agent_data['id'], kb_files, agent)
+
+    # Indexa os documentos novos/alterados (ver agents/ingestion.py)
+    if not lazy:
+        _start_ingestion(block=KB_INGESTION_MODE == "blocking")
 
     return agents
+
+
+def _open_knowledge(agent_id: int, kb_files: List[str], agent: Agent, start: bool = False) -> None:
+    """
+    Opens the agent's LanceDB table and queues its ingestion job. The knowledge
+    base is attached now if the table exists, otherwise once it is indexed.
+    start=True (lazy mode, first delegation) also starts the ingestor.
+    """
+    from agno.knowledge.knowledge import Knowledge
+    from agno.vectordb.lancedb import LanceDb, SearchType
+
+    # One LanceDB table per agent
+    embedder = _make_embedder()
+    vector_db = LanceDb(
+        table_name=f"kb_agent_{agent_id}",
+        uri=str(VECTOR_DB_PATH),
+        search_type=SearchType.hybrid,
+        embedder=embedder,
+    )
+    knowledge_base = Knowledge(vector_db=vector_db, max_results=3)
+    job = KnowledgeJob(f"kb_agent_{agent_id}", vector_db, embedder, _resolve_documents(kb_files))
+
+    # Sem tabela ainda: a base entra quando a primeira indexação terminar
+    if vector_db.exists():
+        agent.knowledge = knowledge_base
+    else:
+        job.on_ready = _attach_knowledge(agent, knowledge_base)
+    knowledge_ingestor.add(job)
+    if start:
+        # Nunca bloqueia aqui: estamos dentro da execução do time
+        _start_ingestion(block=False)
+
+
+def _start_ingestion(block: bool) -> None:
+    if KB_INGESTION_MODE == "off":
+        return
+    if block:
+        knowledge_ingestor.run()
+    else:
+        knowledge_ingestor.start()
+
+
+def _make_embedder() -> IngestionEmbedder:
+    """Batching/caching embedder for one agent's table; KB_EMBEDDER=fake uses local deterministic vectors."""
+    from agno.knowledge.embedder.google import GeminiEmbedder
+
+    inner = FakeEmbedder() if KB_EMBEDDER == "fake" else GeminiEmbedder()
+    return IngestionEmbedder(inner=inner, cache=embedding_cache)
+
+
+def _resolve_documents(kb_files: List[str]) -> List[Path]:
+    """Paths of the agent's documents that exist and have a supported format."""
+    paths = []
+    for kb_file in kb_files:
+        kb_path = PROJECT_ROOT / "public" / "uploads" / kb_file
+        # Fallback to older path if not in uploads/
+        if not kb_path.exists():
+            kb_path = PROJECT_ROOT / kb_file
+        if not kb_path.exists():
+            print(f"  - Warning: Document not found: {kb_file}")
+        elif kb_path.suffix.lower() not in SUPPORTED_SUFFIXES:
+            print(f"  - Warning: Unsupported knowledge base format: {kb_file}")
+        else:
+            paths.append(kb_path)
+    return paths
+
+
+def _attach_knowledge(agent: Agent, knowledge_base: Any):
+    def attach():
+        agent.knowledge = knowledge_base
+        print(f"Knowledge base ready for agent: {agent.description}")
+    return attach
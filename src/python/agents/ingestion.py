@@ -0,0 +1,420 @@
+"""
+Ingestão da base de conhecimento dos agentes (tabelas kb_agent_{id} no LanceDB).
+
+Antes, load_agents lia, dividia e embutia cada documento em série durante o
+import do main.py — um PDF novo de 200 páginas segurava o startup por
+minutos. Agora load_agents só monta os agentes e registra um KnowledgeJob
+por agente; o KnowledgeIngestor indexa em uma thread de fundo:
+
+1. detecção de mudança pelo manifesto (kb_ingestion_manifest, um registro
+   por arquivo e tabela): tamanho e mtime iguais pulam o arquivo sem lê-lo;
+   senão vale o sha256 do conteúdo — renomear ou mover não reindexa, e
+   trocar o chunker ou o embedder reindexa. O manifesto também guarda de
+   quais chunks cada arquivo é dono (kb_ingestion_chunks): um chunk (id = md5
+   do conteúdo) fica uma vez só na tabela e só sai quando nenhum arquivo o
+   tem mais — editar um arquivo apaga só os trechos que deixaram de existir,
+   remover um arquivo apaga só o que era exclusivo dele, e os outros
+   arquivos da tabela não são relidos;
+2. leitura e divisão em chunks (PDFReader/TextReader, agents/chunking.py),
+   até KB_INGESTION_WORKERS arquivos ao mesmo tempo, cada um em um processo
+   novo que não importa o main.py;
+3. embeddings em lote, só dos chunks que ainda não estão na tabela
+   (IngestionEmbedder.prepare, KB_EMBED_BATCH_SIZE chunks
+   por chamada, até KB_EMBED_CONCURRENCY chamadas simultâneas, backoff em
+   429) enquanto o pool segue lendo os próximos arquivos;
+4. um único insert no LanceDB por arquivo.
+
+No modo AGENT_LOADING_MODE=lazy, o KnowledgeJob de cada agente só é criado
+na primeira delegação a ele (agents/lazy.py), e a indexação começa aí.
+
+Um agente sem tabela ainda recebe a base de conhecimento quando a primeira
+indexação dele termina (on_ready); quem já tinha tabela segue usando o
+conteúdo anterior enquanto a indexação roda. Progresso em status().
+"""
+
+import hashlib
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core.config import KB_INGESTION_WORKERS, PROJECT_ROOT
+from core.repositories import KnowledgeManifestRepository, ManifestRow
+
+from .chunking import Chunk, chunker_for, read_chunks, read_chunks_in_subprocess
+from .embeddings import IngestionEmbedder
+
+SUPPORTED_SUFFIXES = {".pdf", ".txt", ".md", ".html"}
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(content: str) -> str:
+    """Id of a chunk's row in the LanceDb table (agno's LanceDb.insert uses the md5 of the content)."""
+    return hashlib.md5(content.replace("\x00", "\ufffd").encode()).hexdigest()
+
+
+def manifest_key(path: Path) -> str:
+    """File path as stored in the manifest (relative to the project root when possible)."""
+    try:
+        return path.resolve().relative_to(PROJECT_ROOT.resolve()).as_posix()
+    except ValueError:
+        return path.resolve().as_posix()
+
+
+class KnowledgeJob:
+    """Documents to index into one agent's LanceDb table."""
+
+    def __init__(
+        self,
+        name: str,
+        vector_db: Any,
+        embedder: IngestionEmbedder,
+        files: List[Path],
+        on_ready: Optional[Callable[[], None]] = None,
+    ):
+        self.name = name
+        self.vector_db = vector_db
+        self.embedder = embedder
+        self.files = files
+        self.on_ready = on_ready
+        self.counts: Counter = Counter()
+        self.pending = 0
+        self.ready = False
+
+
+class _FileWork:
+    """A file that needs (re)indexing, plus what to record once it is indexed."""
+
+    __slots__ = ("path", "row", "claim", "aliases")
+
+    def __init__(self, path: Path, row: ManifestRow, claim: bool = False):
+        self.path = path
+        # Registro do manifesto a gravar (row_count preenchido após o insert)
+        self.row = row
+        # Arquivo sem mudança, relido só para registrar de quais chunks é dono
+        # (e repor os que faltarem) — uma vez, depois da migração 10
+        self.claim = claim
+        # Outros arquivos da mesma tabela com o mesmo conteúdo
+        self.aliases: List[ManifestRow] = []
+
+
+class KnowledgeIngestor:
+    """Indexes registered KnowledgeJobs in a background thread (or inline with run())."""
+
+    def __init__(self, workers: int = KB_INGESTION_WORKERS):
+        self.workers = max(workers, 1)
+        self._jobs: List[KnowledgeJob] = []
+        self._queued: List[KnowledgeJob] = []
+        self._lock = threading.Lock()
+        self._running = False
+        self._stop = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self._embed_seconds = 0.0
+        self._insert_seconds = 0.0
+
+    def add(self, job: KnowledgeJob) -> None:
+        with self._lock:
+            self._jobs.append(job)
+            self._queued.append(job)
+            self._idle.clear()
+
+    def start(self) -> None:
+        """Indexes the queued jobs in a daemon thread; returns immediately."""
+        with self._lock:
+            if self._running:
+                return  # a thread em andamento pega os jobs novos
+            self._running = True
+        threading.Thread(target=self.run, name="kb-ingestion", daemon=True).start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until every queued job was processed. Returns False on timeout."""
+        return self._idle.wait(timeout)
+
+    def stop(self) -> None:
+        """Stops after the file being indexed (shutdown); the rest is picked up on the next startup."""
+        self._stop.set()
+
+    # ------------------------------------------------------------------
+    # Pipeline
+    # ------------------------------------------------------------------
+
+    def run(self) -> None:
+        with self._lock:
+            self._running = True
+        self._started_at = self._started_at or time.monotonic()
+        while True:
+            with self._lock:
+                jobs, self._queued = self._queued, []
+                if not jobs or self._stop.is_set():
+                    self._running = False
+                    self._finished_at = time.monotonic()
+                    self._idle.set()
+                    return
+            try:
+                self._run_jobs(jobs)
+            except Exception as e:
+                print(f"Knowledge ingestion error: {e}")
+
+    def _run_jobs(self, jobs: List[KnowledgeJob]) -> None:
+        work: List[Tuple[KnowledgeJob, _FileWork]] = []
+        for job in jobs:
+            try:
+                planned = self._plan(job)
+            except Exception as e:
+                print(f"Error planning knowledge ingestion for {job.name}: {e}")
+                job.counts["failed"] += len(job.files)
+                planned = []
+            work.extend((job, item) for item in planned)
+            job.pending = len(planned)
+            if not job.pending:
+                self._mark_ready(job)
+
+        if not work:
+            return
+        print(f"Knowledge ingestion: {len(work)} documents to index with {self.workers} workers")
+        pool = ThreadPoolExecutor(self.workers, thread_name_prefix="kb-parse")
+        reader = self._reader()
+        try:
+            futures = {pool.submit(reader, str(item.path)): (job, item) for job, item in work}
+            for future in as_completed(futures):
+                if self._stop.is_set():
+                    return
+                job, item = futures[future]
+                try:
+                    self._index(job, item, future.result())
+                except Exception as e:
+                    job.counts["failed"] += 1
+                    print(f"  - Error indexing document {item.path.name} ({job.name}): {e}")
+                job.pending -= 1
+                if not job.pending:
+                    self._mark_ready(job)
+        finally:
+            # No shutdown não espera os PDFs que ainda estão sendo lidos
+            pool.shutdown(wait=not self._stop.is_set(), cancel_futures=True)
+
+    def _reader(self) -> Callable[[str], List[Chunk]]:
+        # Com mais de um worker, cada thread do pool só espera o processo
+        # filho (agents/chunking.py) e a leitura roda em paralelo de verdade.
+        # Nada de fork: este processo já tem threads (uvicorn, embeddings).
+        if self.workers > 1:
+            return read_chunks_in_subprocess
+        return read_chunks
+
+    def _plan(self, job: KnowledgeJob) -> List[_FileWork]:
+        """Compares the job's files with the manifest; returns what must be indexed."""
+        vector_db = job.vector_db
+        if vector_db.exists():
+            manifest = KnowledgeManifestRepository.load(job.name)
+            owners = KnowledgeManifestRepository.files_with_chunks(job.name)
+        else:
+            # Tabela apagada (ou nunca criada): o manifesto não vale mais
+            KnowledgeManifestRepository.delete(job.name)
+            manifest, owners = {}, set()
+        embedder_id = job.embedder.embedder_id
+        current = {manifest_key(path): path for path in job.files}
+
+        def has_chunks(row: ManifestRow) -> bool:
+            # Indexado antes de kb_ingestion_chunks: não se sabe de quais chunks é dono
+            return row[6] == 0 or row[0] in owners
+
+        work: List[_FileWork] = []
+        planned: Dict[str, _FileWork] = {}
+        unowned: List[str] = []
+        # Chunks apagados sem saber o dono (registros antigos): os demais arquivos são relidos
+        reclaim = False
+        for key, path in current.items():
+            try:
+                stat = path.stat()
+                chunker = chunker_for(path)
+                entry = manifest.get(key)
+                config_matches = entry is not None and entry[4] == chunker and entry[5] == embedder_id
+                claimed = entry is not None and has_chunks(entry)
+                if config_matches and claimed and entry[1] == stat.st_size and entry[2] == stat.st_mtime:
+                    job.counts["unchanged"] += 1
+                    continue
+
+                sha = file_sha256(path)
+                row: ManifestRow = (key, stat.st_size, stat.st_mtime, sha, chunker, embedder_id, None)
+                if config_matches and claimed and entry[3] == sha:
+                    # Só o mtime mudou (cópia, touch)
+                    KnowledgeManifestRepository.save(job.name, row[:6] + (entry[6],))
+                    job.counts["unchanged"] += 1
+                    continue
+
+                # Mesmo conteúdo já indexado com a mesma configuração: arquivo renomeado/movido ou cópia
+                donor = next(
+                    (
+                        other for other in manifest.values()
+                        if other[3:6] == (sha, chunker, embedder_id) and other[0] != key and has_chunks(other)
+                    ),
+                    None,
+                )
+                if donor is not None:
+                    released = KnowledgeManifestRepository.copy_chunks(job.name, donor[0], key)
+                    if released is None:
+                        raise RuntimeError("could not record chunk ownership")
+                    unowned.extend(released)
+                    KnowledgeManifestRepository.save(job.name, row[:6] + (donor[6],))
+                    manifest[key] = row[:6] + (donor[6],)
+                    owners.add(key)
+                    job.counts["moved"] += 1
+                    continue
+                if sha in planned:
+                    planned[sha].aliases.append(row)
+                    manifest.pop(key, None)
+                    continue
+
+                if entry is None and vector_db.exists():
+                    # Indexado por Knowledge.add_content: só dá para achar pelo nome
+                    for name in (str(path), path.name):
+                        if vector_db.name_exists(name):
+                            vector_db.delete_by_name(name)
+                            job.counts["legacy_replaced"] += 1
+                            reclaim = True
+
+                item = _FileWork(path, row, claim=entry is not None and not claimed)
+                planned[sha] = item
+                work.append(item)
+                manifest.pop(key, None)
+            except Exception as e:
+                print(f"  - Error checking document {path.name} ({job.name}): {e}")
+                job.counts["failed"] += 1
+
+        # Arquivos que saíram do agente: apaga o registro e os chunks que só eles tinham
+        orphans = [key for key in manifest if key not in current]
+        if orphans:
+            legacy = [manifest[key] for key in orphans if not has_chunks(manifest[key])]
+            unowned.extend(KnowledgeManifestRepository.delete(job.name, orphans))
+            for key in orphans:
+                manifest.pop(key)
+            job.counts["orphans_removed"] += len(orphans)
+            surviving = {row[3] for row in manifest.values()}
+            for row in legacy:
+                if row[3] not in surviving:
+                    vector_db.delete_by_content_id(row[3])
+                    reclaim = True
+        self._delete_chunks(job, unowned)
+
+        # Só na primeira ingestão depois da migração 10 (ou com uma tabela do
+        # Knowledge.add_content): um chunk igual em dois arquivos fica uma vez
+        # na tabela, e o apagado acima pode ter levado o de outro arquivo. Os
+        # demais são relidos e o insert repõe o que faltar.
+        if reclaim:
+            for key, row in manifest.items():
+                if key in current:
+                    work.append(_FileWork(current[key], row, claim=True))
+        return work
+
+    def _index(self, job: KnowledgeJob, item: _FileWork, chunks: List[Chunk]) -> None:
+        from agno.knowledge.document import Document
+
+        path = item.path
+        sha = item.row[3]
+
+        documents = [
+            Document(content=content, name=name, meta_data={**meta, "source_sha256": sha}, content_id=sha)
+            for content, name, meta in chunks
+        ]
+        ids = [chunk_id(doc.content) for doc in documents]
+        # O insert do agno pula ids que já estão na tabela: só embute os novos.
+        # Num claim os chunks já estão lá; o insert embute um a um os que faltarem.
+        owned = set(ids) if item.claim else KnowledgeManifestRepository.owned_chunks(job.name, ids)
+        texts = [doc.content for doc, doc_id in zip(documents, ids) if doc_id not in owned]
+
+        started = time.perf_counter()
+        embedded = started
+        try:
+            if texts:
+                job.embedder.prepare(texts)
+            embedded = time.perf_counter()
+            if documents:
+                if not job.vector_db.exists():
+                    job.vector_db.create()
+                job.vector_db.insert(content_hash=sha, documents=documents)
+        finally:
+            job.embedder.discard(texts)
+        finished = time.perf_counter()
+
+        # Registra depois do insert: se o processo cair antes, o arquivo é reindexado.
+        # Chunks da versão anterior que nenhum outro arquivo tem saem da tabela.
+        unowned: List[str] = []
+        for row in [item.row, *item.aliases]:
+            released = KnowledgeManifestRepository.replace_chunks(job.name, row[0], ids)
+            if released is None:
+                raise RuntimeError("could not record chunk ownership")
+            unowned.extend(released)
+            KnowledgeManifestRepository.save(job.name, row[:6] + (len(documents),))
+        self._delete_chunks(job, unowned)
+
+        self._embed_seconds += embedded - started
+        self._insert_seconds += finished - embedded
+        if item.claim:
+            job.counts["claimed"] += 1
+            return
+        job.counts["indexed"] += 1
+        job.counts["chunks"] += len(documents)
+        if documents:
+            rate = len(texts) / (embedded - started) if embedded > started else 0.0
+            print(
+                f"  - Indexed {path.name} ({job.name}): {len(documents)} chunks ({len(texts)} new) "
+                f"in {finished - started:.1f}s (embedding {rate:.0f} chunks/s)"
+            )
+        else:
+            print(f"  - No text extracted from {path.name} ({job.name})")
+
+    @staticmethod
+    def _delete_chunks(job: KnowledgeJob, chunk_ids: List[str]) -> None:
+        for doc_id in dict.fromkeys(chunk_ids):
+            job.vector_db.delete_by_id(doc_id)
+            job.counts["chunks_removed"] += 1
+
+    @staticmethod
+    def _mark_ready(job: KnowledgeJob) -> None:
+        if job.ready:
+            return
+        job.ready = True
+        if job.on_ready:
+            try:
+                job.on_ready()
+            except Exception as e:
+                print(f"Error attaching knowledge base {job.name}: {e}")
+
+    # ------------------------------------------------------------------
+    # Status
+    # ------------------------------------------------------------------
+
+    def status(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs)
+        chunks = sum(job.counts["chunks"] for job in jobs)
+        running = not self._idle.is_set()
+        elapsed = None
+        if self._started_at is not None:
+            elapsed = (time.monotonic() if running else self._finished_at) - self._started_at
+        return {
+            "state": "running" if running else ("done" if self._started_at is not None else "idle"),
+            "workers": self.workers,
+            "elapsed_seconds": round(elapsed, 3) if elapsed is not None else None,
+            "embed_seconds": round(self._embed_seconds, 3),
+            "insert_seconds": round(self._insert_seconds, 3),
+            "chunks_per_second": round(chunks / self._embed_seconds, 1) if self._embed_seconds else None,
+            "tables": {
+                job.name: {"files": len(job.files), "pending": job.pending, "ready": job.ready, **job.counts}
+                for job in jobs
+            },
+        }
+
+
+knowledge_ingestor = KnowledgeIngestor()
@@ -0,0 +1,93 @@
+"""
+Agente com base de conhecimento aberta sob demanda.
+
+No modo AGENT_LOADING_MODE=lazy, load_agents monta cada membro do time só a
+partir da linha do banco (modelo, papel, instruções): a tabela do LanceDB, o
+embedder, o objeto Knowledge e a verificação dos documentos ficam para a
+primeira vez que o Parente delega ao membro (run/arun). Assim o startup não
+importa o LanceDB nem abre uma tabela por agente. No arun, essa abertura
+roda numa thread, sem travar o event loop.
+
+Se a abertura falhar (LanceDB indisponível, disco cheio), o membro responde
+sem a base e uma delegação posterior tenta de novo, com backoff exponencial
+a partir de AGENT_KNOWLEDGE_RETRY_SECONDS.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Optional
+
+from agno.agent import Agent
+
+from core.config import AGENT_KNOWLEDGE_RETRY_MAX_SECONDS, AGENT_KNOWLEDGE_RETRY_SECONDS
+
+KnowledgeLoader = Callable[["LazyKnowledgeAgent"], None]
+
+
+class LazyKnowledgeAgent(Agent):
+    """Agent whose knowledge base is opened by knowledge_loader on the first run."""
+
+    def __init__(self, *args, knowledge_loader: Optional[KnowledgeLoader] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._knowledge_loader = knowledge_loader
+        self._knowledge_lock = threading.Lock()
+        # Falhas seguidas do loader e quando a próxima tentativa é permitida
+        self._knowledge_failures = 0
+        self._knowledge_retry_at = 0.0
+
+    @property
+    def knowledge_pending(self) -> bool:
+        return self._knowledge_loader is not None
+
+    def ensure_knowledge(self) -> None:
+        """
+        Runs the knowledge loader until it succeeds (first delegation); later
+        calls return immediately. After a failure, calls before the backoff
+        expires also return at once and the agent runs without knowledge.
+        """
+        if self._knowledge_loader is None or time.monotonic() < self._knowledge_retry_at:
+            return
+        # Segura o lock durante a abertura: uma segunda delegação simultânea
+        # espera a base em vez de rodar sem ela
+        with self._knowledge_lock:
+            loader = self._knowledge_loader
+            if loader is None or time.monotonic() < self._knowledge_retry_at:
+                return
+            try:
+                loader(self)
+            except Exception as e:
+                delay = min(AGENT_KNOWLEDGE_RETRY_SECONDS * 2 ** self._knowledge_failures, AGENT_KNOWLEDGE_RETRY_MAX_SECONDS)
+                self._knowledge_failures += 1
+                self._knowledge_retry_at = time.monotonic() + delay
+                print(f"Error opening knowledge base for agent {self.description}: {e} (retrying in {delay:.0f}s)")
+                return
+            # Só depois da abertura: até aqui o arun de outra delegação ainda passa pelo lock
+            self._knowledge_loader = None
+
+    def run(self, *args, **kwargs) -> Any:
+        self.ensure_knowledge()
+        return super().run(*args, **kwargs)
+
+    # Não é async: o arun do agno devolve uma corrotina ou, com stream, um
+    # iterador assíncrono, e o wrapper precisa manter o mesmo formato. A
+    # abertura (import do LanceDB, conexão, exists()) roda numa thread, fora
+    # do event loop que atende os outros usuários.
+    def arun(self, *args, **kwargs) -> Any:
+        if self._knowledge_loader is None or time.monotonic() < self._knowledge_retry_at:
+            return super().arun(*args, **kwargs)
+        stream = kwargs.get("stream")
+        if stream is None:
+            stream = getattr(self, "stream", None)
+        if stream:
+            return self._astream_with_knowledge(args, kwargs)
+        return self._arun_with_knowledge(args, kwargs)
+
+    async def _arun_with_knowledge(self, args: tuple, kwargs: dict) -> Any:
+        await asyncio.to_thread(self.ensure_knowledge)
+        return await super().arun(*args, **kwargs)
+
+    async def _astream_with_knowledge(self, args: tuple, kwargs: dict) -> AsyncIterator[Any]:
+        await asyncio.to_thread(self.ensure_knowledge)
+        async for event in super().arun(*args, **kwargs):
+            yield event
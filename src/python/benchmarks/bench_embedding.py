@@ -0,0 +1,84 @@
+"""
+Vazão de embeddings na ingestão: por chunk x em lote x em lote concorrente.
+
+Usa o FakeEmbedder (agents/embeddings.py), sem rede: cada chamada custa
+--latency segundos mais --per-chunk segundos por texto, como um request ao
+Gemini. Compara o caminho antigo do agno (um request por chunk, em série),
+lotes de --batch-size em série e lotes com --concurrency chamadas
+simultâneas pelo EmbedRequestPool. Com --rate-limit-every N, cada N-ésima
+chamada devolve 429 e o pool aplica o backoff.
+
+Os vetores são conferidos contra o FakeEmbedder chamado direto (mesmo texto,
+mesmo vetor), então os três caminhos têm que devolver o mesmo resultado.
+
+Uso (a partir de src/python):
+    python benchmarks/bench_embedding.py [--chunks 2000] [--latency 0.2] [--concurrency 4] [--rate-limit-every 7]
+"""
+
+import argparse
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from agents.embeddings import EmbedRequestPool, FakeEmbedder, IngestionEmbedder  # noqa: E402
+
+
+@dataclass
+class TimedFake(FakeEmbedder):
+    """FakeEmbedder whose batch latency grows with the batch size."""
+
+    per_chunk: float = 0.0
+
+    def get_embeddings_batch_and_usage(self, texts):
+        time.sleep(self.per_chunk * len(texts))
+        return super().get_embeddings_batch_and_usage(texts)
+
+
+def run(name: str, texts: list, batch_size: int, concurrency: int, args) -> None:
+    inner = TimedFake(
+        dimensions=args.dimensions, latency=args.latency, rate_limit_every=args.rate_limit_every, per_chunk=args.per_chunk
+    )
+    pool = EmbedRequestPool(concurrency=concurrency, backoff_base=args.backoff, backoff_max=args.backoff * 8)
+    embedder = IngestionEmbedder(inner=inner, embed_batch_size=batch_size, pool=pool)
+
+    started = time.perf_counter()
+    embedder.prepare(texts)
+    elapsed = time.perf_counter() - started
+
+    reference = FakeEmbedder(dimensions=args.dimensions)
+    assert all(embedder.get_embedding(text) == reference.vector(text) for text in texts), f"{name}: wrong vectors"
+    pool.close()
+
+    metrics = pool.metrics()
+    print(
+        f"{name:<28} {elapsed:8.2f}s {len(texts) / elapsed:10.1f} chunks/s "
+        f"{inner.requests:6d} requests {metrics['retries']:4d} retries ({metrics['rate_limited']} x 429)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.2, help="segundos por request")
+    parser.add_argument("--per-chunk", type=float, default=0.001, help="segundos extras por texto no lote")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--backoff", type=float, default=0.5, help="backoff base do 429 (segundos)")
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--skip-per-chunk", action="store_true", help="pula o caminho de um request por chunk")
+    args = parser.parse_args()
+
+    texts = [f"Trecho {i} do manual: verifique a antena, o cabo e a fonte do roteador." for i in range(args.chunks)]
+    print(f"{args.chunks} chunks, {args.latency * 1000:.0f} ms/request + {args.per_chunk * 1000:.1f} ms/chunk\n")
+    if not args.skip_per_chunk:
+        run("per chunk (agno insert)", texts, 1, 1, args)
+    run(f"batches of {args.batch_size}", texts, args.batch_size, 1, args)
+    run(f"batches x {args.concurrency} concurrent", texts, args.batch_size, args.concurrency, args)
+
+
+if __name__ == "__main__":
+    main()
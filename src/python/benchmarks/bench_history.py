@@ -0,0 +1,130 @@
+"""
+Tamanho do histórico injetado no prompt do ParenteTeam: legado x orçamento.
+
+Para cada turno de usuário de cada conversa, monta o bloco de histórico como
+o ParenteTeam fazia (últimas 10 mensagens inteiras, incluindo a que está
+sendo respondida) e como o HistoryBuilder (core/history.py) faz agora, e
+compara os tokens estimados (~4 caracteres por token).
+
+Fontes:
+- --db CAMINHO: tabela messages de um banco do projeto, lida em modo
+  somente leitura;
+- sem fonte: conversas sintéticas determinísticas no estilo do Parente
+  (respostas longas com saudação e oferta de ajuda repetidas).
+
+Uso (a partir de src/python):
+    python benchmarks/bench_history.py [--db ../../database.sqlite] [--conversations 200]
+"""
+
+import argparse
+import random
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+Conversation = list[dict]
+
+_TOPICS = [
+    "A antena da comunidade parou de funcionar depois da chuva.",
+    "Como faço para cadastrar minha família no programa?",
+    "O roteador fica piscando uma luz vermelha.",
+    "Quando vem a equipe técnica?",
+    "Qual a senha da internet da escola?",
+]
+
+
+def load_conversations(db_path: Path, limit: int) -> list[Conversation]:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        ids = [row["id"] for row in conn.execute("SELECT id FROM conversations ORDER BY id DESC LIMIT ?", (limit,))]
+        return [
+            [dict(row) for row in conn.execute(
+                "SELECT sender, content FROM messages WHERE conversation_id = ? ORDER BY id", (conversation_id,)
+            )]
+            for conversation_id in ids
+        ]
+    finally:
+        conn.close()
+
+
+def synthetic(conversations: int, seed: int) -> list[Conversation]:
+    rng = random.Random(seed)
+    result = []
+    for _ in range(conversations):
+        messages = []
+        for _ in range(rng.randint(3, 15)):
+            question = rng.choice(_TOPICS)
+            steps = "\n".join(
+                f"{i}. Passo {i}: " + " ".join(rng.choice(["verifique", "o cabo", "da antena", "com calma", "e depois", "ligue"]) for _ in range(rng.randint(8, 20)))
+                for i in range(1, rng.randint(3, 7))
+            )
+            answer = (
+                "Olá, parente! 🌿\n"
+                f"Entendi sua dúvida sobre: {question.lower()}\n"
+                f"{steps}\n"
+                "Se o problema continuar, fale com a equipe técnica da Rede.\n"
+                "Quer que eu explique novamente? Estou aqui para ajudar! 😊"
+            )
+            messages += [{"sender": "user", "content": question}, {"sender": "agent", "content": answer}]
+        result.append(messages)
+    return result
+
+
+def legacy_block(history_newest_first: list[dict]) -> str:
+    entries = [f"{'User' if m['sender'] == 'user' else 'Agent'}: {m['content']}" for m in history_newest_first]
+    return "Previous Conversation History:\n" + "\n".join(entries) + "\n---\n" if entries else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from core.config import HISTORY_MAX_MESSAGES
+    from core.history import HistoryBuilder, estimate_tokens
+
+    if args.db:
+        conversations, origin = load_conversations(args.db, args.conversations), str(args.db)
+    else:
+        conversations, origin = synthetic(args.conversations, args.seed), f"sintético (seed {args.seed})"
+
+    builder = HistoryBuilder()
+    legacy_tokens: list[int] = []
+    budget_tokens: list[int] = []
+    elapsed = 0.0
+    for messages in conversations:
+        for i, message in enumerate(messages):
+            if message["sender"] != "user":
+                continue
+            # Como no ParenteTeam: a mensagem atual já foi gravada quando o histórico é lido
+            visible = messages[: i + 1]
+            legacy_tokens.append(estimate_tokens(legacy_block(list(reversed(visible[-10:])))))
+            started = time.perf_counter()
+            block = builder.build(list(reversed(visible[-HISTORY_MAX_MESSAGES:])), message["content"])
+            elapsed += time.perf_counter() - started
+            budget_tokens.append(estimate_tokens(block))
+
+    if not legacy_tokens:
+        print(f"Nenhum turno de usuário em {origin}.")
+        return
+
+    def describe(values: list[int]) -> str:
+        ordered = sorted(values)
+        return f"média {sum(values) / len(values):>7.0f}  p95 {ordered[int(0.95 * (len(ordered) - 1))]:>6}  máx {ordered[-1]:>6}"
+
+    total_legacy, total_budget = sum(legacy_tokens), sum(budget_tokens)
+    print(f"{len(legacy_tokens)} turnos em {len(conversations)} conversas — {origin}")
+    print(f"orçamento: {builder.budget_tokens} tokens\n")
+    print(f"legado (10 msgs inteiras)   {describe(legacy_tokens)}")
+    print(f"HistoryBuilder              {describe(budget_tokens)}")
+    print(f"\ntokens de histórico economizados: {total_legacy - total_budget} ({(total_legacy - total_budget) / total_legacy:.1%})")
+    print(f"montagem: {elapsed / len(budget_tokens) * 1e6:.0f} µs por turno")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark do caminho de escrita de mensagens (ConversationRepository.log_message).
+
+Compara a implementação antiga — ensure_conversation (SELECT + UPDATE/INSERT,
+commit) seguido de um INSERT em outra conexão (segundo commit) — com o
+caminho atual: UPSERT ... RETURNING + INSERT numa única transação, usando
+a conexão do pool.
+
+Uso (a partir de src/python):
+    python benchmarks/bench_log_message.py [--messages 2000] [--users 50]
+
+Roda sobre um banco temporário; o banco do projeto não é tocado.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def _legacy_log_message(db_path: Path, user_id: str, sender: str, content: str):
+    """Reprodução fiel do log_message anterior (duas conexões, dois commits)."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM conversations WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        if row:
+            conversation_id = row["id"]
+            cursor.execute("UPDATE conversations SET last_message_at = CURRENT_TIMESTAMP WHERE id = ?", (conversation_id,))
+        else:
+            cursor.execute("INSERT INTO conversations (user_id) VALUES (?)", (user_id,))
+            conversation_id = cursor.lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(
+            "INSERT INTO messages (conversation_id, sender, content, media_type, media_url) VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, sender, content, None, None),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _run(label: str, log_fn, messages: int, users: int) -> float:
+    start = time.perf_counter()
+    for i in range(messages):
+        user_id = f"wa:55970000{i % users:04d}"
+        log_fn(user_id, "user" if i % 2 == 0 else "agent", f"mensagem de teste {i}")
+    elapsed = time.perf_counter() - start
+    rate = messages / elapsed
+    print(f"{label:<10} {messages} mensagens em {elapsed:.3f}s → {rate:,.0f} msg/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix="bench_log_message_"))
+    legacy_db = tmp_dir / "legacy.sqlite"
+    current_db = tmp_dir / "current.sqlite"
+    legacy_db.touch()
+    current_db.touch()
+
+    # O pool lê DB_FILE no import de core.config — precisa vir antes dos imports.
+    os.environ["DB_FILE"] = str(current_db)
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from core.migrations import run_migrations
+    from core.repositories import ConversationRepository
+
+    run_migrations(legacy_db)
+    run_migrations(current_db)
+
+    print(f"SQLite {sqlite3.sqlite_version} | banco temporário em {tmp_dir}")
+    before = _run("antes", lambda u, s, c: _legacy_log_message(legacy_db, u, s, c), args.messages, args.users)
+    after = _run("depois", ConversationRepository.log_message, args.messages, args.users)
+    print(f"Ganho: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Tempo de startup do servidor: AGENT_LOADING_MODE=eager x lazy.
+
+Cada medição roda num processo novo (imports frios) e separa as fases do
+main.py:
+
+- import agno: agno.agent/team/os, modelo Gemini e SqliteDb;
+- import projeto: core.*, agents.factory, tools e services;
+- run_migrations;
+- load_agents: linhas do banco e construção dos agentes (no modo eager,
+  inclui importar o LanceDB e abrir uma tabela por agente);
+- 1ª delegação: abertura das bases que o modo lazy adiou (ensure_knowledge
+  em todos os membros, como no primeiro delegate_to_all_members).
+
+O banco e o diretório do LanceDB são temporários: --db CAMINHO copia um
+banco do projeto; sem --db, um banco sintético com --agents agentes de
+produção e --docs documentos de texto cada. A indexação fica desligada (KB_INGESTION_MODE=off) e o
+embedder é o fake, para medir só o startup, sem rede.
+
+Uso (a partir de src/python):
+    python benchmarks/bench_startup.py [--db ../../database.sqlite] [--agents 20] [--docs 3] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SCHEMA_SQL = ROOT.parents[1] / "database" / "migrations" / "001_initial_schema.sql"
+
+PHASES = ["import agno", "import projeto", "run_migrations", "load_agents", "1ª delegação"]
+
+
+def child() -> None:
+    """Runs main.py's startup phases and prints their durations as JSON."""
+    sys.path.insert(0, str(ROOT))
+    timings = {}
+
+    started = time.perf_counter()
+    import agno.agent  # noqa: F401
+    import agno.db.sqlite  # noqa: F401
+    import agno.models.google  # noqa: F401
+    import agno.os  # noqa: F401
+    import agno.team  # noqa: F401
+    timings["import agno"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    from agents.factory import load_agents
+    from core.migrations import run_migrations
+    import core.team  # noqa: F401
+    import services.analyzer  # noqa: F401
+    import tools.audio_gen  # noqa: F401
+    timings["import projeto"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    run_migrations()
+    timings["run_migrations"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    agents = load_agents()
+    timings["load_agents"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for agent in agents:
+        if hasattr(agent, "ensure_knowledge"):
+            agent.ensure_knowledge()
+    timings["1ª delegação"] = time.perf_counter() - started
+
+    print(json.dumps({"agents": len(agents), "timings": timings}))
+
+
+def seed(db_path: Path, agents: int, docs: int, docs_dir: Path) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA_SQL.read_text(encoding="utf-8"))
+    for agent_id in range(1, agents + 1):
+        conn.execute(
+            "INSERT INTO agents (id, subject, type, behaviour, details, status) VALUES (?, ?, ?, ?, ?, 'production')",
+            (agent_id, f"Assunto {agent_id}", "Fast" if agent_id % 2 else "Slow", "Responda com calma.", "Detalhes."),
+        )
+        for doc in range(docs):
+            path = docs_dir / f"agent{agent_id}_doc{doc}.txt"
+            path.write_text(f"Manual {agent_id}.{doc}: verifique a antena e o roteador.\n" * 50, encoding="utf-8")
+            # Caminho absoluto: _resolve_documents usa como está
+            conn.execute("INSERT INTO agent_documents (agent_id, filename) VALUES (?, ?)", (agent_id, str(path)))
+    conn.commit()
+    conn.close()
+
+
+def measure(mode: str, db_path: Path, vector_dir: Path) -> dict:
+    env = {
+        **os.environ,
+        "DB_FILE": str(db_path),
+        "AGENT_LOADING_MODE": mode,
+        "KB_INGESTION_MODE": "off",
+        "KB_EMBEDDER": "fake",
+        "VECTOR_DB_DIR": str(vector_dir / "lancedb"),
+        "EMBEDDING_CACHE_FILE": str(vector_dir / "embedding_cache.sqlite"),
+    }
+    proc = subprocess.run([sys.executable, __file__, "--child"], env=env, cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit(f"Startup ({mode}) falhou:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, help="banco do projeto a copiar (em vez do sintético)")
+    parser.add_argument("--agents", type=int, default=20)
+    parser.add_argument("--docs", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    work = Path(tempfile.mkdtemp(prefix="bench_startup_"))
+    try:
+        db_path = work / "startup.sqlite"
+        if args.db:
+            shutil.copyfile(args.db, db_path)
+        else:
+            docs_dir = work / "docs"
+            docs_dir.mkdir()
+            seed(db_path, args.agents, args.docs, docs_dir)
+
+        # Aquecimento: aplica as migrations para todas as medições pegarem o fast path
+        measure("lazy", db_path, work)
+
+        results = {}
+        for mode in ("eager", "lazy"):
+            runs = [measure(mode, db_path, work) for _ in range(args.repeat)]
+            results[mode] = {phase: statistics.median(run["timings"][phase] for run in runs) for phase in PHASES}
+            agents = runs[0]["agents"]
+
+        print(f"{agents} agentes, mediana de {args.repeat} execuções (segundos)\n")
+        print(f"{'fase':<16}{'eager':>10}{'lazy':>10}")
+        for phase in PHASES:
+            print(f"{phase:<16}{results['eager'][phase]:>10.3f}{results['lazy'][phase]:>10.3f}")
+        for mode in ("eager", "lazy"):
+            results[mode]["startup"] = sum(results[mode][phase] for phase in PHASES[:4])
+        print(f"{'startup (1-4)':<16}{results['eager']['startup']:>10.3f}{results['lazy']['startup']:>10.3f}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark da ingestão de uma entrega do webhook com 100 mensagens.
+
+Monta um payload no formato da WhatsApp Cloud API com várias entries e
+changes (cada change com várias mensagens e callbacks de status) e compara:
+
+- legado: só messages[0] de cada change, e para cada mensagem uma consulta
+  de deduplicação, um INSERT na fila e um registro de id visto — cada um
+  com seu próprio commit;
+- atual: um único parse, parse_webhook_payload em uma passada e
+  InboundMessageRepository.accept_batch — deduplicação, fila e ids vistos
+  numa só transação para a entrega inteira. Status nunca tocam o banco.
+
+Uso (a partir de src/python):
+    python benchmarks/bench_webhook_batch.py [--messages 100] [--users 20] [--rounds 50]
+
+Roda sobre um banco temporário; o banco do projeto não é tocado.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def build_payload(round_no: int, messages: int, users: int, entries: int = 5, changes: int = 4) -> dict:
+    """Webhook delivery with `messages` text messages spread over entries × changes, plus statuses."""
+    per_change = max(messages // (entries * changes), 1)
+    counter = 0
+    payload_entries = []
+    for e in range(entries):
+        payload_changes = []
+        for c in range(changes):
+            batch = []
+            statuses = []
+            for _ in range(per_change):
+                if counter >= messages:
+                    break
+                phone = f"55970000{counter % users:04d}"
+                batch.append({
+                    "from": phone,
+                    "id": f"wamid.bench.{round_no}.{counter}",
+                    "timestamp": str(int(time.time())),
+                    "type": "text",
+                    "text": {"body": f"mensagem {counter}"},
+                })
+                statuses.append({
+                    "id": f"wamid.out.{round_no}.{counter}",
+                    "status": "delivered" if counter % 3 else "read",
+                    "recipient_id": phone,
+                })
+                counter += 1
+            payload_changes.append({
+                "field": "messages",
+                "value": {"messaging_product": "whatsapp", "messages": batch, "statuses": statuses},
+            })
+        payload_entries.append({"id": f"waba-{e}", "changes": payload_changes})
+    return {"object": "whatsapp_business_account", "entry": payload_entries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix="bench_webhook_batch_"))
+    db_path = tmp_dir / "bench.sqlite"
+    db_path.touch()
+
+    # O pool lê DB_FILE no import de core.config — precisa vir antes dos imports.
+    os.environ["DB_FILE"] = str(db_path)
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from core.migrations import run_migrations
+    from core.database import get_db_connection, release_db_connection
+    from core.repositories import InboundMessageRepository
+    from utils.whatsapp.payload import loads_body, parse_webhook_payload
+
+    run_migrations(db_path)
+    ttl_start = 0.0
+
+    def legacy(raw: bytes) -> int:
+        body = json.loads(raw)
+        processed = 0
+        conn = get_db_connection()
+        try:
+            for entry in body.get("entry", []):
+                for change in entry.get("changes", []):
+                    messages = change.get("value", {}).get("messages", [])
+                    if not messages:
+                        continue
+                    message = messages[0]
+                    seen = conn.execute(
+                        "SELECT 1 FROM webhook_seen_ids WHERE message_id = ? AND seen_at >= ?", (message["id"], ttl_start)
+                    ).fetchone()
+                    if seen:
+                        continue
+                    InboundMessageRepository.enqueue(message)
+                    conn.execute("INSERT OR REPLACE INTO webhook_seen_ids VALUES (?, ?)", (message["id"], time.time()))
+                    conn.commit()
+                    processed += 1
+        finally:
+            release_db_connection(conn)
+        return processed
+
+    def current(raw: bytes) -> int:
+        batch = parse_webhook_payload(loads_body(raw))
+        all_messages = [m for messages in batch.messages_by_user.values() for m in messages]
+        return sum(1 for queued in InboundMessageRepository.accept_batch(all_messages, ttl_start) if queued)
+
+    results = {}
+    for label, fn, offset in (("legado", legacy, 0), ("atual", current, 1_000_000)):
+        payloads = [json.dumps(build_payload(offset + r, args.messages, args.users)).encode() for r in range(args.rounds)]
+        processed = 0
+        start = time.perf_counter()
+        for body in payloads:
+            processed += fn(body)
+        elapsed = time.perf_counter() - start
+        per_payload_ms = elapsed / args.rounds * 1000
+        results[label] = (per_payload_ms, processed / args.rounds)
+        print(
+            f"{label:<7} {processed / args.rounds:>5.0f}/{args.messages} mensagens processadas por entrega, "
+            f"{per_payload_ms:7.2f} ms por entrega"
+        )
+
+    # Reentrega do mesmo payload: tudo deve ser descartado como duplicata
+    redelivered = current(json.dumps(build_payload(1_000_000, args.messages, args.users)).encode())
+    print(f"reentrega: {redelivered} mensagens aceitas (esperado: 0)")
+    per_message = {label: ms / count for label, (ms, count) in results.items() if count}
+    print(f"custo por mensagem processada: legado {per_message['legado']:.3f} ms, atual {per_message['atual']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Verificação de regressão da ingestão incremental (agents/ingestion.py).
+
+Roda o KnowledgeIngestor contra um vector DB em memória que segue a regra
+do LanceDb.insert do agno 2.2: o id de cada chunk é o md5 do conteúdo e
+chunks com id já presente na tabela são pulados. Os documentos são
+divididos por parágrafo (no lugar do TextReader), com o FakeEmbedder, sem
+rede. Cenários, conferindo a tabela, os arquivos lidos e os textos
+embutidos depois de cada um:
+
+- indexação inicial de dois arquivos que compartilham um parágrafo;
+- edição parcial (um parágrafo de seis) de um dos arquivos: só ele é lido e
+  só o parágrafo novo é embutido;
+- banco vindo de antes de kb_ingestion_chunks (sem donos registrados): os
+  arquivos são relidos uma vez, sem embutir nada;
+- remoção do arquivo que "é dono" do parágrafo compartilhado: nada é lido;
+- nova execução sem mudanças (nada lido);
+- arquivo renomeado: nada lido, os chunks continuam.
+
+Uso (a partir de src/python):
+    python benchmarks/check_kb_ingestion.py
+
+Sai com código 1 se a tabela não tiver exatamente os parágrafos esperados
+ou se um arquivo sem mudança for relido.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_work = Path(tempfile.mkdtemp(prefix="check_kb_ingestion_"))
+_db_path = _work / "check.sqlite"
+os.environ["DB_FILE"] = str(_db_path)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from agents import ingestion  # noqa: E402
+from agents.embeddings import FakeEmbedder, IngestionEmbedder  # noqa: E402
+from agents.ingestion import KnowledgeIngestor, KnowledgeJob  # noqa: E402
+from core.migrations import TABLE_MIGRATIONS, run_migrations  # noqa: E402
+
+SHARED = "Parágrafo comum aos dois manuais: desligue e ligue o roteador."
+
+
+class AgnoLikeVectorDb:
+    """In-memory table with agno 2.2 LanceDb.insert semantics (id = md5(content), existing ids skipped)."""
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.rows = {}
+        self.created = False
+
+    def exists(self):
+        return self.created
+
+    def create(self):
+        self.created = True
+
+    def insert(self, content_hash, documents):
+        for doc in documents:
+            doc_id = hashlib.md5(doc.content.encode()).hexdigest()
+            if doc_id in self.rows:
+                continue
+            self.embedder.get_embedding(doc.content)
+            self.rows[doc_id] = (doc.content, doc.content_id, doc.name)
+
+    def delete_by_id(self, doc_id):
+        return self.rows.pop(doc_id, None) is not None
+
+    def content_hash_exists(self, content_hash):
+        return any(row[1] == content_hash for row in self.rows.values())
+
+    def name_exists(self, name):
+        return any(row[2] == name for row in self.rows.values())
+
+    def delete_by_name(self, name):
+        self.rows = {k: v for k, v in self.rows.items() if v[2] != name}
+
+    def delete_by_content_id(self, content_id):
+        self.rows = {k: v for k, v in self.rows.items() if v[1] != content_id}
+
+    def contents(self):
+        return sorted(row[0] for row in self.rows.values())
+
+
+class CountingEmbedder(FakeEmbedder):
+    """FakeEmbedder that records the texts it embedded."""
+
+    def get_embeddings_batch_and_usage(self, texts):
+        embedded.extend(texts)
+        return super().get_embeddings_batch_and_usage(texts)
+
+    def get_embedding_and_usage(self, text):
+        embedded.append(text)
+        return super().get_embedding_and_usage(text)
+
+
+embedded = []
+read = []
+
+
+def read_paragraphs(path_str):
+    path = Path(path_str)
+    read.append(path.name)
+    text = path.read_text(encoding="utf-8")
+    return [(p.strip(), path.name, {}) for p in text.split("\n\n") if p.strip()]
+
+
+def paragraphs(prefix, count):
+    return [f"{prefix} parágrafo {i}: verifique a antena e o cabo." for i in range(count)]
+
+
+def write(path, parts):
+    path.write_text("\n\n".join(parts), encoding="utf-8")
+    # mtime distinto mesmo em sistemas de arquivo com resolução de 1s
+    stamp = time.time() + write.calls
+    write.calls += 1
+    os.utime(path, (stamp, stamp))
+
+
+write.calls = 0
+
+
+def run(vector_db, embedder, files):
+    embedded.clear()
+    read.clear()
+    job = KnowledgeJob("kb_check", vector_db, embedder, files)
+    ingestor = KnowledgeIngestor(workers=1)
+    ingestor.add(job)
+    ingestor.run()
+    return job.counts
+
+
+def check(label, vector_db, expected, counts, reads=(), embeds=None):
+    actual = vector_db.contents()
+    ok = actual == sorted(set(expected)) and sorted(read) == sorted(reads)
+    if embeds is not None:
+        ok = ok and sorted(embedded) == sorted(embeds)
+    print(
+        f"{'OK  ' if ok else 'FAIL'} {label}: {len(actual)} chunks na tabela, esperados {len(set(expected))}, "
+        f"lidos {sorted(read)}, {len(embedded)} embutidos {dict(counts)}"
+    )
+    if not ok:
+        for missing in sorted(set(expected) - set(actual)):
+            print(f"       faltando: {missing}")
+        for extra in sorted(set(actual) - set(expected)):
+            print(f"       sobrando: {extra}")
+    return ok
+
+
+def main() -> int:
+    conn = sqlite3.connect(_db_path)
+    for _, create_sql in TABLE_MIGRATIONS:
+        conn.execute(create_sql)
+    conn.close()
+    run_migrations(_db_path)
+    ingestion.read_chunks = read_paragraphs
+
+    # Sem cache: um texto embutido de novo apareceria em `embedded`
+    embedder = IngestionEmbedder(inner=CountingEmbedder(dimensions=8))
+    vector_db = AgnoLikeVectorDb(embedder)
+    manual_a, manual_b = _work / "manual_a.txt", _work / "manual_b.txt"
+    both = ["manual_a.txt", "manual_b.txt"]
+
+    a = paragraphs("A", 5) + [SHARED]
+    b = paragraphs("B", 3) + [SHARED]
+    write(manual_a, a)
+    write(manual_b, b)
+    counts = run(vector_db, embedder, [manual_a, manual_b])
+    results = [check("indexação inicial", vector_db, a + b, counts, both, list(dict.fromkeys(a + b)))]
+
+    a[2] = "A parágrafo 2 (revisado): verifique também a fonte de energia."
+    write(manual_a, a)
+    counts = run(vector_db, embedder, [manual_a, manual_b])
+    results.append(check("edição parcial de A", vector_db, a + b, counts, ["manual_a.txt"], [a[2]]))
+
+    conn = sqlite3.connect(_db_path)
+    conn.execute("DELETE FROM kb_ingestion_chunks")
+    conn.commit()
+    conn.close()
+    counts = run(vector_db, embedder, [manual_a, manual_b])
+    results.append(check("donos não registrados", vector_db, a + b, counts, both, []) and counts["claimed"] == 2)
+
+    counts = run(vector_db, embedder, [manual_b])
+    results.append(check("remoção de A", vector_db, b, counts, [], []))
+
+    counts = run(vector_db, embedder, [manual_b])
+    results.append(check("sem mudanças", vector_db, b, counts, [], []) and not counts["indexed"])
+
+    manual_c = _work / "manual_c.txt"
+    manual_b.rename(manual_c)
+    counts = run(vector_db, embedder, [manual_c])
+    results.append(check("B renomeado para C", vector_db, b, counts, [], []) and counts["moved"] == 1)
+
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
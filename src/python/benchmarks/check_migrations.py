@@ -0,0 +1,106 @@
+"""
+Verificação do runner de migrations (core/migrations.py) num banco temporário.
+
+1. Um banco vazio chega à versão mais recente, e a segunda execução sai pelo
+   fast path.
+2. Uma migration de exemplo em lotes (chunk_size), que só mexe numa tabela
+   criada aqui, é interrompida no meio; a próxima execução retoma do
+   checkpoint gravado em schema_migrations e cada linha é processada uma
+   única vez.
+
+Nada toca o banco do projeto.
+
+Uso (a partir de src/python):
+    python benchmarks/check_migrations.py
+
+Sai com código 1 se alguma verificação falhar.
+"""
+
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core import migrations  # noqa: E402
+from core.migrations import LATEST_VERSION, Migration, run_migrations  # noqa: E402
+
+ROWS = 12_345
+CHUNK_SIZE = 1_000
+FAIL_AFTER_CHUNKS = 3
+
+
+class Interrupted(Exception):
+    pass
+
+
+def make_example(fail_after: Optional[int]):
+    """Chunked migration that increments sample.visits by id range; raises after fail_after lots."""
+    calls = 0
+
+    def apply(conn: sqlite3.Connection, after_id: Optional[int], chunk_size: int) -> Optional[int]:
+        nonlocal calls
+        calls += 1
+        if fail_after is not None and calls > fail_after:
+            raise Interrupted()
+        start = after_id or 0
+        if start >= conn.execute("SELECT MAX(id) FROM sample").fetchone()[0]:
+            return None
+        conn.execute("UPDATE sample SET visits = visits + 1 WHERE id > ? AND id <= ?", (start, start + chunk_size))
+        return start + chunk_size
+
+    return apply
+
+
+def main() -> int:
+    migrations.CHUNK_PAUSE_SECONDS = 0
+    failures = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "check.sqlite"
+        sqlite3.connect(db_path).close()
+
+        run_migrations(db_path)
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        version = migrations._get_current_version(conn)
+        if version != LATEST_VERSION:
+            failures.append(f"banco vazio ficou na versão {version}, esperado {LATEST_VERSION}")
+        run_migrations(db_path)
+
+        conn.execute("CREATE TABLE sample (id INTEGER PRIMARY KEY, visits INTEGER NOT NULL DEFAULT 0)")
+        conn.executemany("INSERT INTO sample (id) VALUES (?)", ((i,) for i in range(1, ROWS + 1)))
+
+        version = LATEST_VERSION + 1000
+        try:
+            migrations._apply_chunked_migration(
+                conn, Migration(version, "example_chunked", make_example(FAIL_AFTER_CHUNKS), CHUNK_SIZE)
+            )
+            failures.append("a migration de exemplo deveria ter sido interrompida")
+        except Interrupted:
+            pass
+        checkpoint, applied_at = conn.execute(
+            "SELECT checkpoint, applied_at FROM schema_migrations WHERE version = ?", (version,)
+        ).fetchone()
+        if checkpoint != FAIL_AFTER_CHUNKS * CHUNK_SIZE or applied_at is not None:
+            failures.append(f"checkpoint após a interrupção: {checkpoint} (applied_at {applied_at})")
+
+        migrations._apply_chunked_migration(conn, Migration(version, "example_chunked", make_example(None), CHUNK_SIZE))
+        applied_at = conn.execute("SELECT applied_at FROM schema_migrations WHERE version = ?", (version,)).fetchone()[0]
+        if applied_at is None:
+            failures.append("a migration de exemplo não foi marcada como aplicada")
+        counts = dict(conn.execute("SELECT visits, COUNT(*) FROM sample GROUP BY visits").fetchall())
+        if counts != {1: ROWS}:
+            failures.append(f"linhas por número de visitas: {counts} (esperado {{1: {ROWS}}})")
+        conn.close()
+
+    for failure in failures:
+        print(f"FALHOU: {failure}")
+    if not failures:
+        print("ok: banco vazio migrado, fast path, migration em lotes retomada do checkpoint")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
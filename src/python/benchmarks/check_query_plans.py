@@ -0,0 +1,143 @@
+"""
+Verificação de regressão dos planos de consulta (EXPLAIN QUERY PLAN).
+
+Cria um banco temporário com o schema das migrations, popula com
+--messages mensagens (padrão: 1 milhão) distribuídas entre --users
+conversas, roda run_migrations (índices + ANALYZE) e confere que cada
+consulta quente usa o índice esperado — sem SCAN na tabela messages.
+
+Uso (a partir de src/python):
+    python benchmarks/check_query_plans.py [--messages 1000000] [--users 2000]
+
+Sai com código 1 se algum plano regredir.
+"""
+
+import argparse
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.migrations import TABLE_MIGRATIONS, run_migrations  # noqa: E402
+
+# (descrição, SQL, parâmetros, índice que o plano precisa citar)
+HOT_QUERIES = [
+    (
+        "get_history (ORDER BY id)",
+        "SELECT sender, content FROM messages WHERE conversation_id = ? ORDER BY id DESC LIMIT 10",
+        (42,),
+        "idx_messages_conversation_id",
+    ),
+    (
+        "ConversationAnalyzer / CommunicationEvalTool (ORDER BY created_at)",
+        "SELECT sender, content FROM messages WHERE conversation_id = ? ORDER BY created_at DESC LIMIT 100",
+        (42,),
+        "idx_messages_conversation_created",
+    ),
+    (
+        "PHP countUnreadMessages",
+        "SELECT COUNT(*) FROM messages WHERE conversation_id = ? AND is_read = 0 AND sender = 'user'",
+        (42,),
+        "idx_messages_unread_user",
+    ),
+    (
+        "Dashboard: mensagens por dia (7 dias)",
+        "SELECT date(created_at) AS day, COUNT(*) FROM messages "
+        "WHERE created_at >= date('now', '-7 days') GROUP BY day ORDER BY day ASC",
+        (),
+        "idx_messages_created_covering",
+    ),
+    (
+        "Dashboard: tipos de mensagem (7 dias)",
+        "SELECT CASE WHEN media_type = 'audio' THEN 'audio' ELSE 'texto' END AS tipo, COUNT(*) "
+        "FROM messages WHERE created_at >= date('now', '-7 days') AND sender = 'user' GROUP BY tipo",
+        (),
+        "idx_messages_created_covering",
+    ),
+    (
+        "Dashboard: ativos hoje",
+        "SELECT COUNT(DISTINCT conversation_id) FROM messages WHERE created_at >= date('now')",
+        (),
+        "idx_messages_created_covering",
+    ),
+    (
+        "Dashboard: contatos por dia (30 dias)",
+        "SELECT date(last_message_at) AS day, COUNT(*) FROM conversations "
+        "WHERE last_message_at >= date('now', '-30 days') GROUP BY day ORDER BY day ASC",
+        (),
+        "idx_conversations_last_message_at",
+    ),
+]
+
+
+def _seed(db_path: Path, messages: int, users: int) -> None:
+    conn = sqlite3.connect(db_path)
+    for _, create_sql in TABLE_MIGRATIONS:
+        conn.execute(create_sql)
+
+    rng = random.Random(1234)
+    conn.executemany(
+        "INSERT INTO conversations (id, user_id, last_message_at) VALUES (?, ?, datetime('now', ?))",
+        ((i, f"wa:5597{i:08d}", f"-{rng.randint(0, 90)} days") for i in range(1, users + 1)),
+    )
+
+    def rows():
+        for i in range(messages):
+            sender = "user" if i % 2 == 0 else "agent"
+            media = "audio" if i % 17 == 0 else None
+            yield (rng.randint(1, users), sender, f"mensagem {i}", media, 1 if rng.random() < 0.9 else 0,
+                   f"-{rng.randint(0, 60 * 24 * 120)} minutes")
+
+    conn.executemany(
+        "INSERT INTO messages (conversation_id, sender, content, media_type, is_read, created_at) "
+        "VALUES (?, ?, ?, ?, ?, datetime('now', ?))",
+        rows(),
+    )
+    conn.commit()
+    conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+
+    db_path = Path(tempfile.mkdtemp(prefix="check_query_plans_")) / "plans.sqlite"
+
+    start = time.perf_counter()
+    _seed(db_path, args.messages, args.users)
+    print(f"Banco populado com {args.messages:,} mensagens em {time.perf_counter() - start:.1f}s")
+
+    run_migrations(db_path)
+
+    conn = sqlite3.connect(db_path)
+    failures = 0
+    for label, sql, params, expected_index in HOT_QUERIES:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        plan_text = " | ".join(plan)
+        # SCAN (mesmo "USING INDEX") percorre a tabela/índice inteiro
+        full_scan = any(step.startswith("SCAN messages") for step in plan)
+        ok = expected_index in plan_text and not full_scan
+
+        t0 = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+
+        status = "OK  " if ok else "FAIL"
+        print(f"[{status}] {label} ({elapsed_ms:.1f} ms)\n        {plan_text}")
+        if not ok:
+            print(f"        esperado: {expected_index}")
+            failures += 1
+    conn.close()
+
+    print(f"\n{len(HOT_QUERIES) - failures}/{len(HOT_QUERIES)} planos usando os índices esperados")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
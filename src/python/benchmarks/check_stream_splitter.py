@@ -0,0 +1,92 @@
+"""
+Verificação do WhatsAppStreamSplitter (utils/markdown_to_whatsapp.py).
+
+Para respostas completas, o envio em streaming tem que mandar exatamente as
+mesmas mensagens do envio normal, split_for_whatsapp(markdown_to_whatsapp(
+resposta)), seja qual for o tamanho dos pedaços que o modelo gera. Confere
+também que uma resposta curta sai em uma mensagem só e que um título no fim
+de um grupo segue com o parágrafo seguinte.
+
+Uso (a partir de src/python):
+    python benchmarks/check_stream_splitter.py
+
+Sai com código 1 se alguma resposta divergir.
+"""
+
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.markdown_to_whatsapp import WhatsAppStreamSplitter, markdown_to_whatsapp, split_for_whatsapp  # noqa: E402
+
+SHORT_REPLY = """Olá, Maria! Tudo bem?
+
+Vamos resolver isso juntos. Siga os passos abaixo para reiniciar o roteador.
+
+**Passos:**
+
+1. Desligue o roteador da tomada.
+2. Espere 30 segundos.
+3. Ligue de novo e aguarde as luzes.
+
+Qualquer coisa, é só me chamar!"""
+
+
+def long_reply(seed: int) -> str:
+    rng = random.Random(seed)
+    parts = []
+    for section in range(8):
+        parts.append(f"## Seção {section}")
+        for _ in range(rng.randint(1, 4)):
+            parts.append(" ".join(["Verifique a antena e o cabo da fonte."] * rng.randint(2, 30)))
+        if rng.random() < 0.5:
+            parts.append("Passos:")
+            parts.append("\n".join(f"- item {i} com **destaque**" for i in range(rng.randint(2, 6))))
+        if rng.random() < 0.3:
+            parts.append("```python\nprint('a')\n\nprint('b')\n```")
+    return "\n\n".join(parts)
+
+
+def stream(reply: str, max_chars: int, rng: random.Random) -> list:
+    splitter = WhatsAppStreamSplitter(max_chars)
+    out, i = [], 0
+    while i < len(reply):
+        step = rng.randint(1, 40)
+        out.extend(splitter.feed(reply[i:i + step]))
+        i += step
+    out.extend(splitter.flush())
+    return out
+
+
+def main() -> int:
+    rng = random.Random(0)
+    failures = 0
+    cases = [("resposta curta", SHORT_REPLY)] + [(f"resposta longa {seed}", long_reply(seed)) for seed in range(30)]
+    for label, reply in cases:
+        for max_chars in (200, 500, 1200):
+            expected = split_for_whatsapp(markdown_to_whatsapp(reply), max_chars)
+            for _ in range(5):
+                actual = stream(reply, max_chars, rng)
+                if actual != expected:
+                    failures += 1
+                    print(f"FAIL {label} (max_chars={max_chars}): {len(actual)} mensagens, esperadas {len(expected)}")
+                    break
+
+    short = stream(SHORT_REPLY, 1200, rng)
+    if len(short) != 1:
+        failures += 1
+        print(f"FAIL resposta curta: {len(short)} mensagens, esperada 1")
+
+    held = split_for_whatsapp(markdown_to_whatsapp("a" * 150 + "\n\n## Passos\n\n" + "b" * 100), 200)
+    if held != ["a" * 150, "_Passos_\n\n" + "b" * 100]:
+        failures += 1
+        print(f"FAIL título no fim do grupo: {held}")
+
+    print("OK" if not failures else f"{failures} falhas")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
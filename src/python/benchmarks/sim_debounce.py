@@ -0,0 +1,180 @@
+"""
+Simulador de replay das políticas de debounce (utils/whatsapp/debounce.py).
+
+Reproduz uma sequência de mensagens recebidas (usuário, horário de envio,
+texto) contra cada política, como o router faz: observe() a cada mensagem e
+window() para decidir a espera; se a próxima mensagem do usuário chega
+depois da janela, o lote é entregue ao agente (uma execução do Team).
+
+Para cada política mostra:
+- execuções do agente e quantas foram economizadas em relação a responder
+  cada mensagem separadamente e à política fixa;
+- espera média/p95 após a última mensagem do lote (latência adicionada);
+- reexecuções: lotes entregues com o usuário ainda digitando (outra
+  mensagem chegou até --rerun-secs depois do flush).
+
+Fontes de timestamps:
+- --db CAMINHO: tabela inbound_messages de um banco do projeto (mensagens
+  das últimas INBOUND_RETENTION_HOURS), lida em modo somente leitura;
+- --csv CAMINHO: colunas user_id,timestamp[,text] (epoch em segundos);
+- sem fonte: tráfego sintético determinístico (--users, --seed).
+
+Uso (a partir de src/python):
+    python benchmarks/sim_debounce.py [--db ../../database.sqlite | --csv msgs.csv] [--users 300]
+"""
+
+import argparse
+import csv
+import json
+import random
+import sqlite3
+import sys
+from pathlib import Path
+
+Event = tuple[str, float, dict]
+
+
+def _text_message(timestamp: float, body: str) -> dict:
+    return {"type": "text", "timestamp": str(int(timestamp)), "text": {"body": body}}
+
+
+def load_inbound(db_path: Path) -> list[Event]:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT user_id, payload, received_at FROM inbound_messages ORDER BY received_at").fetchall()
+    finally:
+        conn.close()
+    events = []
+    for user_id, payload, received_at in rows:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            continue
+        message.setdefault("timestamp", str(int(received_at)))
+        events.append((user_id, float(message["timestamp"]), message))
+    return events
+
+
+def load_csv(csv_path: Path) -> list[Event]:
+    events = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not row or row[0] == "user_id":
+                continue
+            timestamp = float(row[1])
+            events.append((row[0], timestamp, _text_message(timestamp, row[2] if len(row) > 2 else "")))
+    return events
+
+
+def synthetic(users: int, seed: int, sessions: int = 6) -> list[Event]:
+    """
+    Users with different typing rhythms (median gap inside a burst from ~1 s
+    to ~15 s). Each session has a few "thoughts" split into several messages;
+    between thoughts the user waits for the reply, between sessions hours pass.
+    """
+    rng = random.Random(seed)
+    events = []
+    for u in range(users):
+        user_id = f"55970000{u:04d}"
+        median_gap = rng.lognormvariate(1.1, 0.7)  # ~3 s, de ~1 s a ~15 s
+        t = 1_700_000_000 + rng.uniform(0, 3600)
+        for _ in range(sessions):
+            for _ in range(rng.randint(1, 4)):
+                burst = 1
+                while rng.random() < 0.6 and burst < 8:
+                    burst += 1
+                for i in range(burst):
+                    if i:
+                        t += rng.lognormvariate(0, 0.6) * median_gap
+                    last = i == burst - 1
+                    ending = "?" if last and rng.random() < 0.4 else ("." if rng.random() < 0.15 else "")
+                    events.append((user_id, float(int(t)), _text_message(t, f"parte {i}{ending}")))
+                t += rng.uniform(20, 90)  # lendo a resposta do agente
+            t += rng.uniform(2, 48) * 3600
+    events.sort(key=lambda e: e[1])
+    return events
+
+
+def simulate(policy, events: list[Event], rerun_secs: float) -> dict:
+    by_user: dict[str, list[tuple[float, dict]]] = {}
+    for user_id, timestamp, message in events:
+        by_user.setdefault(user_id, []).append((timestamp, message))
+
+    runs = reruns = 0
+    waits: list[float] = []
+    for user_id, messages in by_user.items():
+        messages.sort(key=lambda m: m[0])
+        for i, (timestamp, message) in enumerate(messages):
+            policy.observe(user_id, timestamp)
+            wait_secs = policy.window(user_id, message)
+            next_at = messages[i + 1][0] if i + 1 < len(messages) else None
+            if next_at is not None and next_at <= timestamp + wait_secs:
+                continue  # timer reiniciado pela próxima mensagem
+            runs += 1
+            waits.append(wait_secs)
+            if next_at is not None and next_at - (timestamp + wait_secs) <= rerun_secs:
+                reruns += 1
+
+    waits.sort()
+    return {
+        "runs": runs,
+        "reruns": reruns,
+        "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+        "p95_wait": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--db", type=Path)
+    source.add_argument("--csv", type=Path)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--rerun-secs", type=float, default=15.0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from core.config import DEBOUNCE_MAX_SECONDS, DEBOUNCE_MIN_SECONDS
+    from utils.whatsapp.debounce import AdaptiveDebouncePolicy, FixedDebouncePolicy
+
+    if args.db:
+        events, origin = load_inbound(args.db), f"inbound_messages de {args.db}"
+    elif args.csv:
+        events, origin = load_csv(args.csv), str(args.csv)
+    else:
+        events, origin = synthetic(args.users, args.seed), f"sintético ({args.users} usuários, seed {args.seed})"
+    if not events:
+        print(f"Nenhuma mensagem em {origin}.")
+        return
+
+    def fixed():
+        return FixedDebouncePolicy(4.0, 0.8)
+
+    policies = [
+        ("sem debounce", FixedDebouncePolicy(0.0, 0.0)),
+        ("fixa 4s/0.8s", fixed()),
+    ]
+    for quantile in (0.8, 0.9, 0.95):
+        policies.append((
+            f"adaptativa q={quantile}",
+            AdaptiveDebouncePolicy(fallback=fixed(), quantile=quantile, persist=False),
+        ))
+
+    print(f"{len(events)} mensagens de {len({e[0] for e in events})} usuários — {origin}")
+    print(f"limites da adaptativa: [{DEBOUNCE_MIN_SECONDS}s, {DEBOUNCE_MAX_SECONDS}s]\n")
+    print(f"{'política':<22}{'execuções':>10}{'msg/exec':>10}{'economia':>10}{'reexec.':>9}{'espera média':>14}{'p95':>8}")
+    baseline = None
+    for label, policy in policies:
+        result = simulate(policy, events, args.rerun_secs)
+        if label.startswith("fixa"):
+            baseline = result["runs"]
+        saved = f"{(baseline - result['runs']) / baseline:+.1%}" if baseline and not label.startswith("fixa") else "-"
+        print(
+            f"{label:<22}{result['runs']:>10}{len(events) / result['runs']:>10.2f}{saved:>10}"
+            f"{result['reruns']:>9}{result['avg_wait']:>13.1f}s{result['p95_wait']:>7.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
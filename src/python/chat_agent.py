@@ -99,6 +99,9 @@ def main():
         try:
             
             from agno.knowledge.reader.pdf_reader import PDFReader
+            from agents.chunking import read_chunks
+            from agents.embedding_cache import embedding_cache
+            from agents.embeddings import IngestionEmbedder
             
             # Drop table to ensure correct dimensions
             import lancedb
@@ -107,10 +110,15 @@ def main():
             # lancedb path
             lancedb_path = os.path.abspath("tmp/lancedb_agent_forge")
 
+            # Cache compartilhado com o servidor: chunks já embutidos não vão à API de novo
+            embedder = IngestionEmbedder(
+                inner=GeminiEmbedder(id="models/text-embedding-004", dimensions=768),
+                cache=embedding_cache,
+            )
             vector_db = LanceDb(
                 table_name="agent_docs",
                 uri=lancedb_path,
-                embedder=GeminiEmbedder(id="models/text-embedding-004", dimensions=768),
+                embedder=embedder,
             )
             
             knowledge_base = Knowledge(
@@ -123,11 +131,18 @@ def main():
                     kb_path = os.path.abspath(kb_file)
                     if os.path.exists(kb_path):
                         logging.debug(f"Adding to KB: {kb_path}")
-                        knowledge_base.add_content(path=kb_path, reader=PDFReader(chunk=True), skip_if_exists=True)
+                        # O cache só vale no prepare(): embute os chunks antes, o insert só os retira
+                        texts = [content for content, _, _ in read_chunks(kb_path)] if kb_path.lower().endswith(".pdf") else []
+                        try:
+                            embedder.prepare(texts)
+                            knowledge_base.add_content(path=kb_path, reader=PDFReader(chunk=True), skip_if_exists=True)
+                        finally:
+                            embedder.discard(texts)
                     else:
                         logging.warning(f"KB file not found: {kb_path}")
                 except Exception as e:
                     logging.error(f"Error adding KB file {kb_file}: {e}")
+            logging.debug(f"Embedding cache: {embedding_cache.metrics()}")
 
         except Exception as e:
             # Log error but continue without KB if it fails
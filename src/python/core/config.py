@@ -22,7 +22,151 @@ _db_file_default = "database_prod.sqlite" if _app_env == "production" else "data
 _db_file = os.getenv("DB_FILE", _db_file_default)
 DB_PATH = PROJECT_ROOT / _db_file
 
-VECTOR_DB_PATH = PROJECT_ROOT / "lancedb_data"
+VECTOR_DB_PATH = PROJECT_ROOT / os.getenv("VECTOR_DB_DIR", "lancedb_data")
+
+# Ajustes do pool de conexões SQLite (ver core/database.py).
+# O arquivo é compartilhado com o dashboard PHP, por isso o busy_timeout
+# precisa cobrir as escritas concorrentes dele.
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()
+DB_HEALTH_CHECK_SECONDS = float(os.getenv("DB_HEALTH_CHECK_SECONDS", "30"))
+# Threads dedicados às consultas feitas a partir do event loop (AsyncConversationRepository).
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "1"))
+
+# Write-behind do log de mensagens (ver MessageLogBuffer em core/repositories.py).
+# Desligado por padrão: cada log_message grava e faz commit na hora.
+MESSAGE_LOG_WRITE_BEHIND = os.getenv("MESSAGE_LOG_WRITE_BEHIND", "false").strip('"').lower() in ("1", "true", "yes")
+MESSAGE_LOG_BATCH_SIZE = int(os.getenv("MESSAGE_LOG_BATCH_SIZE", "50"))
+MESSAGE_LOG_FLUSH_MS = int(os.getenv("MESSAGE_LOG_FLUSH_MS", "200"))
+# Lote que falha é retentado com backoff exponencial; esgotadas as tentativas,
+# grava linha a linha e descarta (com log) só as que continuarem falhando
+MESSAGE_LOG_MAX_RETRIES = int(os.getenv("MESSAGE_LOG_MAX_RETRIES", "5"))
+# Acima disso, quem chama log_message grava o buffer na hora (contrapressão)
+MESSAGE_LOG_MAX_PENDING = int(os.getenv("MESSAGE_LOG_MAX_PENDING", "5000"))
+
+# Cache em memória do estado por usuário (ai_status + LGPD). Quem muda esse
+# estado (dashboard PHP, outro worker) incrementa conversation_state_version
+# em system_settings; cada worker confere o contador a cada
+# CONVERSATION_STATE_VERSION_CHECK_SECONDS. O TTL é só uma rede de segurança.
+CONVERSATION_STATE_TTL_SECONDS = float(os.getenv("CONVERSATION_STATE_TTL_SECONDS", "30"))
+CONVERSATION_STATE_CACHE_SIZE = int(os.getenv("CONVERSATION_STATE_CACHE_SIZE", "10000"))
+CONVERSATION_STATE_VERSION_CHECK_SECONDS = float(os.getenv("CONVERSATION_STATE_VERSION_CHECK_SECONDS", "1"))
+
+# ── WhatsApp Graph API (ver utils/whatsapp/client.py) ─────────────────────────
+# Um único AsyncClient com pool de conexões é compartilhado por todos os
+# envios, uploads e downloads. WHATSAPP_GRAPH_BASE_URL permite apontar para
+# um servidor local (stub) em testes.
+WHATSAPP_GRAPH_BASE_URL = os.getenv("WHATSAPP_GRAPH_BASE_URL", "https://graph.facebook.com").rstrip("/")
+WHATSAPP_API_VERSION = os.getenv("WHATSAPP_API_VERSION", "v22.0")
+WHATSAPP_HTTP_MAX_CONNECTIONS = int(os.getenv("WHATSAPP_HTTP_MAX_CONNECTIONS", "20"))
+WHATSAPP_HTTP_MAX_KEEPALIVE = int(os.getenv("WHATSAPP_HTTP_MAX_KEEPALIVE", "10"))
+WHATSAPP_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("WHATSAPP_HTTP_KEEPALIVE_EXPIRY", "60"))
+WHATSAPP_HTTP_TIMEOUT = float(os.getenv("WHATSAPP_HTTP_TIMEOUT", "20"))
+WHATSAPP_HTTP_CONNECT_TIMEOUT = float(os.getenv("WHATSAPP_HTTP_CONNECT_TIMEOUT", "5"))
+# Tentativas extras em 429/5xx/erros de rede, com backoff exponencial (segundos).
+# Envios de mensagem (POST não idempotente) só repetem erro de conexão e 429.
+WHATSAPP_HTTP_MAX_RETRIES = int(os.getenv("WHATSAPP_HTTP_MAX_RETRIES", "3"))
+WHATSAPP_HTTP_BACKOFF_BASE = float(os.getenv("WHATSAPP_HTTP_BACKOFF_BASE", "0.5"))
+WHATSAPP_HTTP_BACKOFF_MAX = float(os.getenv("WHATSAPP_HTTP_BACKOFF_MAX", "8"))
+# Tamanho máximo de uma mídia recebida; anexos maiores são ignorados
+WHATSAPP_MEDIA_MAX_BYTES = int(os.getenv("WHATSAPP_MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Agendador das execuções do agente (ver utils/whatsapp/scheduler.py):
+# uma fila FIFO por usuário e um teto global de execuções simultâneas do Team.
+# Acima dos limites de pendência o trabalho novo é descartado e o usuário avisado.
+WHATSAPP_MAX_CONCURRENT_RUNS = int(os.getenv("WHATSAPP_MAX_CONCURRENT_RUNS", "8"))
+WHATSAPP_MAX_PENDING_RUNS = int(os.getenv("WHATSAPP_MAX_PENDING_RUNS", "200"))
+WHATSAPP_MAX_PENDING_PER_USER = int(os.getenv("WHATSAPP_MAX_PENDING_PER_USER", "5"))
+
+# Despachante de envios (ver utils/whatsapp/dispatcher.py). A Cloud API aceita
+# 80 mensagens/s por número por padrão; o pacing espaça as mensagens de um
+# mesmo usuário para simular ritmo humano.
+WHATSAPP_SEND_RATE = float(os.getenv("WHATSAPP_SEND_RATE", "80"))
+WHATSAPP_SEND_BURST = int(os.getenv("WHATSAPP_SEND_BURST", "20"))
+WHATSAPP_SEND_PACING_SECONDS = float(os.getenv("WHATSAPP_SEND_PACING_SECONDS", "0.6"))
+# Quantos ids de mensagens enviadas ficam guardados para casar com os status
+WHATSAPP_DELIVERY_TRACK_SIZE = int(os.getenv("WHATSAPP_DELIVERY_TRACK_SIZE", "10000"))
+
+# Fila persistente de mensagens recebidas (ver InboundMessageRepository).
+# Um lote em processamento mantém um lease renovado periodicamente; se o
+# processo cair, o lease expira e outro worker (ou o próximo startup) retoma.
+INBOUND_LEASE_SECONDS = float(os.getenv("INBOUND_LEASE_SECONDS", "60"))
+INBOUND_SWEEP_SECONDS = float(os.getenv("INBOUND_SWEEP_SECONDS", "15"))
+INBOUND_MAX_ATTEMPTS = int(os.getenv("INBOUND_MAX_ATTEMPTS", "3"))
+# Mensagens processadas ficam guardadas por este período (idempotência)
+INBOUND_RETENTION_HOURS = float(os.getenv("INBOUND_RETENTION_HOURS", "24"))
+
+# Deduplicação do webhook (ver utils/whatsapp/dedup.py): LRU em memória na
+# frente da tabela webhook_seen_ids. A Meta reentrega webhooks por até 7 dias.
+WEBHOOK_DEDUP_CACHE_SIZE = int(os.getenv("WEBHOOK_DEDUP_CACHE_SIZE", "20000"))
+WEBHOOK_DEDUP_TTL_HOURS = float(os.getenv("WEBHOOK_DEDUP_TTL_HOURS", "168"))
+# Orçamento do ack do webhook: se a gravação na fila passar disso, o 200 sai
+# antes e a gravação termina em background (a Meta reentrega após timeout).
+WEBHOOK_ACK_BUDGET_MS = float(os.getenv("WEBHOOK_ACK_BUDGET_MS", "1000"))
+# Debounce do webhook (ver utils/whatsapp/debounce.py): "fixed" usa
+# MESSAGE_DEBOUNCE_SECONDS; "adaptive" aprende o intervalo entre mensagens de
+# cada usuário. "fixed" é o padrão até o adaptativo ser calibrado: no
+# sim_debounce, com os limites atuais, ele economiza execuções mas quase
+# triplica a espera média (p95 de 4s para 12s).
+DEBOUNCE_POLICY = os.getenv("DEBOUNCE_POLICY", "fixed").strip().lower()
+DEBOUNCE_MIN_SECONDS = float(os.getenv("DEBOUNCE_MIN_SECONDS", "0.8"))
+DEBOUNCE_MAX_SECONDS = float(os.getenv("DEBOUNCE_MAX_SECONDS", "12"))
+# Fração dos intervalos dentro de uma rajada que a janela deve cobrir
+DEBOUNCE_QUANTILE = float(os.getenv("DEBOUNCE_QUANTILE", "0.9"))
+# Intervalos maiores que isso começam uma nova conversa e não entram no modelo
+DEBOUNCE_SESSION_GAP_SECONDS = float(os.getenv("DEBOUNCE_SESSION_GAP_SECONDS", "60"))
+DEBOUNCE_MIN_SAMPLES = int(os.getenv("DEBOUNCE_MIN_SAMPLES", "5"))
+# Follow-up durante uma execução do agente (ver utils/whatsapp/followup.py):
+# "merge" cancela a execução em andamento e reexecuta com as mensagens antigas
+# + a nova; "off" deixa terminar e responde a nova depois.
+RUN_FOLLOWUP_POLICY = os.getenv("RUN_FOLLOWUP_POLICY", "merge").strip().lower()
+# Só cancela execuções iniciadas há no máximo isso (as mais longas estão quase no fim)
+RUN_FOLLOWUP_WINDOW_SECONDS = float(os.getenv("RUN_FOLLOWUP_WINDOW_SECONDS", "30"))
+# Envia a resposta do Team parágrafo a parágrafo, à medida que é gerada
+WHATSAPP_STREAM_RESPONSES = os.getenv("WHATSAPP_STREAM_RESPONSES", "false").strip().lower() in ("1", "true", "yes")
+
+# Histórico injetado no prompt do ParenteTeam (ver core/history.py)
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "20"))
+# Orçamento de tokens (estimados) do bloco de histórico inteiro
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))
+# Mensagens mais recentes mantidas por inteiro (até HISTORY_RECENT_MAX_TOKENS cada)
+HISTORY_RECENT_MESSAGES = int(os.getenv("HISTORY_RECENT_MESSAGES", "4"))
+HISTORY_RECENT_MAX_TOKENS = int(os.getenv("HISTORY_RECENT_MAX_TOKENS", "250"))
+# As mais antigas viram um resumo de até HISTORY_OLD_MAX_TOKENS
+HISTORY_OLD_MAX_TOKENS = int(os.getenv("HISTORY_OLD_MAX_TOKENS", "60"))
+
+# "lazy" (padrão) monta os agentes só com a linha do banco e abre a tabela do
+# LanceDB/base de conhecimento na primeira delegação (ver agents/lazy.py);
+# "eager" abre tudo no startup.
+AGENT_LOADING_MODE = os.getenv("AGENT_LOADING_MODE", "lazy").strip().lower()
+# Se a abertura falhar, o agente responde sem a base e a próxima delegação
+# tenta de novo depois desse intervalo, que dobra a cada falha até o máximo
+AGENT_KNOWLEDGE_RETRY_SECONDS = float(os.getenv("AGENT_KNOWLEDGE_RETRY_SECONDS", "30"))
+AGENT_KNOWLEDGE_RETRY_MAX_SECONDS = float(os.getenv("AGENT_KNOWLEDGE_RETRY_MAX_SECONDS", "600"))
+
+# Ingestão da base de conhecimento dos agentes (ver agents/ingestion.py):
+# "background" sobe os agentes na hora e indexa em paralelo; "blocking"
+# espera a indexação no startup (comportamento antigo); "off" não indexa.
+KB_INGESTION_MODE = os.getenv("KB_INGESTION_MODE", "background").strip().lower()
+# Processos que leem e dividem os documentos (PDF/texto) em chunks
+KB_INGESTION_WORKERS = int(os.getenv("KB_INGESTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Chunks por chamada ao embedder (o batchEmbedContents do Gemini aceita até 100)
+KB_EMBED_BATCH_SIZE = int(os.getenv("KB_EMBED_BATCH_SIZE", "100"))
+# Chamadas de lote simultâneas ao embedder, somando todos os agentes
+KB_EMBED_CONCURRENCY = int(os.getenv("KB_EMBED_CONCURRENCY", "4"))
+# Tentativas por lote em 429/5xx; o 429 pausa todas as chamadas (backoff exponencial)
+KB_EMBED_MAX_ATTEMPTS = int(os.getenv("KB_EMBED_MAX_ATTEMPTS", "6"))
+KB_EMBED_BACKOFF_BASE = float(os.getenv("KB_EMBED_BACKOFF_BASE", "2.0"))
+KB_EMBED_BACKOFF_MAX = float(os.getenv("KB_EMBED_BACKOFF_MAX", "60.0"))
+# "gemini" (padrão) ou "fake": vetores determinísticos locais, para testar a
+# ingestão sem rede (ver FakeEmbedder em agents/embeddings.py)
+KB_EMBEDDER = os.getenv("KB_EMBEDDER", "gemini").strip().lower()
+# Cache persistente de embeddings (ver agents/embedding_cache.py). Fica num
+# arquivo SQLite próprio, fora do banco compartilhado com o dashboard PHP.
+EMBEDDING_CACHE_PATH = PROJECT_ROOT / os.getenv("EMBEDDING_CACHE_FILE", "lancedb_data/embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
 
 print(f"[config] APP_ENV={_app_env} | DB={DB_PATH.name}")
 
@@ -1,17 +1,202 @@
+import asyncio
+import functools
+import os
 import sqlite3
-from typing import Optional
-from .config import DB_PATH
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional
 
-def get_db_connection() -> Optional[sqlite3.Connection]:
-    """Establishes a connection to the SQLite database."""
-    if not DB_PATH.exists():
-        print(f"Error: Database not found at {DB_PATH}")
-        return None
-    
-    try:
-        conn = sqlite3.connect(DB_PATH)
+from .config import (
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB,
+    DB_EXECUTOR_WORKERS,
+    DB_HEALTH_CHECK_SECONDS,
+    DB_MMAP_SIZE,
+    DB_PATH,
+    DB_SYNCHRONOUS,
+)
+
+
+def _apply_pragmas(conn: sqlite3.Connection) -> None:
+    """Applies the connection tuning shared by every pooled connection."""
+    # WAL lets the PHP dashboard keep reading while the bot writes.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    # Negative cache_size is expressed in KiB instead of pages.
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+class ConnectionPool:
+    """
+    Keeps one long-lived SQLite connection per thread.
+
+    The asyncio event loop runs on a single thread, so every coroutine on it
+    shares the same connection; worker threads get their own. Connections are
+    opened lazily, tuned once, health-checked before reuse and discarded after
+    a fork (uvicorn reload / multiple workers).
+    """
+
+    def __init__(self, db_path: Path, health_check_seconds: float = DB_HEALTH_CHECK_SECONDS):
+        self.db_path = Path(db_path)
+        self.health_check_seconds = health_check_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: list[sqlite3.Connection] = []
+        self._pid = os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Each connection is only used by the thread that opened it;
+        # check_same_thread is relaxed so close_all() can run from any thread.
+        conn = sqlite3.connect(
+            str(self.db_path),
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+        )
         conn.row_factory = sqlite3.Row
+        _apply_pragmas(conn)
+        with self._lock:
+            self._connections.append(conn)
         return conn
-    except sqlite3.Error as e:
-        print(f"Error connecting to database: {e}")
-        return None
+
+    def _is_healthy(self, conn: sqlite3.Connection, last_checked: float) -> bool:
+        try:
+            # Raises ProgrammingError if someone closed the connection.
+            conn.total_changes
+            if time.monotonic() - last_checked >= self.health_check_seconds:
+                conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _reset_after_fork(self) -> None:
+        # Connections inherited from the parent process must not be reused.
+        self._local = threading.local()
+        with self._lock:
+            self._connections = []
+        self._pid = os.getpid()
+
+    def acquire(self) -> Optional[sqlite3.Connection]:
+        """Borrows this thread's connection, opening or replacing it if needed."""
+        if os.getpid() != self._pid:
+            self._reset_after_fork()
+
+        local = self._local
+        conn = getattr(local, "conn", None)
+
+        if conn is not None and not self._is_healthy(conn, local.checked_at):
+            self._discard(conn)
+            conn = None
+
+        if conn is None:
+            if not self.db_path.exists():
+                print(f"Error: Database not found at {self.db_path}")
+                return None
+            try:
+                conn = self._connect()
+            except sqlite3.Error as e:
+                print(f"Error connecting to database: {e}")
+                return None
+            local.conn = conn
+            local.depth = 0
+
+        local.checked_at = time.monotonic()
+        local.depth += 1
+        return conn
+
+    def release(self, conn: Optional[sqlite3.Connection]) -> None:
+        """
+        Returns a borrowed connection. When the outermost borrower releases it,
+        any transaction left open by an error path is rolled back so the next
+        borrower starts clean.
+        """
+        local = self._local
+        if conn is None or getattr(local, "conn", None) is not conn:
+            return
+
+        local.depth = max(local.depth - 1, 0)
+        if local.depth == 0:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                self._discard(conn)
+                local.conn = None
+
+    def close_all(self) -> None:
+        """Closes every connection opened by the pool (used on shutdown)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+_pool = ConnectionPool(DB_PATH)
+
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool for DB_PATH."""
+    return _pool
+
+
+def get_db_connection() -> Optional[sqlite3.Connection]:
+    """Borrows a pooled connection to the SQLite database.
+
+    Callers must hand it back with release_db_connection() instead of closing it.
+    """
+    return _pool.acquire()
+
+
+def release_db_connection(conn: Optional[sqlite3.Connection]) -> None:
+    """Returns a connection obtained from get_db_connection() to the pool."""
+    _pool.release(conn)
+
+
+# ── DB executor ──────────────────────────────────────────────────────────────
+# Coroutines never touch SQLite directly: the blocking call is queued on a
+# small dedicated thread pool, each thread holding its own pooled connection.
+_db_executor: Optional[ThreadPoolExecutor] = None
+_db_executor_lock = threading.Lock()
+
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(
+                max_workers=max(DB_EXECUTOR_WORKERS, 1),
+                thread_name_prefix="sqlite-db",
+            )
+        return _db_executor
+
+
+async def run_in_db_thread(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Runs a blocking database call on the DB executor and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_db_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_db_executor() -> None:
+    """Waits for queued database calls to finish and stops the DB executor."""
+    global _db_executor
+    with _db_executor_lock:
+        executor, _db_executor = _db_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
@@ -0,0 +1,186 @@
+"""
+Histórico de conversa injetado no prompt do ParenteTeam.
+
+Antes, as últimas 10 mensagens entravam inteiras a cada execução, por cima do
+prompt do Parente e das memórias do agno — respostas longas do agente
+inflavam todas as requisições seguintes. O HistoryBuilder monta o bloco de
+histórico dentro de um orçamento de tokens (HISTORY_TOKEN_BUDGET):
+
+- a mensagem que está sendo respondida já vai no input e não se repete;
+- linhas de cortesia que o agente repete em várias respostas (saudação,
+  "Quer que eu explique novamente?") e caminhos de áudio gerado saem;
+- as HISTORY_RECENT_MESSAGES mais recentes ficam por inteiro (até
+  HISTORY_RECENT_MAX_TOKENS cada); as mais antigas viram um resumo
+  extrativo — as primeiras frases, até HISTORY_OLD_MAX_TOKENS;
+- o que não couber no orçamento é omitido (da mais antiga para a mais nova).
+
+Tokens são estimados (~4 caracteres por token em português), sem tokenizer.
+O bloco é montado a cada execução, sem cache: toda execução chega com pelo
+menos uma mensagem nova (a resposta anterior do agente), então um cache por
+usuário nunca acertaria — e a montagem custa bem menos que a consulta.
+"""
+
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List
+
+from .config import (
+    HISTORY_OLD_MAX_TOKENS,
+    HISTORY_RECENT_MAX_TOKENS,
+    HISTORY_RECENT_MESSAGES,
+    HISTORY_TOKEN_BUDGET,
+)
+
+HISTORY_HEADER = "Previous Conversation History:\n"
+HISTORY_FOOTER = "\n---\n"
+
+_CHARS_PER_TOKEN = 4
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+_AUDIO_PATH_RE = re.compile(r"\S*[\\/]uploads[\\/]audio[\\/]\S+")
+# Linhas com menos que isso (normalizadas) não contam como boilerplate
+_MIN_BOILERPLATE_CHARS = 8
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token); good enough for budgeting."""
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def _normalize_line(line: str) -> str:
+    """Lowercase letters/digits only, so emojis and punctuation don't hide a repeated line."""
+    line = unicodedata.normalize("NFKD", line.lower())
+    return " ".join("".join(c if c.isalnum() else " " for c in line if not unicodedata.combining(c)).split())
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Whole sentences (or words) from the start of text, up to max_tokens."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max_tokens * _CHARS_PER_TOKEN
+    kept = ""
+    for sentence in _SENTENCE_END_RE.split(" ".join(text.split())):
+        candidate = f"{kept} {sentence}" if kept else sentence
+        if len(candidate) > max_chars:
+            break
+        kept = candidate
+    if not kept:
+        kept = text[:max_chars].rsplit(" ", 1)[0]
+    return kept.rstrip() + " …"
+
+
+class HistoryBuilder:
+    """Builds the token-budgeted history block."""
+
+    def __init__(
+        self,
+        budget_tokens: int = HISTORY_TOKEN_BUDGET,
+        recent_messages: int = HISTORY_RECENT_MESSAGES,
+        recent_max_tokens: int = HISTORY_RECENT_MAX_TOKENS,
+        old_max_tokens: int = HISTORY_OLD_MAX_TOKENS,
+    ):
+        self.budget_tokens = budget_tokens
+        self.recent_messages = recent_messages
+        self.recent_max_tokens = recent_max_tokens
+        self.old_max_tokens = old_max_tokens
+
+        self._lock = threading.Lock()
+        self._raw_tokens = 0
+        self._built_tokens = 0
+        self._builds = 0
+
+    def build(self, history: List[Dict[str, Any]], current_input: Any = None) -> str:
+        """
+        History block for the prompt. history comes from get_history (newest
+        first); current_input is the text being answered, whose trailing user
+        messages are already in the prompt and are skipped.
+        """
+        rows = list(reversed(history))
+        if isinstance(current_input, str):
+            while rows and rows[-1]["sender"] == "user" and rows[-1]["content"] and rows[-1]["content"] in current_input:
+                rows.pop()
+
+        raw_tokens = sum(estimate_tokens(str(row["content"] or "")) for row in rows)
+        context = self._render(rows)
+        with self._lock:
+            self._record(raw_tokens, context)
+        return context
+
+    # ------------------------------------------------------------------
+    # Montagem
+    # ------------------------------------------------------------------
+
+    def _render(self, rows: List[Dict[str, Any]]) -> str:
+        if not rows:
+            return ""
+        boilerplate = self._boilerplate_lines(rows)
+
+        # Da mais nova para a mais antiga, enquanto couber no orçamento
+        entries: List[str] = []
+        used = estimate_tokens(HISTORY_HEADER + HISTORY_FOOTER)
+        omitted = 0
+        for age, row in enumerate(reversed(rows)):
+            content = self._clean(str(row["content"] or ""), row["sender"], boilerplate)
+            if not content:
+                continue
+            role = "User" if row["sender"] == "user" else "Agent"
+            limit = self.recent_max_tokens if age < self.recent_messages else self.old_max_tokens
+            entry = f"{role}: {_truncate(content, limit)}"
+            cost = estimate_tokens(entry) + 1
+            if used + cost > self.budget_tokens and limit > self.old_max_tokens:
+                # Recente demais para caber inteira: tenta o resumo
+                entry = f"{role}: {_truncate(content, self.old_max_tokens)}"
+                cost = estimate_tokens(entry) + 1
+            if used + cost > self.budget_tokens:
+                omitted = len(rows) - age
+                break
+            entries.append(entry)
+            used += cost
+
+        if not entries:
+            return ""
+        if omitted:
+            entries.append(f"({omitted} earlier messages omitted)")
+        return HISTORY_HEADER + "\n".join(reversed(entries)) + HISTORY_FOOTER
+
+    @staticmethod
+    def _boilerplate_lines(rows: List[Dict[str, Any]]) -> set:
+        """Normalized lines that appear in two or more agent messages of the window."""
+        counts: Counter = Counter()
+        for row in rows:
+            if row["sender"] != "user":
+                lines = {_normalize_line(line) for line in str(row["content"] or "").splitlines()}
+                counts.update(line for line in lines if len(line) >= _MIN_BOILERPLATE_CHARS)
+        return {line for line, count in counts.items() if count >= 2}
+
+    @staticmethod
+    def _clean(content: str, sender: str, boilerplate: set) -> str:
+        if sender == "user":
+            return content.strip()
+        content = _AUDIO_PATH_RE.sub("[audio]", content)
+        lines = [line for line in content.splitlines() if line.strip()]
+        kept = [line for line in lines if _normalize_line(line) not in boilerplate]
+        # Só boilerplate: mantém a primeira linha para a vez do agente não sumir
+        return "\n".join(kept or lines[:1]).strip()
+
+    # ------------------------------------------------------------------
+    # Métricas
+    # ------------------------------------------------------------------
+
+    def _record(self, raw_tokens: int, context: str) -> None:
+        self._builds += 1
+        self._raw_tokens += raw_tokens
+        self._built_tokens += estimate_tokens(context)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "budget_tokens": self.budget_tokens,
+                "builds": self._builds,
+                "avg_raw_tokens": round(self._raw_tokens / self._builds) if self._builds else None,
+                "avg_injected_tokens": round(self._built_tokens / self._builds) if self._builds else None,
+            }
+
+
+history_builder = HistoryBuilder()
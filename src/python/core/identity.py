@@ -0,0 +1,30 @@
+"""
+Chave canônica de usuário para a tabela conversations.
+
+Historicamente o mesmo telefone aparecia como "5597..." (LGPD, status da IA)
+e como "wa:5597..." (session_id do ParenteTeam), o que obrigava toda consulta
+a testar as duas formas. Agora todo acesso passa por canonical_user_id e a
+migration de merge em core/migrations.py unifica as conversas antigas.
+"""
+
+WHATSAPP_PREFIX = "wa:"
+
+
+def canonical_user_id(user_id: str) -> str:
+    """
+    Normaliza um identificador de usuário para a forma gravada no banco.
+
+    Telefones (com ou sem 'wa:' / '+') viram 'wa:<dígitos>'. Identificadores
+    que não são telefone (ex.: sessões do AgentOS) são mantidos como vieram.
+    """
+    raw = str(user_id).strip()
+    had_prefix = raw.startswith(WHATSAPP_PREFIX)
+    if had_prefix:
+        raw = raw[len(WHATSAPP_PREFIX):].strip()
+
+    phone = raw[1:] if raw.startswith("+") else raw
+    if phone.isdigit():
+        return f"{WHATSAPP_PREFIX}{phone}"
+    if had_prefix:
+        return f"{WHATSAPP_PREFIX}{raw}"
+    return raw
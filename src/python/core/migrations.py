@@ -1,21 +1,38 @@
 """
-Auto-migration runner para o banco SQLite do projeto.
+Auto-migration runner versionado para o banco SQLite do projeto.
 
-Ao ser chamado no startup do app, verifica quais colunas/tabelas estão
-faltando e aplica apenas o necessário — sem recriar dados existentes.
+Cada migration em MIGRATIONS tem uma versão inteira, crescente, e roda na
+sua própria transação (BEGIN IMMEDIATE … COMMIT). As versões aplicadas
+ficam registradas na tabela schema_migrations; no startup o runner lê a
+maior versão aplicada com uma única consulta e, se for a mais recente,
+retorna sem nenhuma introspecção do schema — o custo de startup não cresce
+com o número de migrations.
 
-Para adicionar uma nova migration, basta inserir um item na lista
-COLUMN_MIGRATIONS ou TABLE_MIGRATIONS abaixo.
+Migrations de dados grandes (backfills) usam chunk_size: são executadas em
+lotes, cada lote numa transação curta, com um checkpoint gravado em
+schema_migrations. Assim o banco compartilhado com o dashboard PHP nunca
+fica travado por muito tempo, e um restart continua de onde parou.
+benchmarks/check_migrations.py exercita esse caminho com uma migration de
+exemplo num banco temporário.
+
+Para adicionar uma nova migration, acrescente um Migration ao FINAL da
+lista MIGRATIONS com a próxima versão. As listas TABLE_MIGRATIONS,
+COLUMN_MIGRATIONS e INDEX_MIGRATIONS são o schema base (versões 1–4) e não
+devem mais ser alteradas: bancos que já estão na versão atual não as
+reavaliam.
 """
 
 import sqlite3
-from typing import Optional
+import time
+from typing import Callable, NamedTuple, Optional
 from .config import DB_PATH
+from .identity import canonical_user_id
 
 
-# ── Migrations de COLUNAS ────────────────────────────────────────────────────
+# ── Schema base: COLUNAS ─────────────────────────────────────────────────────
 # Cada item: (tabela, coluna, SQL do ALTER TABLE)
-# O runner verifica se a coluna já existe antes de aplicar.
+# A migration 2 verifica se a coluna já existe antes de aplicar, pois bancos
+# antigos podem ter recebido parte delas pelo runner anterior ou pelo PHP.
 COLUMN_MIGRATIONS: list[tuple[str, str, str]] = [
     # 001 — ai_status (controle de pausa da IA por usuário)
     (
@@ -75,7 +92,7 @@ COLUMN_MIGRATIONS: list[tuple[str, str, str]] = [
 ]
 
 
-# ── Migrations de TABELAS ────────────────────────────────────────────────────
+# ── Schema base: TABELAS ─────────────────────────────────────────────────────
 # Cada item: (nome_da_tabela, SQL CREATE TABLE IF NOT EXISTS)
 TABLE_MIGRATIONS: list[tuple[str, str]] = [
     (
@@ -136,24 +153,371 @@ TABLE_MIGRATIONS: list[tuple[str, str]] = [
 ]
 
 
+# ── Schema base: ÍNDICES ─────────────────────────────────────────────────────
+# Cada item: (nome_do_índice, tabela, SQL CREATE INDEX IF NOT EXISTS)
+# Aplicados depois das colunas, seguidos de ANALYZE para o planner passar a
+# usá-los. benchmarks/check_query_plans.py verifica que as consultas quentes
+# continuam usando estes índices.
+INDEX_MIGRATIONS: list[tuple[str, str, str]] = [
+    # Histórico por conversa em ordem de id (get_history, getMessagesAfter do PHP).
+    # O rowid (id) já faz parte de todo índice, então ORDER BY id sai do índice.
+    (
+        "idx_messages_conversation_id",
+        "messages",
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages (conversation_id)",
+    ),
+    # Histórico por conversa em ordem de created_at
+    # (ConversationAnalyzer, CommunicationEvalTool, getMessages do PHP)
+    (
+        "idx_messages_conversation_created",
+        "messages",
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation_created ON messages (conversation_id, created_at)",
+    ),
+    # Contagem de mensagens não lidas do usuário (índice parcial, só as não lidas)
+    (
+        "idx_messages_unread_user",
+        "messages",
+        "CREATE INDEX IF NOT EXISTS idx_messages_unread_user ON messages (conversation_id) "
+        "WHERE is_read = 0 AND sender = 'user'",
+    ),
+    # Agregados do dashboard por período: mensagens/tipos por dia e "ativos hoje".
+    # Cobre sender/media_type/conversation_id, então nenhuma delas vai à tabela.
+    (
+        "idx_messages_created_covering",
+        "messages",
+        "CREATE INDEX IF NOT EXISTS idx_messages_created_covering "
+        "ON messages (created_at, sender, media_type, conversation_id)",
+    ),
+    # Lista de conversas e contatos por dia no dashboard
+    (
+        "idx_conversations_last_message_at",
+        "conversations",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_last_message_at ON conversations (last_message_at)",
+    ),
+]
+
+
 def _get_existing_columns(conn: sqlite3.Connection, table: str) -> set[str]:
     """Retorna o conjunto de colunas existentes em uma tabela."""
-    try:
-        cur = conn.cursor()
-        cur.execute(f"PRAGMA table_info({table})")
-        return {row[1] for row in cur.fetchall()}
-    except sqlite3.Error:
-        return set()
+    cur = conn.cursor()
+    cur.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cur.fetchall()}
 
 
 def _get_existing_tables(conn: sqlite3.Connection) -> set[str]:
     """Retorna o conjunto de tabelas existentes no banco."""
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    return {row[0] for row in cur.fetchall()}
+
+
+# ── Passos das migrations ────────────────────────────────────────────────────
+# Cada função recebe a conexão já dentro de uma transação; quem faz
+# COMMIT/ROLLBACK é o runner.
+
+def _create_base_tables(conn: sqlite3.Connection) -> None:
+    for _, create_sql in TABLE_MIGRATIONS:
+        conn.execute(create_sql)
+
+
+def _add_base_columns(conn: sqlite3.Connection) -> None:
+    existing_tables = _get_existing_tables(conn)
+    cols_cache: dict[str, set[str]] = {}
+
+    for table, column, sql in COLUMN_MIGRATIONS:
+        if table not in existing_tables:
+            continue
+        if table not in cols_cache:
+            cols_cache[table] = _get_existing_columns(conn, table)
+        if column not in cols_cache[table]:
+            conn.execute(sql)
+            cols_cache[table].add(column)
+            print(f"[migrations] Coluna adicionada: {table}.{column}")
+
+
+def _merge_duplicate_conversations(conn: sqlite3.Connection) -> None:
+    """
+    Unifica conversas do mesmo usuário gravadas com e sem o prefixo 'wa:'
+    (ver core/identity.py). As mensagens são movidas para a conversa
+    canônica e os estados são mesclados de forma conservadora:
+    IA pausada prevalece, e o consentimento LGPD mais recente prevalece.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id, user_id, ai_status, last_message_at, lgpd_consent_status, "
+        "lgpd_consent_at, lgpd_awaiting_response FROM conversations ORDER BY id"
+    )
+    groups: dict[str, list[sqlite3.Row]] = {}
+    for row in cur.fetchall():
+        groups.setdefault(canonical_user_id(row["user_id"]), []).append(row)
+
+    changed = 0
+    for canonical, rows in groups.items():
+        if len(rows) == 1 and rows[0]["user_id"] == canonical:
+            continue
+
+        # Mantém a conversa que já usa a chave canônica; senão a mais antiga
+        keeper = next((r for r in rows if r["user_id"] == canonical), rows[0])
+        duplicates = [r for r in rows if r["id"] != keeper["id"]]
+
+        ai_status = "paused" if any(r["ai_status"] == "paused" for r in rows) else (keeper["ai_status"] or "active")
+        last_message_at = max((r["last_message_at"] for r in rows if r["last_message_at"]), default=None)
+        decided = [r for r in rows if r["lgpd_consent_status"] in ("accepted", "rejected")]
+        if decided:
+            lgpd = max(decided, key=lambda r: r["lgpd_consent_at"] or "")
+        else:
+            lgpd = max(rows, key=lambda r: r["lgpd_awaiting_response"] or 0)
+
+        for dup in duplicates:
+            cur.execute("UPDATE messages SET conversation_id = ? WHERE conversation_id = ?", (keeper["id"], dup["id"]))
+            cur.execute("DELETE FROM conversations WHERE id = ?", (dup["id"],))
+
+        cur.execute(
+            """
+            UPDATE conversations
+            SET user_id = ?, ai_status = ?, last_message_at = ?,
+                lgpd_consent_status = ?, lgpd_consent_at = ?, lgpd_awaiting_response = ?
+            WHERE id = ?
+            """,
+            (
+                canonical, ai_status, last_message_at,
+                lgpd["lgpd_consent_status"], lgpd["lgpd_consent_at"], lgpd["lgpd_awaiting_response"],
+                keeper["id"],
+            ),
+        )
+        changed += len(rows)
+
+    print(f"[migrations] user_id canônico: {changed} conversas normalizadas")
+
+
+def _create_hot_query_indexes(conn: sqlite3.Connection) -> None:
+    for index_name, _, sql in INDEX_MIGRATIONS:
+        conn.execute(sql)
+    conn.execute("ANALYZE")
+
+
+def _create_inbound_queue(conn: sqlite3.Connection) -> None:
+    """
+    Fila persistente das mensagens recebidas pelo webhook (ver
+    InboundMessageRepository). message_id é o id do WhatsApp: UNIQUE garante
+    que reentregas da Meta não geram uma segunda execução.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS inbound_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id TEXT NOT NULL UNIQUE,
+            user_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_by TEXT,
+            lease_until REAL,
+            received_at REAL NOT NULL,
+            processed_at REAL
+        )
+    """)
+    # Claim por usuário e varredura de pendentes/expirados
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inbound_messages_user_status ON inbound_messages (user_id, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inbound_messages_status_received ON inbound_messages (status, received_at)")
+
+
+def _create_webhook_seen_ids(conn: sqlite3.Connection) -> None:
+    """
+    Ids de mensagens do WhatsApp já recebidas pelo webhook, com TTL (ver
+    SeenMessageRepository). Cobre a janela de reentregas da Meta mesmo depois
+    que a linha em inbound_messages foi expurgada.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS webhook_seen_ids (
+            message_id TEXT PRIMARY KEY,
+            seen_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_webhook_seen_ids_seen_at ON webhook_seen_ids (seen_at)")
+
+
+def _create_user_typing_stats(conn: sqlite3.Connection) -> None:
+    """
+    Modelo compacto do ritmo de digitação de cada usuário (ver
+    TypingStatsRepository e utils/whatsapp/debounce.py): média e variância
+    móveis do log do intervalo entre mensagens de uma mesma rajada.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_typing_stats (
+            user_id TEXT PRIMARY KEY,
+            samples INTEGER NOT NULL DEFAULT 0,
+            mean_log_gap REAL NOT NULL DEFAULT 0,
+            var_log_gap REAL NOT NULL DEFAULT 0,
+            last_message_at REAL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def _create_kb_ingestion_manifest(conn: sqlite3.Connection) -> None:
+    """
+    Manifesto da ingestão da base de conhecimento (ver agents/ingestion.py e
+    KnowledgeManifestRepository): um registro por arquivo indexado em cada
+    tabela kb_agent_{id} do LanceDB, com o que é preciso para saber se ele
+    mudou (tamanho, mtime, sha256, chunker, embedder) e quantos chunks gerou.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS kb_ingestion_manifest (
+            table_name TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            sha256 TEXT NOT NULL,
+            chunker TEXT NOT NULL,
+            embedder_id TEXT NOT NULL,
+            row_count INTEGER,
+            indexed_at REAL NOT NULL,
+            PRIMARY KEY (table_name, file_path)
+        ) WITHOUT ROWID
+    """)
+
+
+def _create_kb_ingestion_chunks(conn: sqlite3.Connection) -> None:
+    """
+    Dono de cada chunk das tabelas kb_agent_{id} (ver
+    KnowledgeManifestRepository.replace_chunks): chunk_id é o id da linha no
+    LanceDB (md5 do conteúdo), que fica uma vez só na tabela mesmo quando
+    dois arquivos têm o mesmo trecho. Um chunk só sai da tabela quando nenhum
+    arquivo é mais dono dele. Arquivos do manifesto sem donos registrados são
+    relidos uma vez na próxima ingestão.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS kb_ingestion_chunks (
+            table_name TEXT NOT NULL,
+            chunk_id TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            PRIMARY KEY (table_name, chunk_id, file_path)
+        ) WITHOUT ROWID
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_kb_ingestion_chunks_file ON kb_ingestion_chunks (table_name, file_path)"
+    )
+
+
+def _backfill_agent_messages_read(conn: sqlite3.Connection, after_id: Optional[int], chunk_size: int) -> Optional[int]:
+    """
+    Mensagens do agente gravadas pelo Python ficavam com is_read = 0; o PHP
+    (Database::insertMessage) grava as do agente já lidas. Alinha as antigas
+    em faixas de id (busca pela chave primária, sem varrer a tabela a cada
+    lote). Só toca linhas com sender != 'user', que nenhuma contagem de não
+    lidas considera.
+    """
+    start = after_id or 0
+    row = conn.execute("SELECT MAX(id) FROM messages").fetchone()
+    if row[0] is None or start >= row[0]:
+        return None
+    end = start + chunk_size
+    conn.execute(
+        "UPDATE messages SET is_read = 1 WHERE id > ? AND id <= ? AND sender != 'user' AND is_read = 0",
+        (start, end),
+    )
+    return end
+
+
+# ── Registro de migrations ───────────────────────────────────────────────────
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    # Sem chunk_size: apply(conn) roda tudo numa transação.
+    # Com chunk_size: apply(conn, checkpoint, chunk_size) processa um lote e
+    # retorna o próximo checkpoint, ou None quando terminou.
+    apply: Callable
+    chunk_size: Optional[int] = None
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "create_base_tables", _create_base_tables),
+    Migration(2, "add_base_columns", _add_base_columns),
+    Migration(3, "canonical_user_ids", _merge_duplicate_conversations),
+    Migration(4, "hot_query_indexes", _create_hot_query_indexes),
+    # 5: não é mais usada (o backfill de is_read virou a 11); bancos em que ela já rodou seguem válidos
+    Migration(6, "inbound_message_queue", _create_inbound_queue),
+    Migration(7, "webhook_seen_ids", _create_webhook_seen_ids),
+    Migration(8, "user_typing_stats", _create_user_typing_stats),
+    Migration(9, "kb_ingestion_manifest", _create_kb_ingestion_manifest),
+    Migration(10, "kb_ingestion_chunks", _create_kb_ingestion_chunks),
+    Migration(11, "backfill_agent_messages_read", _backfill_agent_messages_read, chunk_size=5000),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+# Pausa entre lotes de migrations de dados, para o PHP conseguir escrever
+CHUNK_PAUSE_SECONDS = 0.05
+
+_SCHEMA_MIGRATIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        checkpoint INTEGER,
+        applied_at DATETIME
+    )
+"""
+
+
+def _get_current_version(conn: sqlite3.Connection) -> int:
+    """Maior versão concluída; 0 se schema_migrations ainda não existe."""
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_migrations WHERE applied_at IS NOT NULL").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def _apply_migration(conn: sqlite3.Connection, migration: Migration) -> None:
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        return {row[0] for row in cur.fetchall()}
-    except sqlite3.Error:
-        return set()
+        migration.apply(conn)
+        conn.execute(
+            "INSERT OR REPLACE INTO schema_migrations (version, name, applied_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+            (migration.version, migration.name),
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _apply_chunked_migration(conn: sqlite3.Connection, migration: Migration) -> None:
+    conn.execute(
+        "INSERT OR IGNORE INTO schema_migrations (version, name) VALUES (?, ?)",
+        (migration.version, migration.name),
+    )
+    checkpoint = conn.execute(
+        "SELECT checkpoint FROM schema_migrations WHERE version = ?", (migration.version,)
+    ).fetchone()[0]
+
+    chunks = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            checkpoint = migration.apply(conn, checkpoint, migration.chunk_size)
+            if checkpoint is None:
+                conn.execute(
+                    "UPDATE schema_migrations SET applied_at = CURRENT_TIMESTAMP WHERE version = ?",
+                    (migration.version,),
+                )
+            else:
+                conn.execute(
+                    "UPDATE schema_migrations SET checkpoint = ? WHERE version = ?",
+                    (checkpoint, migration.version),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        chunks += 1
+        if checkpoint is None:
+            break
+        time.sleep(CHUNK_PAUSE_SECONDS)
+
+    print(f"[migrations] {migration.name}: {chunks} lotes processados")
 
 
 def run_migrations(db_path=None) -> None:
@@ -161,7 +525,8 @@ def run_migrations(db_path=None) -> None:
     Executa todas as migrations pendentes no banco especificado.
     Se db_path não for fornecido, usa o DB_PATH do config.
 
-    Deve ser chamado uma vez no startup do app.
+    Deve ser chamado uma vez no startup do app. Para na primeira migration
+    que falhar (a transação dela é desfeita); as seguintes dependem dela.
     """
     target = db_path or DB_PATH
 
@@ -170,59 +535,40 @@ def run_migrations(db_path=None) -> None:
         return
 
     try:
-        conn = sqlite3.connect(str(target))
+        # Autocommit: as transações são abertas explicitamente por migration
+        conn = sqlite3.connect(str(target), isolation_level=None)
         conn.row_factory = sqlite3.Row
     except sqlite3.Error as e:
         print(f"[migrations] Erro ao conectar em {target}: {e}")
         return
 
-    applied = 0
-    errors = 0
-
     try:
-        existing_tables = _get_existing_tables(conn)
-
-        # 1. Garante que as tabelas principais existem
-        for table_name, create_sql in TABLE_MIGRATIONS:
-            if table_name not in existing_tables:
-                try:
-                    conn.execute(create_sql)
-                    conn.commit()
-                    print(f"[migrations] Tabela criada: {table_name}")
-                    applied += 1
-                except sqlite3.Error as e:
-                    print(f"[migrations] Erro ao criar tabela {table_name}: {e}")
-                    errors += 1
-
-        # Recarrega tabelas existentes após possíveis criações
-        existing_tables = _get_existing_tables(conn)
-
-        # 2. Aplica colunas faltantes
-        # Cache de colunas por tabela para evitar múltiplas queries
-        cols_cache: dict[str, set[str]] = {}
-
-        for table, column, sql in COLUMN_MIGRATIONS:
-            if table not in existing_tables:
-                continue  # Tabela não existe, pula
-
-            if table not in cols_cache:
-                cols_cache[table] = _get_existing_columns(conn, table)
-
-            if column not in cols_cache[table]:
-                try:
-                    conn.execute(sql)
-                    conn.commit()
-                    cols_cache[table].add(column)  # Atualiza cache
-                    print(f"[migrations] Coluna adicionada: {table}.{column}")
-                    applied += 1
-                except sqlite3.Error as e:
-                    print(f"[migrations] Erro ao adicionar {table}.{column}: {e}")
-                    errors += 1
+        current = _get_current_version(conn)
+
+        # Fast path: nada a fazer, nenhuma introspecção
+        if current >= LATEST_VERSION:
+            print(f"[migrations] Banco atualizado (versão {current}) — nenhuma migration pendente.")
+            return
+
+        conn.execute(_SCHEMA_MIGRATIONS_SQL)
 
+        applied = 0
+        for migration in MIGRATIONS:
+            if migration.version <= current:
+                continue
+            try:
+                if migration.chunk_size:
+                    _apply_chunked_migration(conn, migration)
+                else:
+                    _apply_migration(conn, migration)
+            except sqlite3.Error as e:
+                print(f"[migrations] Erro na migration {migration.version} ({migration.name}): {e}")
+                print(f"[migrations] Interrompido: {applied} aplicadas, banco na versão {current}.")
+                return
+            print(f"[migrations] Aplicada: {migration.version} — {migration.name}")
+            applied += 1
+            current = migration.version
+
+        print(f"[migrations] Concluído: {applied} aplicadas, banco na versão {LATEST_VERSION}.")
     finally:
         conn.close()
-
-    if applied == 0 and errors == 0:
-        print(f"[migrations] Banco atualizado — nenhuma migration pendente.")
-    else:
-        print(f"[migrations] Concluído: {applied} aplicadas, {errors} erros.")
@@ -1,6 +1,45 @@
+import atexit
+import json
 import sqlite3
-from typing import List, Dict, Optional, Any
-from .database import get_db_connection
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, List, Dict, Optional, Any, Set, Tuple
+from .config import (
+    CONVERSATION_STATE_CACHE_SIZE,
+    CONVERSATION_STATE_TTL_SECONDS,
+    CONVERSATION_STATE_VERSION_CHECK_SECONDS,
+    INBOUND_LEASE_SECONDS,
+    INBOUND_MAX_ATTEMPTS,
+    MESSAGE_LOG_BATCH_SIZE,
+    MESSAGE_LOG_FLUSH_MS,
+    MESSAGE_LOG_MAX_PENDING,
+    MESSAGE_LOG_MAX_RETRIES,
+    MESSAGE_LOG_WRITE_BEHIND,
+)
+from .database import get_db_connection, release_db_connection, run_in_db_thread
+from .identity import canonical_user_id
+
+# INSERT ... ON CONFLICT ... RETURNING requires SQLite 3.35+
+_SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+_UPSERT_CONVERSATION_SQL = """
+    INSERT INTO conversations (user_id) VALUES (?)
+    ON CONFLICT(user_id) DO UPDATE SET last_message_at = CURRENT_TIMESTAMP
+    RETURNING id
+"""
+
+# (user_id, sender, content, media_type, media_url)
+MessageRow = Tuple[str, str, str, Optional[str], Optional[str]]
+# (user_id, samples, mean_log_gap, var_log_gap, last_message_at)
+TypingStatsRow = Tuple[str, int, float, float, Optional[float]]
+# (file_path, size, mtime, sha256, chunker, embedder_id, row_count)
+ManifestRow = Tuple[str, int, float, str, str, str, Optional[int]]
+# Contador em system_settings incrementado a cada mudança de ai_status/LGPD
+# (PHP ou Python); ver ConversationStateCache.check_version
+STATE_VERSION_KEY = "conversation_state_version"
+
 
 class AgentRepository:
     @staticmethod
@@ -19,7 +58,7 @@ class AgentRepository:
             print(f"Error fetching agents: {e}")
             return []
         finally:
-            conn.close()
+            release_db_connection(conn)
 
     @staticmethod
     def get_agent_documents(agent_id: int) -> List[str]:
@@ -37,10 +76,30 @@ class AgentRepository:
         except sqlite3.Error as e:
             print(f"Error fetching agent documents: {e}")
         finally:
-            conn.close()
+            release_db_connection(conn)
             
         return doc_files
 
+    @staticmethod
+    def get_documents_by_agent() -> Dict[int, List[str]]:
+        """Fetches every agent's documents in one query (agent_id -> filenames)."""
+        conn = get_db_connection()
+        if not conn:
+            return {}
+
+        documents: Dict[int, List[str]] = {}
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT agent_id, filename FROM agent_documents ORDER BY agent_id, id")
+            for row in cursor.fetchall():
+                documents.setdefault(row['agent_id'], []).append(row['filename'])
+        except sqlite3.Error as e:
+            print(f"Error fetching agent documents: {e}")
+        finally:
+            release_db_connection(conn)
+
+        return documents
+
 class ConversationRepository:
     @staticmethod
     def get_conversation_id(user_id: str) -> Optional[int]:
@@ -51,7 +110,7 @@ class ConversationRepository:
         
         try:
             cursor = conn.cursor()
-            cursor.execute("SELECT id FROM conversations WHERE user_id = ?", (user_id,))
+            cursor.execute("SELECT id FROM conversations WHERE user_id = ?", (canonical_user_id(user_id),))
             row = cursor.fetchone()
             if row:
                 return row['id']
@@ -59,7 +118,27 @@ class ConversationRepository:
         except sqlite3.Error:
             return None
         finally:
-            conn.close()
+            release_db_connection(conn)
+
+    @staticmethod
+    def _upsert_conversation(cursor: sqlite3.Cursor, user_id: str) -> Optional[int]:
+        """
+        Creates the conversation or bumps its last_message_at, returning its id.
+        Runs inside the caller's transaction; the caller commits.
+        """
+        if _SUPPORTS_RETURNING:
+            cursor.execute(_UPSERT_CONVERSATION_SQL, (user_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+        # SQLite < 3.35 has no RETURNING: fall back to SELECT + UPDATE/INSERT
+        cursor.execute("SELECT id FROM conversations WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute("UPDATE conversations SET last_message_at = CURRENT_TIMESTAMP WHERE id = ?", (row['id'],))
+            return row['id']
+        cursor.execute("INSERT INTO conversations (user_id) VALUES (?)", (user_id,))
+        return cursor.lastrowid
 
     @staticmethod
     def ensure_conversation(user_id: str) -> Optional[int]:
@@ -70,50 +149,85 @@ class ConversationRepository:
         
         try:
             cursor = conn.cursor()
-            cursor.execute("SELECT id FROM conversations WHERE user_id = ?", (user_id,))
-            row = cursor.fetchone()
-            
-            if row:
-                conversation_id = row['id']
-                cursor.execute("UPDATE conversations SET last_message_at = CURRENT_TIMESTAMP WHERE id = ?", (conversation_id,))
-                conn.commit()
-                return conversation_id
-            else:
-                cursor.execute("INSERT INTO conversations (user_id) VALUES (?)", (user_id,))
-                conn.commit()
-                return cursor.lastrowid
+            conversation_id = ConversationRepository._upsert_conversation(cursor, canonical_user_id(user_id))
+            conn.commit()
+            return conversation_id
         except sqlite3.Error as e:
             print(f"Error ensuring conversation: {e}")
             return None
         finally:
-            conn.close()
+            release_db_connection(conn)
 
     @staticmethod
     def log_message(user_id: str, sender: str, content: str, media_type: str = None, media_url: str = None):
-        """Logs a message to the database, ensuring conversation exists."""
-        conversation_id = ConversationRepository.ensure_conversation(user_id)
-        if not conversation_id:
+        """
+        Logs a message to the database, ensuring conversation exists.
+        With MESSAGE_LOG_WRITE_BEHIND enabled the row is queued on the
+        MessageLogBuffer and committed with the next batch.
+        """
+        row = (canonical_user_id(user_id), sender, content, media_type, media_url)
+        buffer = get_message_log_buffer()
+        if buffer:
+            buffer.append(row)
             return
+        ConversationRepository.write_messages([row])
 
+    @staticmethod
+    def write_messages(rows: List[MessageRow]) -> bool:
+        """
+        Writes (user_id, sender, content, media_type, media_url) rows in a single
+        transaction: one conversation upsert per user plus the message inserts.
+        user_id must already be canonical (see canonical_user_id).
+        Returns False if nothing was committed.
+        """
         conn = get_db_connection()
         if not conn:
-            return
+            return False
 
         try:
             cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO messages (conversation_id, sender, content, media_type, media_url) VALUES (?, ?, ?, ?, ?)",
-                (conversation_id, sender, content, media_type, media_url)
-            )
+            conversation_ids: Dict[str, int] = {}
+            for user_id, sender, content, media_type, media_url in rows:
+                conversation_id = conversation_ids.get(user_id)
+                if conversation_id is None:
+                    conversation_id = ConversationRepository._upsert_conversation(cursor, user_id)
+                    if not conversation_id:
+                        conn.rollback()
+                        return False
+                    conversation_ids[user_id] = conversation_id
+                # Same convention as the PHP dashboard: only user messages start unread
+                cursor.execute(
+                    "INSERT INTO messages (conversation_id, sender, content, media_type, media_url, is_read) VALUES (?, ?, ?, ?, ?, ?)",
+                    (conversation_id, sender, content, media_type, media_url, 0 if sender == 'user' else 1)
+                )
             conn.commit()
+            return True
         except sqlite3.Error as e:
             print(f"Error logging message: {e}")
+            return False
         finally:
-            conn.close()
+            release_db_connection(conn)
 
     @staticmethod
     def get_history(user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
-        """Fetches recent message history for a user."""
+        """
+        Fetches recent message history for a user, newest first.
+        Messages still waiting in the write-behind buffer are included.
+        """
+        user_id = canonical_user_id(user_id)
+        buffer = get_message_log_buffer()
+        if not buffer:
+            return ConversationRepository._fetch_history(user_id, limit)
+
+        # Holding the read lock keeps a flush from moving rows between the
+        # buffer and the table while we look at both.
+        with buffer.read_lock():
+            history = ConversationRepository._fetch_history(user_id, limit)
+            pending = buffer.pending_for(user_id)
+        return (list(reversed(pending)) + history)[:limit]
+
+    @staticmethod
+    def _fetch_history(user_id: str, limit: int) -> List[Dict[str, Any]]:
         conn = get_db_connection()
         if not conn:
             return []
@@ -142,36 +256,63 @@ class ConversationRepository:
             print(f"Error fetching history: {e}")
             return []
         finally:
-            conn.close()
+            release_db_connection(conn)
 
     @staticmethod
-    def get_ai_status(phone_number: str) -> str:
-        """Check AI status for a given phone number (user_id). handles wa: prefix logic."""
+    def _fetch_state(user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Reads ai_status and the LGPD columns in one query and caches them.
+        Returns None (and caches nothing) if the database is unavailable.
+        """
+        generation = conversation_state_cache.generation(user_id)
         conn = get_db_connection()
         if not conn:
-            return 'active'
-        
+            return None
+
         try:
             cursor = conn.cursor()
-            
-            # 1. Try with 'wa:' prefix first
-            wa_id = f"wa:{phone_number}"
-            cursor.execute("SELECT ai_status FROM conversations WHERE user_id = ?", (wa_id,))
+            cursor.execute(
+                "SELECT ai_status, lgpd_consent_status, lgpd_awaiting_response FROM conversations WHERE user_id = ?",
+                (user_id,)
+            )
             row = cursor.fetchone()
-            
-            if not row:
-                # 2. Fallback to raw phone number
-                cursor.execute("SELECT ai_status FROM conversations WHERE user_id = ?", (phone_number,))
-                row = cursor.fetchone()
-            
             if row:
-                return row['ai_status']
-            return 'active'
+                state = _make_state(row['ai_status'], row['lgpd_consent_status'], row['lgpd_awaiting_response'])
+            else:
+                # Usuário ainda sem conversa registrada
+                state = _make_state(None, None, 0)
+            conversation_state_cache.put(user_id, state, generation)
+            return state
         except Exception as e:
-            print(f"Error checking AI status: {e}")
-            return 'active'
+            print(f"Error fetching conversation state: {e}")
+            return None
         finally:
-            conn.close()
+            release_db_connection(conn)
+
+    @staticmethod
+    def _get_state(phone_number: str) -> Optional[Dict[str, Any]]:
+        user_id = canonical_user_id(phone_number)
+        if conversation_state_cache.version_check_due():
+            conversation_state_cache.check_version()
+        return conversation_state_cache.get(user_id) or ConversationRepository._fetch_state(user_id)
+
+    @staticmethod
+    def _bump_state_version(cursor: sqlite3.Cursor) -> None:
+        """Tells the other workers' state caches that a conversation's state changed (same transaction)."""
+        cursor.execute(
+            f"""
+            INSERT INTO system_settings (key, value, updated_at) VALUES ('{STATE_VERSION_KEY}', '1', CURRENT_TIMESTAMP)
+            ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1, updated_at = CURRENT_TIMESTAMP
+            """
+        )
+
+    @staticmethod
+    def get_ai_status(phone_number: str) -> str:
+        """Check AI status for a given phone number (user_id). Served from the state cache when fresh."""
+        state = ConversationRepository._get_state(phone_number)
+        if not state:
+            return 'active'
+        return state["ai_status"]
 
     # ------------------------------------------------------------------
     # LGPD — Consentimento
@@ -180,119 +321,1019 @@ class ConversationRepository:
     @staticmethod
     def get_lgpd_status(phone_number: str) -> dict:
         """
-        Retorna o estado de consentimento LGPD para um número de telefone.
+        Retorna o estado de consentimento LGPD para um número de telefone
+        (servido pelo cache de estado quando válido).
 
         Returns:
             dict com chaves:
                 - status: 'pending' | 'accepted' | 'rejected'
                 - awaiting_response: bool (True se política já foi enviada)
         """
-        conn = get_db_connection()
-        if not conn:
+        state = ConversationRepository._get_state(phone_number)
+        if not state:
             return {"status": "pending", "awaiting_response": False}
-
-        try:
-            cursor = conn.cursor()
-
-            # Tenta com prefixo 'wa:' primeiro, depois sem
-            for user_id in (f"wa:{phone_number}", phone_number):
-                cursor.execute(
-                    "SELECT lgpd_consent_status, lgpd_awaiting_response FROM conversations WHERE user_id = ?",
-                    (user_id,)
-                )
-                row = cursor.fetchone()
-                if row:
-                    return {
-                        "status": row["lgpd_consent_status"] or "pending",
-                        "awaiting_response": bool(row["lgpd_awaiting_response"]),
-                    }
-
-            # Usuário ainda sem conversa registrada
-            return {"status": "pending", "awaiting_response": False}
-        except Exception as e:
-            print(f"Error checking LGPD status: {e}")
-            return {"status": "pending", "awaiting_response": False}
-        finally:
-            conn.close()
+        return dict(state["lgpd"])
 
     @staticmethod
     def set_lgpd_consent(phone_number: str, status: str):
         """
         Grava o resultado do consentimento LGPD ('accepted' ou 'rejected')
         com timestamp e remove o flag de aguardando resposta.
+        Cria a conversa se ainda não existir (mesma transação).
         """
-        # Garante que a conversa existe antes de atualizar
-        ConversationRepository.ensure_conversation(f"wa:{phone_number}")
-
         conn = get_db_connection()
         if not conn:
             return
 
         try:
             cursor = conn.cursor()
-
-            # Atualiza com prefixo 'wa:'
-            wa_id = f"wa:{phone_number}"
+            user_id = canonical_user_id(phone_number)
+            conversation_id = ConversationRepository._upsert_conversation(cursor, user_id)
             cursor.execute(
                 """
                 UPDATE conversations
                 SET lgpd_consent_status = ?,
                     lgpd_consent_at = CURRENT_TIMESTAMP,
                     lgpd_awaiting_response = 0
-                WHERE user_id = ?
+                WHERE id = ?
                 """,
-                (status, wa_id)
+                (status, conversation_id)
             )
-
-            # Fallback: tenta sem prefixo se não achou
-            if cursor.rowcount == 0:
-                cursor.execute(
-                    """
-                    UPDATE conversations
-                    SET lgpd_consent_status = ?,
-                        lgpd_consent_at = CURRENT_TIMESTAMP,
-                        lgpd_awaiting_response = 0
-                    WHERE user_id = ?
-                    """,
-                    (status, phone_number)
-                )
-
+            ConversationRepository._bump_state_version(cursor)
             conn.commit()
+            conversation_state_cache.update_lgpd(user_id, status=status, awaiting_response=False)
         except Exception as e:
             print(f"Error setting LGPD consent: {e}")
         finally:
-            conn.close()
+            release_db_connection(conn)
 
     @staticmethod
     def set_lgpd_awaiting(phone_number: str, waiting: bool = True):
         """
         Marca ou desmarca o flag de 'aguardando resposta LGPD' para o número.
-        Cria a conversa se ainda não existir.
+        Cria a conversa se ainda não existir (mesma transação).
         """
-        ConversationRepository.ensure_conversation(f"wa:{phone_number}")
-
         conn = get_db_connection()
         if not conn:
             return
 
         try:
             cursor = conn.cursor()
-            value = 1 if waiting else 0
-
-            wa_id = f"wa:{phone_number}"
+            user_id = canonical_user_id(phone_number)
+            conversation_id = ConversationRepository._upsert_conversation(cursor, user_id)
             cursor.execute(
-                "UPDATE conversations SET lgpd_awaiting_response = ? WHERE user_id = ?",
-                (value, wa_id)
+                "UPDATE conversations SET lgpd_awaiting_response = ? WHERE id = ?",
+                (1 if waiting else 0, conversation_id)
             )
+            ConversationRepository._bump_state_version(cursor)
+            conn.commit()
+            conversation_state_cache.update_lgpd(user_id, awaiting_response=waiting)
+        except Exception as e:
+            print(f"Error setting LGPD awaiting: {e}")
+        finally:
+            release_db_connection(conn)
 
-            if cursor.rowcount == 0:
-                cursor.execute(
-                    "UPDATE conversations SET lgpd_awaiting_response = ? WHERE user_id = ?",
-                    (value, phone_number)
+def _make_state(ai_status: Optional[str], lgpd_status: Optional[str], lgpd_awaiting: Any) -> Dict[str, Any]:
+    return {
+        "ai_status": ai_status or "active",
+        "lgpd": {"status": lgpd_status or "pending", "awaiting_response": bool(lgpd_awaiting)},
+    }
+
+
+class ConversationStateCache:
+    """
+    In-process cache of the per-user state read on every debounced message
+    (ai_status and LGPD consent), keyed by canonical user id.
+
+    Entries expire after `ttl` seconds and are bounded LRU-style. Writes made
+    through ConversationRepository update the cache. Every writer (the PHP
+    dashboard pausing the AI, any uvicorn worker) also increments
+    conversation_state_version in system_settings; check_version() reads it
+    at most every `version_check_secs` and drops every entry when it moved,
+    so other workers see the change within that interval.
+    /whatsapp/internal_invalidate_state still invalidates the receiving
+    worker at once.
+
+    A per-key generation counter stops a read that raced with an
+    invalidation from putting the stale value back.
+    """
+
+    def __init__(
+        self,
+        ttl: float = CONVERSATION_STATE_TTL_SECONDS,
+        max_entries: int = CONVERSATION_STATE_CACHE_SIZE,
+        version_check_secs: float = CONVERSATION_STATE_VERSION_CHECK_SECONDS,
+    ):
+        self.ttl = ttl
+        self.max_entries = max(max_entries, 1)
+        self.version_check_secs = version_check_secs
+        self._version: Optional[str] = None
+        self._next_version_check = 0.0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._global_generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, user_id: str) -> Tuple[int, int]:
+        with self._lock:
+            return self._global_generation, self._generations.get(user_id, 0)
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: str, state: Dict[str, Any], generation: Tuple[int, int]) -> None:
+        with self._lock:
+            if generation != (self._global_generation, self._generations.get(user_id, 0)):
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl, state)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def update_lgpd(self, user_id: str, **changes) -> None:
+        """Write-through after a committed LGPD update; bumps the key's generation."""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            state = {"ai_status": entry[1]["ai_status"], "lgpd": {**entry[1]["lgpd"], **changes}}
+            self._entries[user_id] = (time.monotonic() + self.ttl, state)
+
+    def version_check_due(self) -> bool:
+        return time.monotonic() >= self._next_version_check
+
+    def check_version(self) -> None:
+        """Drops every entry if conversation_state_version changed since the last check. Does a DB read."""
+        self._next_version_check = time.monotonic() + self.version_check_secs
+        conn = get_db_connection()
+        if not conn:
+            return
+        try:
+            row = conn.execute("SELECT value FROM system_settings WHERE key = ?", (STATE_VERSION_KEY,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading conversation state version: {e}")
+            return
+        finally:
+            release_db_connection(conn)
+        version = row[0] if row else None
+        with self._lock:
+            changed = version != self._version
+            self._version = version
+        if changed:
+            self.invalidate()
+
+    def invalidate(self, user_id: Optional[str] = None) -> None:
+        """Drops one user's entry, or every entry when user_id is None."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+                self._generations.clear()
+                self._global_generation += 1
+                return
+            user_id = canonical_user_id(user_id)
+            self._entries.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+
+conversation_state_cache = ConversationStateCache()
+
+
+class MessageLogBuffer:
+    """
+    Write-behind queue for log_message.
+
+    Rows are collected in memory and committed by a background thread in one
+    transaction once max_batch rows are waiting or the oldest row has waited
+    flush_interval seconds. This trades a few hundred milliseconds of
+    durability for far fewer fsyncs on the database file shared with the PHP
+    dashboard. Pending rows stay visible to get_history (read-your-writes).
+
+    A batch that fails is retried max_retries times with exponential backoff,
+    then written row by row; rows that still fail are dropped and logged. At
+    max_pending rows, append() flushes in the caller's thread.
+    """
+
+    def __init__(
+        self,
+        writer: Callable[[List[MessageRow]], bool],
+        max_batch: int = MESSAGE_LOG_BATCH_SIZE,
+        flush_interval: float = MESSAGE_LOG_FLUSH_MS / 1000,
+        max_retries: int = MESSAGE_LOG_MAX_RETRIES,
+        max_pending: int = MESSAGE_LOG_MAX_PENDING,
+    ):
+        self._writer = writer
+        self.max_batch = max(max_batch, 1)
+        self.flush_interval = flush_interval
+        self.max_retries = max(max_retries, 0)
+        self.max_pending = max(max_pending, self.max_batch)
+        self._pending: List[MessageRow] = []
+        self._oldest_at: Optional[float] = None
+        # Falhas seguidas de flush e o instante da próxima tentativa (backoff)
+        self._failures = 0
+        self._retry_at: Optional[float] = None
+        self.dropped = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.RLock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="message-log-flush", daemon=True)
+        self._thread.start()
+
+    def append(self, row: MessageRow) -> None:
+        with self._cond:
+            closed = self._closed
+            if not closed:
+                self._pending.append(row)
+                if len(self._pending) < self.max_pending:
+                    if self._oldest_at is None:
+                        # First row starts the flush_interval countdown.
+                        self._oldest_at = time.monotonic()
+                        self._cond.notify()
+                    elif len(self._pending) >= self.max_batch:
+                        self._cond.notify()
+                    return
+        if closed:
+            # Buffer already shut down: write through.
+            self._writer([row])
+        else:
+            # Buffer full (the database keeps failing): flush here instead of growing.
+            self.flush()
+
+    def pending_for(self, user_id: str) -> List[Dict[str, Any]]:
+        """Unflushed messages of a user, oldest first."""
+        with self._cond:
+            return [
+                {"sender": sender, "content": content}
+                for uid, sender, content, _, _ in self._pending
+                if uid == user_id
+            ]
+
+    def read_lock(self) -> threading.RLock:
+        return self._flush_lock
+
+    def flush(self) -> None:
+        """Commits every pending row now."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+                self._oldest_at = None
+            if not batch:
+                return
+            if self._writer(batch):
+                self._failures, self._retry_at = 0, None
+                return
+            self._failures += 1
+            if self._failures <= self.max_retries:
+                # Keep the rows (in order) and retry after the backoff.
+                delay = self.flush_interval * 2 ** (self._failures - 1)
+                with self._cond:
+                    self._pending[:0] = batch
+                    self._oldest_at = time.monotonic()
+                    self._retry_at = self._oldest_at + delay
+                print(f"Error flushing message log: {len(batch)} rows re-queued (attempt {self._failures}, retry in {delay:.1f}s)")
+                return
+            # Retries exhausted: isolate the rows that cannot be written.
+            self._failures, self._retry_at = 0, None
+            for row in batch:
+                if not self._writer([row]):
+                    self.dropped += 1
+                    print(f"Error flushing message log: dropped message of {row[0]} (sender {row[1]})")
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._retry_at is not None and time.monotonic() < self._retry_at:
+                        self._cond.wait(self._retry_at - time.monotonic())
+                        continue
+                    if len(self._pending) >= self.max_batch:
+                        break
+                    if self._oldest_at is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self._oldest_at + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            self.flush()
+
+    def close(self) -> None:
+        """Stops the flush thread and commits whatever is still pending."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        # Without the backoff: each failed flush counts as a retry until the
+        # rows are written or dropped.
+        while self._pending:
+            self.flush()
+
+
+_message_log_buffer: Optional[MessageLogBuffer] = None
+_message_log_buffer_lock = threading.Lock()
+
+
+def get_message_log_buffer() -> Optional[MessageLogBuffer]:
+    """Returns the shared write-behind buffer, or None when it is disabled."""
+    global _message_log_buffer
+    if not MESSAGE_LOG_WRITE_BEHIND:
+        return None
+    with _message_log_buffer_lock:
+        if _message_log_buffer is None:
+            _message_log_buffer = MessageLogBuffer(ConversationRepository.write_messages)
+            atexit.register(_message_log_buffer.close)
+        return _message_log_buffer
+
+
+def flush_message_log() -> None:
+    """Commits buffered messages immediately (no-op when write-behind is off)."""
+    if _message_log_buffer is not None:
+        _message_log_buffer.flush()
+
+
+def close_message_log() -> None:
+    """Flushes and stops the write-behind buffer; called on shutdown."""
+    if _message_log_buffer is not None:
+        _message_log_buffer.close()
+
+
+class InboundMessageRepository:
+    """
+    Durable queue of inbound WhatsApp messages (table inbound_messages).
+
+    The webhook enqueues every message before debouncing it; the debounce
+    flush claims all pending rows of a user under a lease, and the rows are
+    marked done only after the batch was processed. If the process dies the
+    lease expires and recover_expired() puts the rows back (at-least-once).
+    Claims run in BEGIN IMMEDIATE transactions and are refused while another
+    worker holds a live lease for the same user, so several uvicorn workers
+    can share the table without answering a user twice in parallel.
+    """
+
+    @staticmethod
+    def _in(ids: List[int]) -> str:
+        return ",".join("?" * len(ids))
+
+    @staticmethod
+    def enqueue(message: Dict[str, Any]) -> Optional[bool]:
+        """
+        Stores a webhook message. Returns False if its WhatsApp id was already
+        queued and None if the database could not be reached.
+        """
+        return InboundMessageRepository.enqueue_many([message])[0]
+
+    @staticmethod
+    def enqueue_many(messages: List[Dict[str, Any]]) -> List[Optional[bool]]:
+        """Stores several webhook messages in one transaction; one result per message, as in enqueue()."""
+        conn = get_db_connection()
+        if not conn:
+            return [None] * len(messages)
+
+        try:
+            now = time.time()
+            results = []
+            for message in messages:
+                message_id = message.get("id") or f"local-{uuid.uuid4().hex}"
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO inbound_messages (message_id, user_id, payload, received_at) VALUES (?, ?, ?, ?)",
+                    (message_id, message.get("from", "unknown"), json.dumps(message), now)
                 )
+                results.append(cursor.rowcount == 1)
+            conn.commit()
+            return results
+        except sqlite3.Error as e:
+            print(f"Error enqueuing inbound messages: {e}")
+            return [None] * len(messages)
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def accept_batch(messages: List[Dict[str, Any]], seen_since: float) -> List[Optional[bool]]:
+        """
+        Webhook ack path in a single transaction: drops messages whose id is in
+        webhook_seen_ids since seen_since, queues the others and records them
+        as seen. One result per message: True queued, False duplicate, None
+        if the database could not be reached.
+        """
+        if not messages:
+            return []
+        conn = get_db_connection()
+        if not conn:
+            return [None] * len(messages)
+
+        try:
+            now = time.time()
+            ids = [message["id"] for message in messages if message.get("id")]
+            seen = set()
+            if ids:
+                rows = conn.execute(
+                    f"SELECT message_id FROM webhook_seen_ids WHERE message_id IN ({InboundMessageRepository._in(ids)}) AND seen_at >= ?",
+                    (*ids, seen_since)
+                ).fetchall()
+                seen = {row[0] for row in rows}
 
+            results = []
+            for message in messages:
+                message_id = message.get("id") or f"local-{uuid.uuid4().hex}"
+                if message_id in seen:
+                    results.append(False)
+                    continue
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO inbound_messages (message_id, user_id, payload, received_at) VALUES (?, ?, ?, ?)",
+                    (message_id, message.get("from", "unknown"), json.dumps(message), now)
+                )
+                queued = cursor.rowcount == 1
+                if queued:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO webhook_seen_ids (message_id, seen_at) VALUES (?, ?)",
+                        (message_id, now)
+                    )
+                results.append(queued)
             conn.commit()
-        except Exception as e:
-            print(f"Error setting LGPD awaiting: {e}")
+            return results
+        except sqlite3.Error as e:
+            print(f"Error accepting webhook messages: {e}")
+            return [None] * len(messages)
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def claim_batch(user_id: str, worker_id: str, lease_seconds: float = INBOUND_LEASE_SECONDS) -> Optional[List[Tuple[int, Dict[str, Any]]]]:
+        """
+        Claims every pending message of user_id, oldest first, as (row id, message).
+        Returns None when another worker holds a live lease on this user and
+        [] when there is nothing to process.
+        """
+        conn = get_db_connection()
+        if not conn:
+            return []
+
+        try:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            busy = conn.execute(
+                "SELECT 1 FROM inbound_messages WHERE user_id = ? AND status = 'processing' AND lease_until > ? LIMIT 1",
+                (user_id, now)
+            ).fetchone()
+            if busy:
+                conn.rollback()
+                return None
+
+            rows = conn.execute(
+                "SELECT id, payload FROM inbound_messages WHERE user_id = ? "
+                "AND (status = 'pending' OR (status = 'processing' AND attempts < ?)) ORDER BY id",
+                (user_id, INBOUND_MAX_ATTEMPTS)
+            ).fetchall()
+            if rows:
+                ids = [row[0] for row in rows]
+                conn.execute(
+                    f"UPDATE inbound_messages SET status = 'processing', claimed_by = ?, lease_until = ?, attempts = attempts + 1 "
+                    f"WHERE id IN ({InboundMessageRepository._in(ids)})",
+                    (worker_id, now + lease_seconds, *ids)
+                )
+            conn.commit()
+            return [(row[0], json.loads(row[1])) for row in rows]
+        except sqlite3.Error as e:
+            print(f"Error claiming inbound messages: {e}")
+            return []
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def _update(sql: str, params: tuple) -> int:
+        conn = get_db_connection()
+        if not conn:
+            return 0
+
+        try:
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Error updating inbound messages: {e}")
+            return 0
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def renew_lease(ids: List[int], worker_id: str, lease_seconds: float = INBOUND_LEASE_SECONDS) -> int:
+        if not ids:
+            return 0
+        return InboundMessageRepository._update(
+            f"UPDATE inbound_messages SET lease_until = ? WHERE claimed_by = ? AND status = 'processing' "
+            f"AND id IN ({InboundMessageRepository._in(ids)})",
+            (time.time() + lease_seconds, worker_id, *ids)
+        )
+
+    @staticmethod
+    def complete(ids: List[int]) -> int:
+        if not ids:
+            return 0
+        return InboundMessageRepository._update(
+            f"UPDATE inbound_messages SET status = 'done', processed_at = ?, lease_until = NULL "
+            f"WHERE id IN ({InboundMessageRepository._in(ids)})",
+            (time.time(), *ids)
+        )
+
+    @staticmethod
+    def release(ids: List[int], max_attempts: int = INBOUND_MAX_ATTEMPTS) -> int:
+        """Puts claimed messages back in the queue, or marks them failed after max_attempts."""
+        if not ids:
+            return 0
+        return InboundMessageRepository._update(
+            f"UPDATE inbound_messages SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            f"claimed_by = NULL, lease_until = NULL WHERE status = 'processing' "
+            f"AND id IN ({InboundMessageRepository._in(ids)})",
+            (max_attempts, *ids)
+        )
+
+    @staticmethod
+    def requeue(ids: List[int]) -> int:
+        """
+        Puts claimed messages back in the queue without counting the attempt
+        (the run was superseded by a follow-up, not failed).
+        """
+        if not ids:
+            return 0
+        return InboundMessageRepository._update(
+            f"UPDATE inbound_messages SET status = 'pending', claimed_by = NULL, lease_until = NULL, "
+            f"attempts = MAX(attempts - 1, 0) WHERE status = 'processing' "
+            f"AND id IN ({InboundMessageRepository._in(ids)})",
+            tuple(ids)
+        )
+
+    @staticmethod
+    def release_worker(worker_id: str) -> int:
+        """Returns every message claimed by worker_id to the queue (graceful shutdown)."""
+        return InboundMessageRepository._update(
+            "UPDATE inbound_messages SET status = 'pending', claimed_by = NULL, lease_until = NULL "
+            "WHERE status = 'processing' AND claimed_by = ?",
+            (worker_id,)
+        )
+
+    @staticmethod
+    def recover_expired(max_attempts: int = INBOUND_MAX_ATTEMPTS) -> int:
+        """Requeues messages whose lease expired (the worker holding them died)."""
+        return InboundMessageRepository._update(
+            "UPDATE inbound_messages SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "claimed_by = NULL, lease_until = NULL WHERE status = 'processing' AND lease_until <= ?",
+            (max_attempts, time.time())
+        )
+
+    @staticmethod
+    def pending_users(received_before: float) -> List[str]:
+        """Users with pending messages received before the given epoch time."""
+        conn = get_db_connection()
+        if not conn:
+            return []
+
+        try:
+            rows = conn.execute(
+                "SELECT DISTINCT user_id FROM inbound_messages WHERE status = 'pending' AND received_at <= ?",
+                (received_before,)
+            ).fetchall()
+            return [row[0] for row in rows]
+        except sqlite3.Error as e:
+            print(f"Error listing pending inbound messages: {e}")
+            return []
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def purge_processed(before: float) -> int:
+        """Deletes done/failed messages processed before the given epoch time."""
+        return InboundMessageRepository._update(
+            "DELETE FROM inbound_messages WHERE status IN ('done', 'failed') AND COALESCE(processed_at, received_at) < ?",
+            (before,)
+        )
+
+
+class AsyncInboundMessageRepository:
+    """Awaitable facade over InboundMessageRepository (same DB executor as the conversations)."""
+
+    @staticmethod
+    async def enqueue(message: Dict[str, Any]) -> Optional[bool]:
+        return await run_in_db_thread(InboundMessageRepository.enqueue, message)
+
+    @staticmethod
+    async def enqueue_many(messages: List[Dict[str, Any]]) -> List[Optional[bool]]:
+        return await run_in_db_thread(InboundMessageRepository.enqueue_many, messages)
+
+    @staticmethod
+    async def accept_batch(messages: List[Dict[str, Any]], seen_since: float) -> List[Optional[bool]]:
+        return await run_in_db_thread(InboundMessageRepository.accept_batch, messages, seen_since)
+
+    @staticmethod
+    async def claim_batch(user_id: str, worker_id: str) -> Optional[List[Tuple[int, Dict[str, Any]]]]:
+        return await run_in_db_thread(InboundMessageRepository.claim_batch, user_id, worker_id)
+
+    @staticmethod
+    async def renew_lease(ids: List[int], worker_id: str) -> int:
+        return await run_in_db_thread(InboundMessageRepository.renew_lease, ids, worker_id)
+
+    @staticmethod
+    async def complete(ids: List[int]) -> int:
+        return await run_in_db_thread(InboundMessageRepository.complete, ids)
+
+    @staticmethod
+    async def release(ids: List[int]) -> int:
+        return await run_in_db_thread(InboundMessageRepository.release, ids)
+
+    @staticmethod
+    async def requeue(ids: List[int]) -> int:
+        return await run_in_db_thread(InboundMessageRepository.requeue, ids)
+
+    @staticmethod
+    async def recover_expired() -> int:
+        return await run_in_db_thread(InboundMessageRepository.recover_expired)
+
+    @staticmethod
+    async def pending_users(received_before: float) -> List[str]:
+        return await run_in_db_thread(InboundMessageRepository.pending_users, received_before)
+
+    @staticmethod
+    async def purge_processed(before: float) -> int:
+        return await run_in_db_thread(InboundMessageRepository.purge_processed, before)
+
+
+class SeenMessageRepository:
+    """
+    Persistent set of WhatsApp message ids already accepted by the webhook
+    (with TTL). Ids are checked and recorded by InboundMessageRepository.accept_batch.
+    """
+
+    @staticmethod
+    def purge_expired(before: float) -> int:
+        conn = get_db_connection()
+        if not conn:
+            return 0
+
+        try:
+            cursor = conn.execute("DELETE FROM webhook_seen_ids WHERE seen_at < ?", (before,))
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Error purging seen message ids: {e}")
+            return 0
+        finally:
+            release_db_connection(conn)
+
+
+class TypingStatsRepository:
+    """
+    Per-user inter-message gap model used by the adaptive debounce policy:
+    (user_id, samples, mean_log_gap, var_log_gap, last_message_at).
+    """
+
+    @staticmethod
+    def load_all() -> List[TypingStatsRow]:
+        conn = get_db_connection()
+        if not conn:
+            return []
+
+        try:
+            cursor = conn.execute(
+                "SELECT user_id, samples, mean_log_gap, var_log_gap, last_message_at FROM user_typing_stats"
+            )
+            return [tuple(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error loading typing stats: {e}")
+            return []
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def save_many(rows: List[TypingStatsRow]) -> bool:
+        """Upserts the given rows in a single transaction."""
+        if not rows:
+            return True
+        conn = get_db_connection()
+        if not conn:
+            return False
+
+        try:
+            now = time.time()
+            conn.executemany(
+                """
+                INSERT INTO user_typing_stats (user_id, samples, mean_log_gap, var_log_gap, last_message_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    samples = excluded.samples,
+                    mean_log_gap = excluded.mean_log_gap,
+                    var_log_gap = excluded.var_log_gap,
+                    last_message_at = excluded.last_message_at,
+                    updated_at = excluded.updated_at
+                """,
+                [(*row, now) for row in rows],
+            )
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Error saving typing stats: {e}")
+            conn.rollback()
+            return False
+        finally:
+            release_db_connection(conn)
+
+
+class AsyncTypingStatsRepository:
+    """Awaitable facade over TypingStatsRepository."""
+
+    @staticmethod
+    async def load_all() -> List[TypingStatsRow]:
+        return await run_in_db_thread(TypingStatsRepository.load_all)
+
+    @staticmethod
+    async def save_many(rows: List[TypingStatsRow]) -> bool:
+        return await run_in_db_thread(TypingStatsRepository.save_many, rows)
+
+
+class KnowledgeManifestRepository:
+    """
+    Files indexed into each kb_agent_{id} LanceDB table:
+    (file_path, size, mtime, sha256, chunker, embedder_id, row_count), plus
+    which files own each chunk id (kb_ingestion_chunks).
+    Used from the knowledge ingestion thread only, so there is no async facade.
+    """
+
+    # Limite de variáveis por consulta em SQLites antigos é 999
+    _ID_BATCH = 500
+
+    @staticmethod
+    def load(table_name: str) -> Dict[str, ManifestRow]:
+        """Manifest of one table, keyed by file_path."""
+        conn = get_db_connection()
+        if not conn:
+            return {}
+
+        try:
+            cursor = conn.execute(
+                """
+                SELECT file_path, size, mtime, sha256, chunker, embedder_id, row_count
+                FROM kb_ingestion_manifest WHERE table_name = ?
+                """,
+                (table_name,),
+            )
+            return {row["file_path"]: tuple(row) for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            print(f"Error loading ingestion manifest: {e}")
+            return {}
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def save(table_name: str, row: ManifestRow) -> bool:
+        conn = get_db_connection()
+        if not conn:
+            return False
+
+        try:
+            conn.execute(
+                """
+                INSERT INTO kb_ingestion_manifest
+                    (table_name, file_path, size, mtime, sha256, chunker, embedder_id, row_count, indexed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(table_name, file_path) DO UPDATE SET
+                    size = excluded.size,
+                    mtime = excluded.mtime,
+                    sha256 = excluded.sha256,
+                    chunker = excluded.chunker,
+                    embedder_id = excluded.embedder_id,
+                    row_count = excluded.row_count,
+                    indexed_at = excluded.indexed_at
+                """,
+                (table_name, *row, time.time()),
+            )
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Error saving ingestion manifest: {e}")
+            conn.rollback()
+            return False
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def delete(table_name: str, file_paths: Optional[List[str]] = None) -> List[str]:
+        """
+        Removes the given entries of a table (or the whole table's manifest when
+        file_paths is None) with their chunk ownership. Returns the chunk ids
+        that no remaining file owns.
+        """
+        conn = get_db_connection()
+        if not conn:
+            return []
+
+        try:
+            if file_paths is None:
+                conn.execute("DELETE FROM kb_ingestion_manifest WHERE table_name = ?", (table_name,))
+                conn.execute("DELETE FROM kb_ingestion_chunks WHERE table_name = ?", (table_name,))
+                conn.commit()
+                return []
+            released = set()
+            for path in file_paths:
+                released.update(KnowledgeManifestRepository._release(conn, table_name, path))
+            conn.executemany(
+                "DELETE FROM kb_ingestion_manifest WHERE table_name = ? AND file_path = ?",
+                [(table_name, path) for path in file_paths],
+            )
+            unowned = KnowledgeManifestRepository._unowned(conn, table_name, released)
+            conn.commit()
+            return unowned
+        except sqlite3.Error as e:
+            print(f"Error deleting ingestion manifest: {e}")
+            conn.rollback()
+            return []
         finally:
-            conn.close()
+            release_db_connection(conn)
+
+    @staticmethod
+    def files_with_chunks(table_name: str) -> Set[str]:
+        """file_paths of a table whose chunk ownership is recorded."""
+        conn = get_db_connection()
+        if not conn:
+            return set()
+
+        try:
+            cursor = conn.execute(
+                "SELECT DISTINCT file_path FROM kb_ingestion_chunks WHERE table_name = ?", (table_name,)
+            )
+            return {row[0] for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            print(f"Error loading ingestion chunks: {e}")
+            return set()
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def owned_chunks(table_name: str, chunk_ids: List[str]) -> Set[str]:
+        """The chunk ids (among chunk_ids) that some file of the table owns, i.e. already in the table."""
+        conn = get_db_connection()
+        if not conn:
+            return set()
+
+        try:
+            ids = list(dict.fromkeys(chunk_ids))
+            owned = set()
+            for start in range(0, len(ids), KnowledgeManifestRepository._ID_BATCH):
+                batch = ids[start:start + KnowledgeManifestRepository._ID_BATCH]
+                cursor = conn.execute(
+                    f"SELECT DISTINCT chunk_id FROM kb_ingestion_chunks WHERE table_name = ? "
+                    f"AND chunk_id IN ({','.join('?' * len(batch))})",
+                    (table_name, *batch),
+                )
+                owned.update(row[0] for row in cursor.fetchall())
+            return owned
+        except sqlite3.Error as e:
+            print(f"Error loading ingestion chunks: {e}")
+            return set()
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def replace_chunks(table_name: str, file_path: str, chunk_ids: List[str]) -> Optional[List[str]]:
+        """
+        Records chunk_ids as the chunks of file_path, replacing its previous
+        ones. Returns the previous chunk ids that no file owns anymore (to
+        delete from the LanceDB table), or None on error.
+        """
+        conn = get_db_connection()
+        if not conn:
+            return None
+
+        try:
+            new_ids = set(chunk_ids)
+            released = KnowledgeManifestRepository._release(conn, table_name, file_path) - new_ids
+            conn.executemany(
+                "INSERT OR IGNORE INTO kb_ingestion_chunks (table_name, chunk_id, file_path) VALUES (?, ?, ?)",
+                [(table_name, chunk_id, file_path) for chunk_id in new_ids],
+            )
+            unowned = KnowledgeManifestRepository._unowned(conn, table_name, released)
+            conn.commit()
+            return unowned
+        except sqlite3.Error as e:
+            print(f"Error saving ingestion chunks: {e}")
+            conn.rollback()
+            return None
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def copy_chunks(table_name: str, from_path: str, to_path: str) -> Optional[List[str]]:
+        """
+        Makes to_path own the same chunks as from_path (same content under
+        another name) instead of its previous ones. Returns the previous chunk
+        ids that no file owns anymore, or None on error.
+        """
+        conn = get_db_connection()
+        if not conn:
+            return None
+
+        try:
+            released = KnowledgeManifestRepository._release(conn, table_name, to_path)
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO kb_ingestion_chunks (table_name, chunk_id, file_path)
+                SELECT table_name, chunk_id, ? FROM kb_ingestion_chunks WHERE table_name = ? AND file_path = ?
+                """,
+                (to_path, table_name, from_path),
+            )
+            unowned = KnowledgeManifestRepository._unowned(conn, table_name, released)
+            conn.commit()
+            return unowned
+        except sqlite3.Error as e:
+            print(f"Error saving ingestion chunks: {e}")
+            conn.rollback()
+            return None
+        finally:
+            release_db_connection(conn)
+
+    @staticmethod
+    def _release(conn: sqlite3.Connection, table_name: str, file_path: str) -> Set[str]:
+        """Deletes file_path's chunk ownership (no commit); returns the chunk ids it owned."""
+        cursor = conn.execute(
+            "SELECT chunk_id FROM kb_ingestion_chunks WHERE table_name = ? AND file_path = ?", (table_name, file_path)
+        )
+        owned = {row[0] for row in cursor.fetchall()}
+        conn.execute("DELETE FROM kb_ingestion_chunks WHERE table_name = ? AND file_path = ?", (table_name, file_path))
+        return owned
+
+    @staticmethod
+    def _unowned(conn: sqlite3.Connection, table_name: str, chunk_ids: Set[str]) -> List[str]:
+        return [
+            chunk_id for chunk_id in chunk_ids
+            if conn.execute(
+                "SELECT 1 FROM kb_ingestion_chunks WHERE table_name = ? AND chunk_id = ? LIMIT 1",
+                (table_name, chunk_id),
+            ).fetchone() is None
+        ]
+
+
+class AsyncConversationRepository:
+    """
+    Awaitable facade over ConversationRepository for code running on the
+    asyncio event loop. Each call is queued on the DB executor thread, so a
+    slow disk never stalls other users' debounce timers or HTTP sends.
+    """
+
+    @staticmethod
+    async def get_conversation_id(user_id: str) -> Optional[int]:
+        return await run_in_db_thread(ConversationRepository.get_conversation_id, user_id)
+
+    @staticmethod
+    async def ensure_conversation(user_id: str) -> Optional[int]:
+        return await run_in_db_thread(ConversationRepository.ensure_conversation, user_id)
+
+    @staticmethod
+    async def log_message(user_id: str, sender: str, content: str, media_type: str = None, media_url: str = None):
+        await run_in_db_thread(ConversationRepository.log_message, user_id, sender, content, media_type, media_url)
+
+    @staticmethod
+    async def get_history(user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return await run_in_db_thread(ConversationRepository.get_history, user_id, limit)
+
+    @staticmethod
+    async def _check_state_version() -> None:
+        # A leitura do contador vai para a thread do banco, no máximo uma vez por intervalo
+        if conversation_state_cache.version_check_due():
+            await run_in_db_thread(conversation_state_cache.check_version)
+
+    @staticmethod
+    async def get_ai_status(phone_number: str) -> str:
+        # Cache hits are answered on the loop without a thread hop.
+        await AsyncConversationRepository._check_state_version()
+        state = conversation_state_cache.get(canonical_user_id(phone_number))
+        if state:
+            return state["ai_status"]
+        return await run_in_db_thread(ConversationRepository.get_ai_status, phone_number)
+
+    @staticmethod
+    async def get_lgpd_status(phone_number: str) -> dict:
+        await AsyncConversationRepository._check_state_version()
+        state = conversation_state_cache.get(canonical_user_id(phone_number))
+        if state:
+            return dict(state["lgpd"])
+        return await run_in_db_thread(ConversationRepository.get_lgpd_status, phone_number)
+
+    @staticmethod
+    async def set_lgpd_consent(phone_number: str, status: str):
+        await run_in_db_thread(ConversationRepository.set_lgpd_consent, phone_number, status)
+
+    @staticmethod
+    async def set_lgpd_awaiting(phone_number: str, waiting: bool = True):
+        await run_in_db_thread(ConversationRepository.set_lgpd_awaiting, phone_number, waiting)
@@ -1,38 +1,48 @@
 import re
-from typing import Any
+from typing import Any, Awaitable, Callable, Optional
 from pathlib import Path
 from agno.team import Team
 from agno.media import Audio
-from core.repositories import ConversationRepository
+from agno.run.team import TeamRunEvent, TeamRunOutput
+from core.config import HISTORY_MAX_MESSAGES
+from core.history import history_builder
+from core.repositories import AsyncConversationRepository, ConversationRepository
+
+# Caminho do áudio gerado pela ferramenta de fala, citado na resposta do Team
+GENERATED_AUDIO_RE = re.compile(r"(?:[a-zA-Z]:)?[\\/].*?public[\\/]uploads[\\/]audio[\\/].*?speech_[\w-]+\.(?:wav|ogg|mp3)")
 
 class ParenteTeam(Team):
     def log_message(self, user_id: str, sender: str, content: str, media_type: str = None, media_url: str = None):
         ConversationRepository.log_message(user_id, sender, content, media_type, media_url)
 
-    def get_conversation_history(self, user_id: str, limit: int = 10) -> str:
-        """Fetches recent conversation history from the database."""
+    async def alog_message(self, user_id: str, sender: str, content: str, media_type: str = None, media_url: str = None):
+        await AsyncConversationRepository.log_message(user_id, sender, content, media_type, media_url)
+
+    def get_conversation_history(self, user_id: str, limit: int = HISTORY_MAX_MESSAGES, current_input: Any = None) -> str:
+        """
+        Fetches recent conversation history from the database, trimmed to the
+        history token budget (see core/history.py).
+        """
         history = ConversationRepository.get_history(user_id, limit)
-        if not history:
-             return ""
+        return history_builder.build(history, current_input)
 
-        history_entries = []
-        for msg in history:
-            role = "User" if msg['sender'] == 'user' else "Agent"
-            history_entries.append(f"{role}: {msg['content']}")
-        
-        if history_entries:
-            return "Previous Conversation History:\n" + "\n".join(history_entries) + "\n---\n"
-        return ""
+    async def aget_conversation_history(self, user_id: str, limit: int = HISTORY_MAX_MESSAGES, current_input: Any = None) -> str:
+        """Async variant of get_conversation_history; the query runs on the DB thread."""
+        history = await AsyncConversationRepository.get_history(user_id, limit)
+        return history_builder.build(history, current_input)
 
     def run(self, input: Any = None, *args, **kwargs) -> Any:
         session_id = kwargs.get("session_id")
-        user_message = str(input)
+        # log_input: texto a gravar no histórico quando parte do input já foi gravada
+        log_input = kwargs.pop("log_input", None)
+        user_message = str(input) if log_input is None else log_input
         
         if session_id:
-             self.log_message(session_id, "user", user_message, media_type=kwargs.get("media_type"), media_url=kwargs.get("media_url"))
+             if user_message:
+                 self.log_message(session_id, "user", user_message, media_type=kwargs.get("media_type"), media_url=kwargs.get("media_url"))
              
              # INJECT HISTORY
-             history_context = self.get_conversation_history(session_id)
+             history_context = self.get_conversation_history(session_id, current_input=input)
              if history_context:
                  if isinstance(input, str):
                      input = history_context + "\n" + input
@@ -45,22 +55,70 @@ class ParenteTeam(Team):
              
         return response
 
-    async def arun(self, input: Any = None, *args, **kwargs) -> Any:
+    async def _aprepare_input(self, input: Any, kwargs: dict) -> Any:
+        """Logs the user message and injects the conversation history (shared by arun/arun_stream)."""
         session_id = kwargs.get("session_id")
-        user_message = str(input)
+        # log_input: texto a gravar no histórico quando parte do input já foi
+        # gravada (execução refeita após um follow-up, ver utils/whatsapp/followup.py)
+        log_input = kwargs.pop("log_input", None)
+        user_message = str(input) if log_input is None else log_input
         
         if session_id:
-             self.log_message(session_id, "user", user_message, media_type=kwargs.get("media_type"), media_url=kwargs.get("media_url"))
+             if user_message:
+                 await self.alog_message(session_id, "user", user_message, media_type=kwargs.get("media_type"), media_url=kwargs.get("media_url"))
 
              # INJECT HISTORY
-             history_context = self.get_conversation_history(session_id)
+             history_context = await self.aget_conversation_history(session_id, current_input=input)
              if history_context:
                  if isinstance(input, str):
                      clean_user_id = session_id.replace("wa:", "")
                      input = f"Current User ID: {clean_user_id}\n" + history_context + "\n" + input
+        return input
+
+    async def arun(self, input: Any = None, *args, **kwargs) -> Any:
+        session_id = kwargs.get("session_id")
+        on_reply_ready = kwargs.pop("on_reply_ready", None)
+        input = await self._aprepare_input(input, kwargs)
 
         # Execute original run
         response = await super().arun(input=input, *args, **kwargs)
+        return await self._afinish_response(session_id, response, on_reply_ready)
+
+    async def arun_stream(self, input: Any, on_content: Callable[[str], Awaitable[None]], **kwargs) -> Any:
+        """
+        Streaming variant of arun: awaits on_content(delta) for every piece of
+        the team's answer as it is generated, then returns the final response
+        (same audio handling and logging as arun).
+        """
+        session_id = kwargs.get("session_id")
+        on_reply_ready = kwargs.pop("on_reply_ready", None)
+        input = await self._aprepare_input(input, kwargs)
+
+        parts: list[str] = []
+        response = None
+        async for event in super().arun(input=input, stream=True, **kwargs):
+            event_name = getattr(event, "event", None)
+            if event_name == TeamRunEvent.run_content.value and isinstance(event.content, str):
+                parts.append(event.content)
+                await on_content(event.content)
+            elif event_name == TeamRunEvent.run_completed.value:
+                response = event
+
+        if response is None:
+            response = TeamRunOutput(content="".join(parts))
+        elif not response.content:
+            response.content = "".join(parts)
+        return await self._afinish_response(session_id, response, on_reply_ready)
+
+    async def _afinish_response(
+        self, session_id: Optional[str], response: Any, on_reply_ready: Optional[Callable[[], None]] = None
+    ) -> Any:
+        """
+        Attaches a generated audio file (if the answer points to one) and logs
+        the agent message. on_reply_ready runs right before the log, with no
+        await in between: the caller uses it to make the run non-cancellable,
+        so a logged reply is always sent.
+        """
         
         media_type = None
         media_url = None
@@ -68,7 +126,7 @@ class ParenteTeam(Team):
         # Audio handling logic
         if response and response.content:
             # Regex to find the path
-            match = re.search(r"(?:[a-zA-Z]:)?[\\/].*?public[\\/]uploads[\\/]audio[\\/].*?speech_[\w-]+\.(?:wav|ogg|mp3)", str(response.content).replace("\\\\", "\\"))
+            match = GENERATED_AUDIO_RE.search(str(response.content).replace("\\\\", "\\"))
             
             if match:
                 file_path_str = match.group(0).strip()
@@ -106,8 +164,10 @@ class ParenteTeam(Team):
                 except Exception as e:
                     print(f"Error reading generated audio file: {e}") 
        
+        if on_reply_ready:
+            on_reply_ready()
         if session_id and response:
              agent_message = str(response.content)
-             self.log_message(session_id, "agent", agent_message, media_type, media_url)
+             await self.alog_message(session_id, "agent", agent_message, media_type, media_url)
              
         return response
@@ -6,11 +6,15 @@ from agno.models.google import Gemini
 
 # Import custom components
 from core.config import DB_PATH, get_model_config
-from core.database import get_db_connection
+from core.database import get_db_connection, get_pool, release_db_connection, shutdown_db_executor
 from core.migrations import run_migrations
+from core.repositories import close_message_log
 from core.models import get_model
 from core.team import ParenteTeam
 from agents.factory import load_agents
+from agents.embedding_cache import embedding_cache
+from agents.embeddings import embed_request_pool
+from agents.ingestion import knowledge_ingestor
 
 # Tools and Services
 from utils.whatsapp.whatsapp import Whatsapp
@@ -120,13 +124,33 @@ async def analyze_conversation(request: Request):
         
         result = analyzer.analyze(conversation_id, conn, force=force)
         
-        conn.close()
+        release_db_connection(conn)
         return result
         
     except Exception as e:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
         print(f"Analysis endpoint error: {e}")
         return {"error": str(e)}
 
+@app.get("/knowledge_status")
+async def knowledge_status():
+    """Progress of the background knowledge-base ingestion (per kb_agent_{id} table), embedding cache hit rate and batch request throughput."""
+    return {
+        **knowledge_ingestor.status(),
+        "embedding_cache": embedding_cache.metrics(),
+        "embedding_requests": embed_request_pool.metrics(),
+        # Modo lazy: membros que ainda não receberam delegação (base não aberta)
+        "agents_pending_knowledge": [agent.description for agent in loaded_agents if getattr(agent, "knowledge_pending", False)],
+    }
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    """Stops knowledge ingestion, flushes buffered messages, drains the DB executor and closes pooled SQLite connections."""
+    knowledge_ingestor.stop()
+    embed_request_pool.close()
+    close_message_log()
+    shutdown_db_executor()
+    get_pool().close_all()
+
 if __name__ == "__main__":
     agent_os.serve(app="main:app", host="0.0.0.0", port=3000, reload=True)
@@ -12,7 +12,7 @@ import unicodedata
 import re
 from typing import Optional
 
-from core.repositories import ConversationRepository
+from core.repositories import AsyncConversationRepository, ConversationRepository
 
 
 # ---------------------------------------------------------------------------
@@ -152,6 +152,25 @@ class LGPDService:
         info = LGPDService.get_consent_status(phone_number)
         return bool(info.get("awaiting_response"))
 
+    # ------------------------------------------------------------------
+    # Variantes assíncronas (para uso no event loop do webhook)
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    async def aget_consent_status(phone_number: str) -> dict:
+        """Versão awaitable de get_consent_status — a consulta roda na thread do banco."""
+        return await AsyncConversationRepository.get_lgpd_status(phone_number)
+
+    @staticmethod
+    async def arecord_consent(phone_number: str, status: str):
+        """Versão awaitable de record_consent."""
+        await AsyncConversationRepository.set_lgpd_consent(phone_number, status)
+
+    @staticmethod
+    async def amark_awaiting(phone_number: str, waiting: bool = True):
+        """Versão awaitable de mark_awaiting."""
+        await AsyncConversationRepository.set_lgpd_awaiting(phone_number, waiting)
+
     # ------------------------------------------------------------------
     # Parsing da resposta do usuário
     # ------------------------------------------------------------------
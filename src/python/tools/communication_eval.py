@@ -1,7 +1,8 @@
-import sqlite3
 import json
 from agno.tools import Toolkit
-from core.config import DB_PATH
+from core.database import get_db_connection, release_db_connection
+from core.identity import canonical_user_id
+from core.repositories import flush_message_log
 
 class CommunicationEvalTool(Toolkit):
     def __init__(self):
@@ -17,14 +18,19 @@ class CommunicationEvalTool(Toolkit):
         :param trigger_message: The exact message sent by the user stating they were not understood.
         :return: A confirmation message.
         """
+        # The complaint itself may still be in the write-behind buffer.
+        flush_message_log()
+
+        conn = get_db_connection()
+        if not conn:
+            return "Error logging communication failure: database unavailable"
+
         try:
-            conn = sqlite3.connect(DB_PATH)
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
             # Fetch the most recent 5 messages for this user
             # We first find the user's conversation 
-            cursor.execute("SELECT id FROM conversations WHERE user_id = ?", (user_identifier,))
+            cursor.execute("SELECT id FROM conversations WHERE user_id = ?", (canonical_user_id(user_identifier),))
             conv_row = cursor.fetchone()
             
             last_messages_list = []
@@ -52,7 +58,8 @@ class CommunicationEvalTool(Toolkit):
             )
             
             conn.commit()
-            conn.close()
             return f"Communication failure logged successfully for user {user_identifier}. Context saved."
         except Exception as e:
             return f"Error logging communication failure: {str(e)}"
+        finally:
+            release_db_connection(conn)
@@ -1,6 +1,5 @@
-import sqlite3
 from agno.tools import Toolkit
-from core.config import DB_PATH
+from core.database import get_db_connection, release_db_connection
 
 class FeatureRequestTool(Toolkit):
     def __init__(self):
@@ -18,8 +17,11 @@ class FeatureRequestTool(Toolkit):
         :param importance: The importance level indicated by the user. Can be 'high', 'normal', or 'low'. Defaults to 'normal'.
         :return: A confirmation message.
         """
+        conn = get_db_connection()
+        if not conn:
+            return "Error logging feature request: database unavailable"
+
         try:
-            conn = sqlite3.connect(DB_PATH)
             cursor = conn.cursor()
             
             cursor.execute(
@@ -28,7 +30,8 @@ class FeatureRequestTool(Toolkit):
             )
             
             conn.commit()
-            conn.close()
             return f"Feature request logged successfully for user {user_identifier}."
         except Exception as e:
             return f"Error logging feature request: {str(e)}"
+        finally:
+            release_db_connection(conn)
@@ -151,7 +151,8 @@ def split_for_whatsapp(text: str, max_chars: int = 1200) -> list:
 
     Estratégia (em ordem de prioridade):
     1. Divide no parágrafo duplo (\n\n) — fronteira natural entre ideias.
-    2. Agrupa parágrafos curtos adjacentes até atingir max_chars.
+    2. Agrupa parágrafos curtos adjacentes até atingir max_chars; um título
+       ou linha terminada em ':' no fim de um grupo passa para o seguinte.
     3. Se um parágrafo individual ainda exceder max_chars, divide nas linhas (\n).
     4. Se uma linha exceder max_chars, divide em fronteiras de frase (. ! ?).
 
@@ -169,49 +170,82 @@ def split_for_whatsapp(text: str, max_chars: int = 1200) -> list:
     paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
 
     # ── 2. Agrupa parágrafos adjacentes até max_chars ───────────────────────
-    groups: list[str] = []
-    current = ""
-
-    for para in paragraphs:
-        if not current:
-            current = para
-        elif len(current) + 2 + len(para) <= max_chars:
-            current += "\n\n" + para
-        else:
-            groups.append(current)
-            current = para
-
-    if current:
-        groups.append(current)
+    grouper = _ParagraphGrouper(max_chars)
+    groups = [group for para in paragraphs for group in grouper.add(para)]
+    groups.extend(grouper.close())
+
+    # ── 3/4. Quebra grupos ainda grandes demais ─────────────────────────────
+    return [message for group in groups for message in _split_group(group, max_chars)]
+
+
+# Título convertido (linha inteira com ênfase, ex.: _Passos_) ou linha
+# terminada em ':', mesmo dentro de ênfase (_Passos:_)
+_LEAD_IN_RE = re.compile(r"(^[*_]+[^*_\n]+[*_]+|:[*_~]*)\s*$")
+
+
+class _ParagraphGrouper:
+    """Greedy grouping of adjacent paragraphs up to max_chars (step 2 of split_for_whatsapp)."""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self._paragraphs: list[str] = []
+        self._size = 0
+
+    def add(self, para: str) -> list:
+        """Adds one paragraph; returns the groups it closed."""
+        if not self._paragraphs or self._size + 2 + len(para) <= self.max_chars:
+            self._append(para)
+            return []
+        # Título ou "Passos:" não fecha um grupo: vai junto com o que apresenta
+        carried = []
+        if len(self._paragraphs) > 1 and _LEAD_IN_RE.search(self._paragraphs[-1]):
+            carried = [self._paragraphs.pop()]
+        closed = ["\n\n".join(self._paragraphs)]
+        self._paragraphs, self._size = [], 0
+        for part in carried:
+            self._append(part)
+        if carried and self._size + 2 + len(para) > self.max_chars:
+            closed.extend(self.close())
+        self._append(para)
+        return closed
+
+    def close(self) -> list:
+        """Returns the last open group, if any."""
+        group = "\n\n".join(self._paragraphs)
+        self._paragraphs, self._size = [], 0
+        return [group] if group else []
+
+    def _append(self, para: str) -> None:
+        self._size += len(para) + (2 if self._paragraphs else 0)
+        self._paragraphs.append(para)
+
+
+def _split_group(group: str, max_chars: int) -> list:
+    """Splits one paragraph group on lines (step 3), then sentences (step 4), if it exceeds max_chars."""
+    if len(group) <= max_chars:
+        return [group.strip()] if group.strip() else []
 
-    # ── 3. Quebra grupos ainda grandes demais nas linhas (\n) ───────────────
     result: list[str] = []
-
-    for group in groups:
-        if len(group) <= max_chars:
-            result.append(group)
-            continue
-
-        lines = group.split("\n")
-        chunk = ""
-        for line in lines:
-            if not chunk:
-                chunk = line
-            elif len(chunk) + 1 + len(line) <= max_chars:
-                chunk += "\n" + line
-            else:
-                # ── 4. Se uma linha isolada ainda for grande, divide em frases
-                if len(chunk) > max_chars:
-                    result.extend(_split_by_sentence(chunk, max_chars))
-                else:
-                    result.append(chunk)
-                chunk = line
-
-        if chunk:
+    lines = group.split("\n")
+    chunk = ""
+    for line in lines:
+        if not chunk:
+            chunk = line
+        elif len(chunk) + 1 + len(line) <= max_chars:
+            chunk += "\n" + line
+        else:
+            # ── 4. Se uma linha isolada ainda for grande, divide em frases
             if len(chunk) > max_chars:
                 result.extend(_split_by_sentence(chunk, max_chars))
             else:
                 result.append(chunk)
+            chunk = line
+
+    if chunk:
+        if len(chunk) > max_chars:
+            result.extend(_split_by_sentence(chunk, max_chars))
+        else:
+            result.append(chunk)
 
     return [r.strip() for r in result if r.strip()]
 
@@ -239,3 +273,67 @@ def _split_by_sentence(text: str, max_chars: int) -> list:
 
     return chunks
 
+
+
+# ---------------------------------------------------------------------------
+# Streaming
+# ---------------------------------------------------------------------------
+
+class WhatsAppStreamSplitter:
+    """
+    Versão incremental de split_for_whatsapp para respostas em streaming.
+
+    feed() recebe os pedaços de texto (Markdown) à medida que o modelo gera.
+    Cada parágrafo fechado por uma linha em branco (nunca dentro de um bloco
+    de código ```) é convertido com markdown_to_whatsapp e entra no mesmo
+    agrupamento de split_for_whatsapp: um grupo só sai quando o parágrafo
+    seguinte não cabe mais nele. Para uma resposta completa, as mensagens
+    são as mesmas de split_for_whatsapp(markdown_to_whatsapp(resposta)) —
+    uma resposta curta continua sendo uma mensagem só. flush() devolve o
+    restante ao fim da geração.
+    """
+
+    def __init__(self, max_chars: int = 1200):
+        self.max_chars = max_chars
+        self._buffer = ""
+        self._grouper = _ParagraphGrouper(max_chars)
+
+    def feed(self, delta: str) -> list:
+        self._buffer += delta
+        ready: list[str] = []
+        while True:
+            cut = self._next_boundary()
+            if cut is None:
+                return ready
+            paragraph, self._buffer = self._buffer[:cut], self._buffer[cut:].lstrip("\n")
+            ready.extend(self._emit(paragraph))
+
+    def flush(self) -> list:
+        ready = self._emit(self._buffer)
+        self._buffer = ""
+        for group in self._grouper.close():
+            ready.extend(_split_group(group, self.max_chars))
+        return ready
+
+    def _next_boundary(self) -> Optional[int]:
+        """Index of the first blank line outside a code block, or None."""
+        start = 0
+        while True:
+            i = self._buffer.find("\n\n", start)
+            if i < 0:
+                return None
+            if self._buffer.count("```", 0, i) % 2 == 0:
+                return i
+            start = i + 2
+
+    def _emit(self, paragraph: str) -> list:
+        converted = markdown_to_whatsapp(paragraph.strip())
+        if not converted:
+            return []
+        ready: list[str] = []
+        # Um bloco de código com linhas em branco vira vários parágrafos, como em split_for_whatsapp
+        for para in (p.strip() for p in converted.split("\n\n")):
+            if para:
+                for group in self._grouper.add(para):
+                    ready.extend(_split_group(group, self.max_chars))
+        return ready
@@ -0,0 +1,285 @@
+"""
+Cliente HTTP compartilhado para a WhatsApp Cloud (Graph) API.
+
+Um único httpx.AsyncClient de longa duração, com pool de conexões,
+keep-alive e HTTP/2 (quando o pacote `h2` está instalado), substitui os
+clientes criados a cada envio/upload/download — evitando um novo handshake
+TLS com graph.facebook.com por mensagem.
+
+Respostas 429 e 5xx (e erros de transporte) são repetidas com backoff
+exponencial, respeitando o cabeçalho Retry-After quando presente. O envio de
+mensagens (POST /messages) não é idempotente: um timeout de leitura ou um 5xx
+pode chegar depois que a Meta já aceitou a mensagem, e repetir duplicaria a
+mensagem para o usuário. Por isso o envio só é repetido quando a requisição
+certamente não foi processada — erro de conexão ou 429.
+
+Configuração em core/config.py (WHATSAPP_HTTP_*); WHATSAPP_GRAPH_BASE_URL
+permite apontar o cliente para um servidor local (stub) em testes.
+"""
+
+import asyncio
+import importlib.util
+import random
+from io import BytesIO
+from typing import Any, Optional, Union
+
+import httpx
+
+from agno.utils.log import log_error, log_warning
+from agno.utils.whatsapp import get_access_token, get_phone_number_id
+
+from core.config import (
+    WHATSAPP_API_VERSION,
+    WHATSAPP_GRAPH_BASE_URL,
+    WHATSAPP_HTTP_BACKOFF_BASE,
+    WHATSAPP_HTTP_BACKOFF_MAX,
+    WHATSAPP_HTTP_CONNECT_TIMEOUT,
+    WHATSAPP_HTTP_KEEPALIVE_EXPIRY,
+    WHATSAPP_HTTP_MAX_CONNECTIONS,
+    WHATSAPP_HTTP_MAX_KEEPALIVE,
+    WHATSAPP_HTTP_MAX_RETRIES,
+    WHATSAPP_HTTP_TIMEOUT,
+)
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+# A requisição nem chegou a sair: seguro repetir mesmo um POST
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# HTTP/2 só é habilitado se o extra httpx[http2] estiver instalado
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class MediaTooLargeError(Exception):
+    """Raised when a media download exceeds the configured size cap."""
+
+    def __init__(self, media_id: str, size: int, max_bytes: int):
+        self.media_id = media_id
+        self.size = size
+        self.max_bytes = max_bytes
+        super().__init__(f"media {media_id} has {size} bytes (limit {max_bytes})")
+
+
+class WhatsAppGraphClient:
+    """Owns the pooled AsyncClient used for every outbound Graph API call."""
+
+    def __init__(
+        self,
+        base_url: str = WHATSAPP_GRAPH_BASE_URL,
+        api_version: str = WHATSAPP_API_VERSION,
+        max_connections: int = WHATSAPP_HTTP_MAX_CONNECTIONS,
+        max_keepalive: int = WHATSAPP_HTTP_MAX_KEEPALIVE,
+        timeout: float = WHATSAPP_HTTP_TIMEOUT,
+        max_retries: int = WHATSAPP_HTTP_MAX_RETRIES,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_version = api_version
+        self.max_retries = max_retries
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=WHATSAPP_HTTP_KEEPALIVE_EXPIRY,
+        )
+        self._timeout = httpx.Timeout(timeout, connect=WHATSAPP_HTTP_CONNECT_TIMEOUT)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Criado sob demanda para nascer dentro do event loop do servidor
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=_HTTP2_AVAILABLE,
+                limits=self._limits,
+                timeout=self._timeout,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    # ------------------------------------------------------------------
+    # Requisições com retry
+    # ------------------------------------------------------------------
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}/{self.api_version}/{path.lstrip('/')}"
+
+    @staticmethod
+    def _auth_headers() -> dict:
+        return {"Authorization": f"Bearer {get_access_token()}"}
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), WHATSAPP_HTTP_BACKOFF_MAX)
+                except ValueError:
+                    pass
+        delay = min(WHATSAPP_HTTP_BACKOFF_BASE * (2 ** attempt), WHATSAPP_HTTP_BACKOFF_MAX)
+        return delay * (0.5 + random.random() / 2)
+
+    async def request(self, method: str, url: str, idempotent: Optional[bool] = None, **kwargs: Any) -> httpx.Response:
+        """
+        Sends a request through the shared client with exponential backoff.
+        Idempotent requests (GET etc., or idempotent=True) retry 429/5xx and
+        any transport error; the others only connection errors and 429.
+        Returns the final response (which may still be an error status) or
+        raises the last transport error.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in _IDEMPOTENT_METHODS
+        retry_errors = httpx.TransportError if idempotent else _NOT_SENT_ERRORS
+        retry_status = _RETRY_STATUS if idempotent else {429}
+        files = kwargs.get("files")
+        for attempt in range(self.max_retries + 1):
+            if files and attempt:
+                # Arquivos em BytesIO precisam voltar ao início para reenviar
+                for value in files.values():
+                    if hasattr(value[1], "seek"):
+                        value[1].seek(0)
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except retry_errors as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, None)
+                log_warning(f"WhatsApp API {method} {url} falhou ({e!r}); nova tentativa em {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code not in retry_status or attempt >= self.max_retries:
+                return response
+
+            delay = self._backoff(attempt, response)
+            log_warning(f"WhatsApp API {method} {url} respondeu {response.status_code}; nova tentativa em {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+        return response  # pragma: no cover - o loop sempre retorna antes
+
+    async def _post_message(self, payload: dict, idempotent: bool = False) -> dict:
+        url = self._url(f"{get_phone_number_id()}/messages")
+        response = await self.request("POST", url, idempotent=idempotent, headers=self._auth_headers(), json=payload)
+        if response.status_code >= 400:
+            log_error(f"WhatsApp send failed. Status: {response.status_code}, Body: {response.text}")
+        response.raise_for_status()
+        return response.json()
+
+    # ------------------------------------------------------------------
+    # Envio
+    # ------------------------------------------------------------------
+
+    async def send_text(self, recipient: str, text: str, preview_url: bool = False) -> dict:
+        return await self._post_message({
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": recipient,
+            "type": "text",
+            "text": {"preview_url": preview_url, "body": text},
+        })
+
+    async def send_audio(self, media_id: str, recipient: str) -> dict:
+        return await self._post_message({
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": recipient,
+            "type": "audio",
+            "audio": {"id": media_id},
+        })
+
+    async def send_image(self, media_id: str, recipient: str, text: Optional[str] = None) -> dict:
+        image = {"id": media_id}
+        if text:
+            image["caption"] = text
+        return await self._post_message({
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": recipient,
+            "type": "image",
+            "image": image,
+        })
+
+    async def typing_indicator(self, message_id: Optional[str]) -> None:
+        """Marks the inbound message as read and shows 'typing…' to the user."""
+        if not message_id:
+            return
+        try:
+            await self._post_message({
+                "messaging_product": "whatsapp",
+                "status": "read",
+                "message_id": message_id,
+                "typing_indicator": {"type": "text"},
+            }, idempotent=True)  # marcar como lida duas vezes não tem efeito
+        except httpx.HTTPError as e:
+            log_warning(f"Typing indicator failed: {e}")
+
+    # ------------------------------------------------------------------
+    # Mídia
+    # ------------------------------------------------------------------
+
+    async def upload_media(self, media_data: bytes, mime_type: str, filename: str) -> Union[str, dict]:
+        """Uploads media and returns its id, or {"error": ...} like agno's upload_media_async."""
+        url = self._url(f"{get_phone_number_id()}/media")
+        data = {"messaging_product": "whatsapp", "type": mime_type}
+        files = {"file": (filename, BytesIO(media_data), mime_type)}
+        try:
+            # Upload repetido só gera um media id a mais, que nunca é enviado
+            response = await self.request("POST", url, idempotent=True, headers=self._auth_headers(), data=data, files=files)
+        except httpx.HTTPError as e:
+            return {"error": str(e)}
+
+        if response.status_code >= 400:
+            log_error(f"Upload failed. Status: {response.status_code}, Body: {response.text}")
+            return {"error": f"Status {response.status_code}: {response.text}"}
+        return response.json().get("id")
+
+    async def get_media(self, media_id: str, max_bytes: Optional[int] = None) -> bytes:
+        """
+        Resolves a media id to its download URL and returns the bytes. Raises on
+        failure, or MediaTooLargeError if the file exceeds max_bytes (checked
+        against the reported size and again while streaming).
+        """
+        headers = self._auth_headers()
+        response = await self.request("GET", self._url(media_id), headers=headers)
+        response.raise_for_status()
+        info = response.json()
+        media_url = info.get("url")
+        if not media_url:
+            raise httpx.HTTPError(f"No download URL for media {media_id}")
+
+        if max_bytes is not None and int(info.get("file_size") or 0) > max_bytes:
+            raise MediaTooLargeError(media_id, int(info["file_size"]), max_bytes)
+
+        return await self._download(media_id, media_url, headers, max_bytes)
+
+    async def _download(self, media_id: str, url: str, headers: dict, max_bytes: Optional[int]) -> bytes:
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    if response.status_code in _RETRY_STATUS and attempt < self.max_retries:
+                        delay = self._backoff(attempt, response)
+                        log_warning(f"Media download {media_id} respondeu {response.status_code}; nova tentativa em {delay:.1f}s")
+                    else:
+                        response.raise_for_status()
+                        chunks = []
+                        size = 0
+                        async for chunk in response.aiter_bytes():
+                            size += len(chunk)
+                            if max_bytes is not None and size > max_bytes:
+                                raise MediaTooLargeError(media_id, size, max_bytes)
+                            chunks.append(chunk)
+                        return b"".join(chunks)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, None)
+                log_warning(f"Media download {media_id} falhou ({e!r}); nova tentativa em {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+        raise httpx.HTTPError(f"Media download {media_id} failed")  # pragma: no cover
@@ -0,0 +1,252 @@
+"""
+Políticas de debounce das mensagens recebidas pelo webhook.
+
+O debounce decide quanto esperar, depois da última mensagem de um usuário,
+antes de entregar o lote ao agente: esperar pouco divide uma ideia digitada
+em várias mensagens em várias execuções do Team (cada uma com seu custo de
+LLM); esperar demais atrasa a resposta de quem já terminou.
+
+- FixedDebouncePolicy: janela fixa (MESSAGE_DEBOUNCE_SECONDS), reduzida
+  quando a mensagem sinaliza fim de pensamento ('?', '!', '.', mídia).
+- AdaptiveDebouncePolicy: aprende, por usuário, a distribuição do intervalo
+  entre mensagens de uma mesma rajada (lognormal: média e variância móveis do
+  log do intervalo) e espera o quantil DEBOUNCE_QUANTILE dessa distribuição,
+  limitado a [DEBOUNCE_MIN_SECONDS, DEBOUNCE_MAX_SECONDS]. Enquanto o usuário
+  tem poucas amostras, usa a política fixa. O modelo fica em memória e é
+  persistido em lote na tabela user_typing_stats.
+
+Para comparar políticas com timestamps reais: benchmarks/sim_debounce.py.
+"""
+
+import math
+import time
+from abc import ABC, abstractmethod
+from statistics import NormalDist
+from typing import Iterable, Optional
+
+from agno.utils.log import log_error, log_info, log_warning
+
+from core.config import (
+    DEBOUNCE_MAX_SECONDS,
+    DEBOUNCE_MIN_SAMPLES,
+    DEBOUNCE_MIN_SECONDS,
+    DEBOUNCE_POLICY,
+    DEBOUNCE_QUANTILE,
+    DEBOUNCE_SESSION_GAP_SECONDS,
+)
+from core.repositories import AsyncTypingStatsRepository, TypingStatsRow
+
+# Sinais de fim de pensamento — disparam flush quase imediato
+FLUSH_TRIGGERS = ("?",)               # contém pergunta
+FLUSH_ENDINGS = ("!", ".", "…")       # termina com esses caracteres
+
+# timestamp do WhatsApp tem resolução de 1 s: intervalos "0" viram meio segundo
+_MIN_GAP_SECS = 0.5
+# Peso mínimo de uma amostra nova na média móvel (~últimas 20 rajadas)
+_MIN_ALPHA = 0.05
+
+
+def message_text(message: dict) -> str:
+    if message.get("type") == "text":
+        return message.get("text", {}).get("body", "").strip()
+    return ""
+
+
+def is_end_of_thought(message: dict) -> bool:
+    """True when the message looks like the end of what the user wanted to say."""
+    msg_text = message_text(message)
+    return (
+        any(trigger in msg_text for trigger in FLUSH_TRIGGERS)
+        or (len(msg_text) > 0 and msg_text[-1] in FLUSH_ENDINGS)
+        or message.get("type") not in ("text",)  # mídia = flush rápido
+    )
+
+
+def message_time(message: dict, default: Optional[float] = None) -> float:
+    """Send time of a WhatsApp message (epoch seconds), falling back to default/now."""
+    try:
+        return float(message["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        return default if default is not None else time.time()
+
+
+class DebouncePolicy(ABC):
+    """Chooses how long to wait for more messages before a user's batch is flushed."""
+
+    name = "base"
+    # Maior janela que a política pode devolver (usada pela varredura da fila)
+    max_window: float = DEBOUNCE_MAX_SECONDS
+
+    def observe(self, user_id: str, sent_at: float) -> None:
+        """Feeds the send time of a new message from user_id (in arrival order)."""
+
+    @abstractmethod
+    def window(self, user_id: str, message: dict) -> float:
+        """Seconds to wait after `message`, the latest one from user_id."""
+
+    async def load(self) -> None:
+        """Restores persisted state (called on startup)."""
+
+    async def flush(self) -> None:
+        """Persists pending state (called periodically and on shutdown)."""
+
+    def metrics(self) -> dict:
+        return {"policy": self.name}
+
+
+class FixedDebouncePolicy(DebouncePolicy):
+    """Same window for everyone, shortened when the message ends a thought."""
+
+    name = "fixed"
+
+    def __init__(self, debounce_secs: float, trigger_secs: float):
+        self.debounce_secs = debounce_secs
+        self.trigger_secs = trigger_secs
+        self.max_window = max(debounce_secs, trigger_secs)
+
+    def window(self, user_id: str, message: dict) -> float:
+        return self.trigger_secs if is_end_of_thought(message) else self.debounce_secs
+
+
+class TypingStats:
+    """Exponentially weighted mean/variance of log(inter-message gap) for one user."""
+
+    __slots__ = ("samples", "mean", "var", "last_at")
+
+    def __init__(self, samples: int = 0, mean: float = 0.0, var: float = 0.0, last_at: Optional[float] = None):
+        self.samples = samples
+        self.mean = mean
+        self.var = var
+        self.last_at = last_at
+
+    def add_gap(self, gap: float) -> None:
+        x = math.log(max(gap, _MIN_GAP_SECS))
+        self.samples += 1
+        if self.samples == 1:
+            self.mean, self.var = x, 0.0
+            return
+        # Média simples nas primeiras amostras, depois média móvel exponencial
+        alpha = max(1.0 / self.samples, _MIN_ALPHA)
+        delta = x - self.mean
+        self.mean += alpha * delta
+        self.var = (1 - alpha) * (self.var + alpha * delta * delta)
+
+    def quantile(self, z: float) -> float:
+        return math.exp(self.mean + z * math.sqrt(self.var))
+
+
+class AdaptiveDebouncePolicy(DebouncePolicy):
+    """
+    Waits for the DEBOUNCE_QUANTILE of each user's within-burst gap
+    distribution, clamped to [min_secs, max_secs]. Users with fewer than
+    min_samples gaps use the fallback policy.
+    """
+
+    name = "adaptive"
+
+    def __init__(
+        self,
+        fallback: DebouncePolicy,
+        min_secs: float = DEBOUNCE_MIN_SECONDS,
+        max_secs: float = DEBOUNCE_MAX_SECONDS,
+        quantile: float = DEBOUNCE_QUANTILE,
+        session_gap_secs: float = DEBOUNCE_SESSION_GAP_SECONDS,
+        min_samples: int = DEBOUNCE_MIN_SAMPLES,
+        persist: bool = True,
+    ):
+        self.fallback = fallback
+        self.min_secs = min_secs
+        self.max_secs = max(max_secs, min_secs)
+        self.max_window = max(self.max_secs, fallback.max_window)
+        self.z = NormalDist().inv_cdf(min(max(quantile, 0.5), 0.999))
+        self.session_gap_secs = session_gap_secs
+        self.min_samples = min_samples
+        self.persist = persist
+
+        self._stats: dict[str, TypingStats] = {}
+        self._dirty: set[str] = set()
+        self._adaptive_windows = 0
+        self._fallback_windows = 0
+
+    def observe(self, user_id: str, sent_at: float) -> None:
+        stats = self._stats.get(user_id)
+        if stats is None:
+            stats = self._stats[user_id] = TypingStats()
+        if stats.last_at is not None:
+            gap = sent_at - stats.last_at
+            # Fora de ordem ou nova conversa: não descreve o ritmo de digitação
+            if 0 <= gap <= self.session_gap_secs:
+                stats.add_gap(gap)
+        stats.last_at = max(sent_at, stats.last_at or sent_at)
+        self._dirty.add(user_id)
+
+    def window(self, user_id: str, message: dict) -> float:
+        stats = self._stats.get(user_id)
+        if stats is None or stats.samples < self.min_samples:
+            self._fallback_windows += 1
+            return self.fallback.window(user_id, message)
+
+        self._adaptive_windows += 1
+        wait_secs = stats.quantile(self.z)
+        if is_end_of_thought(message):
+            # Pontuação só encurta até o ritmo típico (mediana) do usuário
+            wait_secs = math.exp(stats.mean)
+        return min(max(wait_secs, self.min_secs), self.max_secs)
+
+    # ------------------------------------------------------------------
+    # Persistência (user_typing_stats)
+    # ------------------------------------------------------------------
+
+    def load_rows(self, rows: Iterable[TypingStatsRow]) -> None:
+        for user_id, samples, mean, var, last_at in rows:
+            if user_id not in self._stats:
+                self._stats[user_id] = TypingStats(samples, mean, var, last_at)
+
+    def dirty_rows(self) -> list[TypingStatsRow]:
+        rows = []
+        for user_id in self._dirty:
+            stats = self._stats[user_id]
+            rows.append((user_id, stats.samples, stats.mean, stats.var, stats.last_at))
+        return rows
+
+    async def load(self) -> None:
+        if not self.persist:
+            return
+        rows = await AsyncTypingStatsRepository.load_all()
+        self.load_rows(rows)
+        if rows:
+            log_info(f"Debounce: modelo de digitação carregado para {len(rows)} usuários")
+
+    async def flush(self) -> None:
+        if not self.persist or not self._dirty:
+            return
+        rows = self.dirty_rows()
+        self._dirty.clear()
+        if not await AsyncTypingStatsRepository.save_many(rows):
+            # Tenta de novo na próxima varredura
+            self._dirty.update(row[0] for row in rows)
+            log_error(f"Debounce: falha ao gravar modelo de digitação de {len(rows)} usuários")
+
+    def metrics(self) -> dict:
+        trained = sum(1 for stats in self._stats.values() if stats.samples >= self.min_samples)
+        return {
+            "policy": self.name,
+            "users": len(self._stats),
+            "trained_users": trained,
+            "adaptive_windows": self._adaptive_windows,
+            "fallback_windows": self._fallback_windows,
+            "min_seconds": self.min_secs,
+            "max_seconds": self.max_secs,
+        }
+
+
+def build_debounce_policy(
+    debounce_secs: float, trigger_secs: float, name: str = DEBOUNCE_POLICY, persist: bool = True
+) -> DebouncePolicy:
+    """Policy selected by DEBOUNCE_POLICY ("fixed" or "adaptive")."""
+    fixed = FixedDebouncePolicy(debounce_secs, trigger_secs)
+    if name == "adaptive":
+        return AdaptiveDebouncePolicy(fallback=fixed, persist=persist)
+    if name != "fixed":
+        log_warning(f"Debounce: política desconhecida '{name}', usando 'fixed'")
+    return fixed
@@ -0,0 +1,90 @@
+"""
+Deduplicação das mensagens entregues pelo webhook.
+
+A Meta reentrega o webhook quando a resposta demora, e cada reentrega com o
+mesmo id de mensagem dispararia uma nova execução do Team (e uma nova
+cobrança do LLM). WebhookDeduplicator descarta no event loop, sem tocar o
+banco, os ids que estão no LRU em memória; os demais são conferidos contra a
+tabela webhook_seen_ids (que sobrevive a restarts e é compartilhada entre
+workers) na mesma transação que os enfileira — ver
+InboundMessageRepository.accept_batch. Ids expiram após WEBHOOK_DEDUP_TTL_HOURS.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from core.config import WEBHOOK_DEDUP_CACHE_SIZE, WEBHOOK_DEDUP_TTL_HOURS
+from core.database import run_in_db_thread
+from core.repositories import SeenMessageRepository
+
+
+class WebhookDeduplicator:
+    """LRU of recently seen WhatsApp message ids in front of the persistent seen-ids table."""
+
+    def __init__(self, max_entries: int = WEBHOOK_DEDUP_CACHE_SIZE, ttl_hours: float = WEBHOOK_DEDUP_TTL_HOURS):
+        self.max_entries = max_entries
+        self.ttl = ttl_hours * 3600
+        # message_id -> seen_at (epoch)
+        self._recent: OrderedDict[str, float] = OrderedDict()
+
+        self.checked = 0
+        self.duplicates_memory = 0
+        self.duplicates_db = 0
+
+    def _remember_locally(self, message_id: str, seen_at: float) -> None:
+        self._recent[message_id] = seen_at
+        self._recent.move_to_end(message_id)
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+
+    def seen_since(self) -> float:
+        """Oldest seen_at that still blocks a redelivery."""
+        return time.time() - self.ttl
+
+    def drop_recent(self, messages: list[dict]) -> list[dict]:
+        """
+        Returns the messages whose id is not in the in-memory LRU, in order.
+        Repeated ids inside the same delivery are dropped as well.
+        """
+        now = time.time()
+        fresh: list[dict] = []
+        in_this_batch: set[str] = set()
+        for message in messages:
+            message_id = message.get("id")
+            if not message_id:
+                fresh.append(message)
+                continue
+            self.checked += 1
+            seen_at = self._recent.get(message_id)
+            if (seen_at is not None and now - seen_at < self.ttl) or message_id in in_this_batch:
+                if seen_at is not None:
+                    self._recent.move_to_end(message_id)
+                self.duplicates_memory += 1
+                continue
+            in_this_batch.add(message_id)
+            fresh.append(message)
+        return fresh
+
+    def record(self, messages: list[dict], results: list[Optional[bool]]) -> None:
+        """Feeds back the accept_batch results: counts duplicates found in the table and caches known ids."""
+        now = time.time()
+        for message, queued in zip(messages, results):
+            if queued is None or not message.get("id"):
+                continue
+            if queued is False:
+                self.duplicates_db += 1
+            self._remember_locally(message["id"], now)
+
+    async def purge_expired(self) -> int:
+        return await run_in_db_thread(SeenMessageRepository.purge_expired, time.time() - self.ttl)
+
+    def metrics(self) -> dict:
+        duplicates = self.duplicates_memory + self.duplicates_db
+        return {
+            "checked": self.checked,
+            "duplicates_dropped": duplicates,
+            "duplicates_from_memory": self.duplicates_memory,
+            "duplicates_from_db": self.duplicates_db,
+            "cached_ids": len(self._recent),
+        }
@@ -0,0 +1,274 @@
+"""
+Despachante das mensagens enviadas ao WhatsApp.
+
+Cada destinatário tem uma fila FIFO própria, esvaziada por uma única tarefa:
+as mensagens de um usuário saem sempre na ordem em que foram enfileiradas,
+enquanto usuários diferentes são atendidos em paralelo. Quem envia só
+enfileira (send_text/send_audio/send_image) e segue adiante; o ritmo entre
+mensagens do mesmo usuário (WHATSAPP_SEND_PACING_SECONDS) é um atraso de
+agendamento dentro do despachante, e não um sleep na corrotina da requisição.
+
+- Limite global: um token bucket (WHATSAPP_SEND_RATE mensagens/s, rajada de
+  WHATSAPP_SEND_BURST) mantém o envio abaixo do throughput da Cloud API.
+- Retry: fica só no WhatsAppGraphClient, que repete o envio apenas quando
+  ele certamente não chegou à API (erro de conexão, 429). O despachante não
+  repete de novo: um timeout de leitura ou 5xx pode ser uma mensagem já
+  entregue, e uma segunda camada de backoff seguraria a fila do usuário.
+- Status de entrega: o id (wamid) de cada mensagem enviada é guardado e os
+  callbacks de status do webhook (sent/delivered/read/failed) são aplicados
+  com on_status — daí saem as latências de entrega e leitura.
+"""
+
+import asyncio
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Any, Awaitable, Callable, Optional
+
+from agno.utils.log import log_error, log_info
+
+from core.config import (
+    WHATSAPP_DELIVERY_TRACK_SIZE,
+    WHATSAPP_SEND_BURST,
+    WHATSAPP_SEND_PACING_SECONDS,
+    WHATSAPP_SEND_RATE,
+)
+
+from .client import WhatsAppGraphClient
+from .metrics import LatencyHistogram
+
+# Latências de entrega/leitura vão de segundos a horas
+_DELIVERY_BUCKETS_MS = (500, 1000, 2000, 5000, 10000, 30000, 60000, 300000, 3600000)
+
+
+class TokenBucket:
+    """Global send-rate limiter; waiters are served in FIFO order."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Takes one token, waiting if needed. Returns the seconds waited."""
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+
+class OutboundMessage:
+    """A queued send. `future` resolves with the WhatsApp message id (or the send error)."""
+
+    __slots__ = ("recipient", "kind", "send", "enqueued_at", "future")
+
+    def __init__(self, recipient: str, kind: str, send: Callable[[], Awaitable[dict]]):
+        self.recipient = recipient
+        self.kind = kind
+        self.send = send
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class _Delivery:
+    __slots__ = ("recipient", "sent_at", "status", "updated_at")
+
+    def __init__(self, recipient: str, sent_at: float):
+        self.recipient = recipient
+        self.sent_at = sent_at
+        self.status = "sent"
+        self.updated_at = sent_at
+
+
+class OutboundDispatcher:
+    """Per-recipient ordered send queues behind a global token bucket."""
+
+    def __init__(
+        self,
+        client: WhatsAppGraphClient,
+        rate: float = WHATSAPP_SEND_RATE,
+        burst: int = WHATSAPP_SEND_BURST,
+        pacing_secs: float = WHATSAPP_SEND_PACING_SECONDS,
+        track_size: int = WHATSAPP_DELIVERY_TRACK_SIZE,
+    ):
+        self.client = client
+        self.pacing_secs = pacing_secs
+        self.track_size = track_size
+        self._bucket = TokenBucket(rate, burst)
+
+        # destinatário -> deque[OutboundMessage]
+        self._queues: dict[str, deque] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        # destinatário -> quando a próxima mensagem pode sair (monotonic)
+        self._next_send_at: dict[str, float] = {}
+        # wamid -> _Delivery (LRU limitado a track_size)
+        self._deliveries: "OrderedDict[str, _Delivery]" = OrderedDict()
+
+        self._counts: Counter = Counter()
+        self._status_counts: Counter = Counter()
+        self._rate_wait = 0.0
+        self._queue_latency = LatencyHistogram()
+        self._delivered_latency = LatencyHistogram(_DELIVERY_BUCKETS_MS)
+        self._read_latency = LatencyHistogram(_DELIVERY_BUCKETS_MS)
+
+    # ------------------------------------------------------------------
+    # Enfileiramento
+    # ------------------------------------------------------------------
+
+    def send_text(self, recipient: str, text: str) -> OutboundMessage:
+        return self.submit(recipient, "text", lambda: self.client.send_text(recipient=recipient, text=text))
+
+    def send_audio(self, recipient: str, media_id: str) -> OutboundMessage:
+        return self.submit(recipient, "audio", lambda: self.client.send_audio(media_id=media_id, recipient=recipient))
+
+    def send_image(self, recipient: str, media_id: str, text: Optional[str] = None) -> OutboundMessage:
+        return self.submit(
+            recipient, "image", lambda: self.client.send_image(media_id=media_id, recipient=recipient, text=text)
+        )
+
+    def submit(self, recipient: str, kind: str, send: Callable[[], Awaitable[dict]]) -> OutboundMessage:
+        """Queues send() behind the previous messages to the same recipient."""
+        message = OutboundMessage(recipient, kind, send)
+        key = self._key(recipient)
+        self._queues.setdefault(key, deque()).append(message)
+        self._counts["queued"] += 1
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+        return message
+
+    @staticmethod
+    def _key(recipient: str) -> str:
+        # O dashboard envia com o prefixo "wa:"; a fila é a mesma do usuário
+        return recipient.removeprefix("wa:")
+
+    # ------------------------------------------------------------------
+    # Envio
+    # ------------------------------------------------------------------
+
+    async def _drain(self, key: str) -> None:
+        queue = self._queues[key]
+        try:
+            while queue:
+                message = queue[0]
+                delay = self._next_send_at.get(key, 0.0) - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._rate_wait += await self._bucket.acquire()
+                self._queue_latency.observe((time.monotonic() - message.enqueued_at) * 1000)
+
+                await self._send(message)
+                queue.popleft()
+                self._next_send_at[key] = time.monotonic() + self.pacing_secs
+        finally:
+            # Sem await entre o fim do loop e a remoção: nenhum submit se perde
+            for message in queue:
+                if not message.future.done():
+                    message.future.cancel()
+            self._queues.pop(key, None)
+            self._workers.pop(key, None)
+            if self._next_send_at.get(key, 0.0) <= time.monotonic():
+                self._next_send_at.pop(key, None)
+
+    async def _send(self, message: OutboundMessage) -> None:
+        # Sem retry aqui: o client já repetiu o que era seguro repetir
+        try:
+            result = await message.send()
+        except Exception as e:
+            self._counts["failed"] += 1
+            log_error(f"Dispatcher: {message.kind} para {message.recipient} descartado: {e}")
+            if not message.future.done():
+                message.future.set_exception(e)
+                # Ninguém é obrigado a aguardar: evita "exception was never retrieved"
+                message.future.exception()
+            return
+
+        self._counts["sent"] += 1
+        wamid = self._message_id(result)
+        if wamid:
+            self._track(wamid, message.recipient)
+        if not message.future.done():
+            message.future.set_result(wamid)
+
+    @staticmethod
+    def _message_id(result: Any) -> Optional[str]:
+        try:
+            return result["messages"][0]["id"]
+        except (KeyError, IndexError, TypeError):
+            return None
+
+    # ------------------------------------------------------------------
+    # Status de entrega
+    # ------------------------------------------------------------------
+
+    def _track(self, wamid: str, recipient: str) -> None:
+        self._deliveries[wamid] = _Delivery(recipient, time.time())
+        while len(self._deliveries) > self.track_size:
+            self._deliveries.popitem(last=False)
+
+    def on_status(self, status_update: dict) -> None:
+        """Applies a webhook status callback (sent/delivered/read/failed) to a tracked message."""
+        delivery = self._deliveries.get(status_update.get("id"))
+        if delivery is None:
+            return
+        status_name = status_update.get("status", "unknown")
+        self._status_counts[status_name] += 1
+        try:
+            at = float(status_update.get("timestamp") or time.time())
+        except (TypeError, ValueError):
+            at = time.time()
+        elapsed_ms = max(at - delivery.sent_at, 0.0) * 1000
+        if status_name == "delivered" and delivery.status == "sent":
+            self._delivered_latency.observe(elapsed_ms)
+        elif status_name == "read" and delivery.status != "read":
+            if delivery.status == "sent":
+                # Às vezes o "read" chega sem o "delivered" antes
+                self._delivered_latency.observe(elapsed_ms)
+            self._read_latency.observe(elapsed_ms)
+        # "failed" sempre prevalece; os demais só avançam
+        if status_name == "failed" or delivery.status != "failed":
+            delivery.status = status_name
+            delivery.updated_at = at
+
+    def delivery_status(self, wamid: str) -> Optional[str]:
+        delivery = self._deliveries.get(wamid)
+        return delivery.status if delivery else None
+
+    # ------------------------------------------------------------------
+    # Métricas e encerramento
+    # ------------------------------------------------------------------
+
+    def metrics(self) -> dict:
+        return {
+            "queued": self._counts["queued"],
+            "sent": self._counts["sent"],
+            "failed": self._counts["failed"],
+            "pending": sum(len(q) for q in self._queues.values()),
+            "active_recipients": len(self._workers),
+            "rate_limit_wait_seconds": round(self._rate_wait, 3),
+            "queue_latency": self._queue_latency.snapshot(),
+            "tracked_deliveries": len(self._deliveries),
+            "delivery_statuses": dict(self._status_counts),
+            "delivered_latency": self._delivered_latency.snapshot(),
+            "read_latency": self._read_latency.snapshot(),
+        }
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """Gives queued messages up to `timeout` seconds to go out, then cancels the rest."""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        _, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            log_info(f"Dispatcher: {len(pending)} filas de envio canceladas no shutdown")
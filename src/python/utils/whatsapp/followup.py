@@ -0,0 +1,159 @@
+"""
+Follow-ups que chegam enquanto o agente ainda está gerando a resposta.
+
+Sem isso, a resposta do lote anterior (já desatualizada) é gerada e enviada
+até o fim e só então a nova mensagem vira outra execução do Team: o dobro de
+tokens, e a resposta que o usuário quer chega por último.
+
+Com RUN_FOLLOWUP_POLICY=merge, uma mensagem nova que chega até
+RUN_FOLLOWUP_WINDOW_SECONDS depois do início da geração cancela a execução
+em andamento — só antes de a resposta ser gravada no histórico ou enviada ao
+usuário. As mensagens do lote cancelado voltam para a fila persistente e a
+próxima execução as reivindica junto com a nova — o texto é mesclado em um
+único prompt.
+
+Tokens e latência economizados são estimativas, a partir das médias das
+execuções que terminaram.
+"""
+
+import asyncio
+import time
+from typing import Any, Optional
+
+from agno.utils.log import log_info
+
+from core.config import RUN_FOLLOWUP_POLICY, RUN_FOLLOWUP_WINDOW_SECONDS
+
+# Peso de uma execução nova nas médias móveis de duração/tokens
+_EWMA_ALPHA = 0.1
+
+
+def run_tokens(response: Any) -> Optional[int]:
+    """Total tokens reported by an agno run response (Metrics object or legacy dict of lists)."""
+    metrics = getattr(response, "metrics", None)
+    if metrics is None:
+        return None
+    value = metrics.get("total_tokens") if isinstance(metrics, dict) else getattr(metrics, "total_tokens", None)
+    if isinstance(value, list):
+        value = sum(v for v in value if v)
+    return int(value) if value else None
+
+
+class _InflightRun:
+    __slots__ = ("task", "text", "started_at", "superseded", "sending")
+
+    def __init__(self, task: asyncio.Task, text: str):
+        self.task = task
+        self.text = text
+        self.started_at = time.monotonic()
+        self.superseded = False
+        self.sending = False
+
+
+class FollowupPolicy:
+    """Tracks the agent run generating for each user and cancels it when a follow-up arrives in time."""
+
+    def __init__(self, mode: str = RUN_FOLLOWUP_POLICY, window_secs: float = RUN_FOLLOWUP_WINDOW_SECONDS):
+        self.enabled = mode == "merge"
+        self.window_secs = window_secs
+
+        # phone_number -> execução gerando (antes de qualquer envio)
+        self._inflight: dict[str, _InflightRun] = {}
+        # phone_number -> texto do lote cancelado (já gravado no histórico)
+        self._superseded_text: dict[str, str] = {}
+
+        self._avg_duration: Optional[float] = None
+        self._avg_tokens: Optional[float] = None
+        self._completed = 0
+        self._cancelled = 0
+        self._late_followups = 0
+        self._cancelled_tokens = 0.0
+        self._latency_saved = 0.0
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida de uma execução
+    # ------------------------------------------------------------------
+
+    def generating(self, phone_number: str, text: str) -> None:
+        """Marks the current task as generating a reply for phone_number (cancellable)."""
+        self._inflight[phone_number] = _InflightRun(asyncio.current_task(), text)
+
+    def finished(self, phone_number: str, response: Any = None) -> None:
+        """Generation ended (reply about to be sent): no longer cancellable; updates the averages."""
+        run = self._inflight.get(phone_number)
+        if run is None or run.superseded:
+            return  # cancelada: o registro fica para was_superseded
+        del self._inflight[phone_number]
+        if response is None:
+            return
+        self._completed += 1
+        duration = time.monotonic() - run.started_at
+        self._avg_duration = self._ewma(self._avg_duration, duration)
+        tokens = run_tokens(response)
+        if tokens:
+            self._avg_tokens = self._ewma(self._avg_tokens, tokens)
+
+    def sending(self, phone_number: str) -> None:
+        """The reply is being logged or sent: the run can no longer be cancelled."""
+        run = self._inflight.get(phone_number)
+        if run is not None:
+            run.sending = True
+
+    def was_superseded(self, phone_number: str) -> bool:
+        """True when the run of phone_number was cancelled by on_followup (pops the record)."""
+        run = self._inflight.get(phone_number)
+        if run is None or not run.superseded:
+            return False
+        del self._inflight[phone_number]
+        self._superseded_text[phone_number] = run.text
+        return True
+
+    def take_superseded_text(self, phone_number: str) -> Optional[str]:
+        """Text of the cancelled batch that the next run of phone_number already includes."""
+        return self._superseded_text.pop(phone_number, None)
+
+    # ------------------------------------------------------------------
+    # Chegada de uma mensagem nova
+    # ------------------------------------------------------------------
+
+    def on_followup(self, phone_number: str) -> bool:
+        """Cancels the in-flight run of phone_number if the policy allows. Returns True if cancelled."""
+        run = self._inflight.get(phone_number)
+        if run is None or run.superseded or run.sending or not self.enabled:
+            return False
+        elapsed = time.monotonic() - run.started_at
+        if elapsed > self.window_secs:
+            self._late_followups += 1
+            return False
+
+        run.superseded = True
+        run.task.cancel()
+        self._cancelled += 1
+        if self._avg_tokens:
+            self._cancelled_tokens += self._avg_tokens
+        if self._avg_duration:
+            self._latency_saved += max(self._avg_duration - elapsed, 0.0)
+        log_info(f"Follow-up: execução de {phone_number} cancelada após {elapsed:.1f}s — será refeita com a nova mensagem")
+        return True
+
+    # ------------------------------------------------------------------
+    # Métricas
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _ewma(current: Optional[float], value: float) -> float:
+        return value if current is None else current + _EWMA_ALPHA * (value - current)
+
+    def metrics(self) -> dict:
+        return {
+            "policy": "merge" if self.enabled else "off",
+            "window_seconds": self.window_secs,
+            "generating": len(self._inflight),
+            "completed_runs": self._completed,
+            "cancelled_runs": self._cancelled,
+            "late_followups": self._late_followups,
+            "avg_run_seconds": round(self._avg_duration, 3) if self._avg_duration else None,
+            "avg_run_tokens": round(self._avg_tokens) if self._avg_tokens else None,
+            "cancelled_tokens_estimate": round(self._cancelled_tokens),
+            "latency_saved_seconds_estimate": round(self._latency_saved, 3),
+        }
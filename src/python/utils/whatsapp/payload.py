@@ -0,0 +1,51 @@
+"""
+Leitura do payload do webhook da WhatsApp Cloud API.
+
+Uma única entrega pode trazer várias entries, cada uma com várias changes,
+e cada change com várias mensagens e/ou callbacks de status (sent,
+delivered, read, failed). parse_webhook_payload percorre tudo em uma
+passada e já agrupa as mensagens por usuário, na ordem de chegada, para que
+o debounce receba o lote inteiro de cada usuário de uma vez.
+
+O corpo é decodificado uma única vez, com orjson quando disponível.
+"""
+
+import json
+from typing import Any, NamedTuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson é opcional
+    orjson = None
+
+
+class WebhookBatch(NamedTuple):
+    # phone_number -> mensagens do usuário, na ordem do payload
+    messages_by_user: dict[str, list[dict]]
+    statuses: list[dict]
+
+    @property
+    def message_count(self) -> int:
+        return sum(len(messages) for messages in self.messages_by_user.values())
+
+
+def loads_body(raw: bytes) -> Any:
+    """Decodes the raw webhook body (the same bytes used for the signature check)."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def parse_webhook_payload(body: dict[str, Any]) -> WebhookBatch:
+    """Collects every message (grouped by sender) and every status callback of a webhook delivery."""
+    messages_by_user: dict[str, list[dict]] = {}
+    statuses: list[dict] = []
+
+    for entry in body.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            statuses.extend(value.get("statuses") or [])
+            for message in value.get("messages") or []:
+                messages_by_user.setdefault(message.get("from", "unknown"), []).append(message)
+
+    return WebhookBatch(messages_by_user, statuses)
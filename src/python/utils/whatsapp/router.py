@@ -1,5 +1,10 @@
 import asyncio
 import base64
+import os
+from collections import Counter
+import socket
+import time
+import uuid
 
 from os import getenv
 from typing import Optional
@@ -10,24 +15,46 @@ from fastapi.responses import PlainTextResponse
 from agno.agent.agent import Agent
 from agno.media import Audio, File, Image, Video
 from agno.team.team import Team
-from agno.tools.whatsapp import WhatsAppTools
 from agno.utils.log import log_error, log_info, log_warning
-from agno.utils.whatsapp import get_media_async, send_image_message_async, typing_indicator_async, upload_media_async
 
 from pathlib import Path
 
 # Fix incorrect import if present, though validate_webhook_signature might need fixing too if it was 'app...'
 # The user file had: from app.utils.whatsapp.security import validate_webhook_signature
 # I should change that to relative too if it exists.
+from .client import MediaTooLargeError, WhatsAppGraphClient
+from .debounce import DebouncePolicy, build_debounce_policy, message_text, message_time
+from .dedup import WebhookDeduplicator
+from .dispatcher import OutboundDispatcher
+from .followup import FollowupPolicy
+from .metrics import LatencyHistogram
+from .payload import loads_body, parse_webhook_payload
+from .scheduler import UserRunScheduler
 from .security import validate_webhook_signature
-from core.config import PROJECT_ROOT
-from core.repositories import ConversationRepository
+from core.config import (
+    INBOUND_LEASE_SECONDS,
+    INBOUND_RETENTION_HOURS,
+    INBOUND_SWEEP_SECONDS,
+    PROJECT_ROOT,
+    WEBHOOK_ACK_BUDGET_MS,
+    WHATSAPP_MEDIA_MAX_BYTES,
+    WHATSAPP_STREAM_RESPONSES,
+)
+from core.database import run_in_db_thread
+from core.history import history_builder
+from core.team import GENERATED_AUDIO_RE
+from core.repositories import (
+    AsyncConversationRepository,
+    AsyncInboundMessageRepository,
+    InboundMessageRepository,
+    conversation_state_cache,
+)
 from services.lgpd import LGPDService
-from utils.markdown_to_whatsapp import markdown_to_whatsapp, split_for_whatsapp
+from utils.markdown_to_whatsapp import WhatsAppStreamSplitter, markdown_to_whatsapp, split_for_whatsapp
 
-def get_ai_status(phone_number: str) -> str:
-    """Check AI status for a given phone number (user_id)."""
-    return ConversationRepository.get_ai_status(phone_number)
+async def get_ai_status(phone_number: str) -> str:
+    """Check AI status for a given phone number (user_id) without blocking the event loop."""
+    return await AsyncConversationRepository.get_ai_status(phone_number)
 
 
 from pydantic import BaseModel
@@ -42,11 +69,64 @@ class InternalSendAudioMessage(BaseModel):
     to: str
     audio_path: str
 
-def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Optional[Team] = None) -> APIRouter:
+class InternalInvalidateState(BaseModel):
+    # Sem 'to', invalida o cache de todos os usuários
+    to: Optional[str] = None
+
+def attach_routes(
+    router: APIRouter,
+    agent: Optional[Agent] = None,
+    team: Optional[Team] = None,
+    client: Optional[WhatsAppGraphClient] = None,
+    debounce_policy: Optional[DebouncePolicy] = None,
+) -> APIRouter:
     if agent is None and team is None:
         raise ValueError("Either agent or team must be provided.")
 
-    whatsapp_tools = WhatsAppTools(async_mode=True)
+    # Cliente HTTP compartilhado (pool + keep-alive) para toda chamada à Graph API
+    if client is None:
+        client = WhatsAppGraphClient()
+        router.add_event_handler("shutdown", client.aclose)
+
+    # Envios: fila ordenada por destinatário, token bucket global e status de entrega
+    dispatcher = OutboundDispatcher(client)
+
+    # Fila FIFO por usuário + teto global de execuções do Team
+    async def _notify_overload(phone_number: str):
+        await _send_whatsapp_message(
+            phone_number,
+            "Estou recebendo muitas mensagens agora. Por favor, aguarde um instante e envie sua mensagem novamente.",
+        )
+
+    scheduler = UserRunScheduler(on_shed=_notify_overload)
+
+    # Follow-up durante a geração: cancela e refaz com as mensagens mescladas
+    followups = FollowupPolicy()
+    # Do início da execução até a primeira mensagem da resposta sair
+    _first_reply_latency = LatencyHistogram(
+        buckets_ms=(250, 500, 1000, 2000, 3000, 5000, 8000, 13000, 20000, 30000, 60000)
+    )
+
+    # Reentregas da Meta (mesmo id de mensagem) são descartadas antes do debounce
+    dedup = WebhookDeduplicator()
+
+    # Callbacks de status (sent/delivered/read/failed) só alimentam contadores
+    _status_counts: Counter = Counter()
+    _webhook_counts: Counter = Counter()
+    # Tempo do POST /webhook até a resposta (caminho do ack)
+    _ack_latency = LatencyHistogram()
+
+    def _handle_statuses(statuses: list[dict]):
+        """Caminho barato para callbacks de status: nunca chega ao agente nem ao banco."""
+        for status_update in statuses:
+            status_name = status_update.get("status", "unknown")
+            _status_counts[status_name] += 1
+            dispatcher.on_status(status_update)
+            if status_name == "failed":
+                log_warning(
+                    f"WhatsApp delivery failed for {status_update.get('recipient_id')} "
+                    f"(message {status_update.get('id')}): {status_update.get('errors')}"
+                )
 
     # ----------------------------------------------------------------
     # Message Debounce — acumula mensagens rápidas do mesmo usuário
@@ -54,22 +134,35 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
     # Janela de espera em segundos (configurável via .env)
     _DEBOUNCE_SECS: float = float(getenv("MESSAGE_DEBOUNCE_SECONDS", "4"))
 
-    # phone_number -> lista de dicts de mensagem pendentes
-    _msg_buffer: dict[str, list[dict]] = {}
+    # As mensagens pendentes ficam na fila persistente (inbound_messages);
+    # em memória só ficam os timers.
     # phone_number -> asyncio.Task em andamento
     _debounce_tasks: dict[str, asyncio.Task] = {}
 
+    # Identifica este processo nos leases da fila persistente
+    _WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    # Espera antes de tentar de novo quando outro worker está com o usuário
+    _BUSY_RETRY_SECS: float = 2.0
+    _background_tasks: list[asyncio.Task] = []
+    # Marcado no shutdown: distingue o cancelamento do processo do de um
+    # follow-up (Task.cancelling() só existe a partir do Python 3.11)
+    _stopping = asyncio.Event()
+
+    _MEDIA_TYPES = ("image", "video", "audio", "document")
+
     def _combine_messages(messages: list) -> dict:
         """
         Mescla várias mensagens do mesmo usuário em uma única.
         Textos são concatenados com newline.
-        Mídia da primeira mensagem que a contenha é preservada.
+        Mídia da primeira mensagem que a contenha é preservada; todos os
+        anexos ficam em "_attachments" para o prefetch baixá-los.
         """
         if len(messages) == 1:
             return messages[0]
 
         base = dict(messages[0])
         text_parts = []
+        attachments = []
 
         for msg in messages:
             msg_type = msg.get("type", "text")
@@ -79,6 +172,8 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                 caption = msg.get(msg_type, {}).get("caption", "") if msg_type != "location" else ""
                 if caption:
                     text_parts.append(caption)
+                if msg_type in _MEDIA_TYPES:
+                    attachments.append((msg_type, msg[msg_type]["id"]))
                 # Se base ainda não tem mídia, pega desta
                 if base.get("type") == "text":
                     base["type"] = msg_type
@@ -94,67 +189,196 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                 base[media_type] = dict(base.get(media_type, {}))
                 base[media_type]["caption"] = combined_text
 
+        base["_attachments"] = attachments
         return base
 
 
-    # Sinais de fim de pensamento — disparam flush quase imediato
-    _FLUSH_TRIGGERS = ("?",)               # contém pergunta
-    _FLUSH_ENDINGS  = ("!", ".", "…")      # termina com esses caracteres
+    # ----------------------------------------------------------------
+    # Media prefetch — baixa todos os anexos em paralelo, uma única vez
+    # ----------------------------------------------------------------
+    def _collect_attachments(message: dict) -> list[tuple[str, str]]:
+        """Lista (tipo, media_id) de todas as mídias da mensagem (inclusive as mescladas)."""
+        if "_attachments" in message:
+            return list(message["_attachments"])
+        msg_type = message.get("type")
+        if msg_type in _MEDIA_TYPES:
+            return [(msg_type, message[msg_type]["id"])]
+        return []
+
+    async def _download_attachment(media_type: str, media_id: str) -> dict:
+        result = {"type": media_type, "id": media_id, "content": None, "media_url": None, "note": None}
+        try:
+            result["content"] = await client.get_media(media_id, max_bytes=WHATSAPP_MEDIA_MAX_BYTES)
+        except MediaTooLargeError as e:
+            log_warning(f"Skipping {media_type} {media_id}: {e}")
+            result["note"] = f"[{media_type} ignorado: arquivo maior que {WHATSAPP_MEDIA_MAX_BYTES // (1024 * 1024)} MB]"
+            return result
+        except Exception as e:
+            log_error(f"Failed to download {media_type} {media_id}: {e}")
+            result["note"] = f"[{media_type.capitalize()} Download Failed: {e}]"
+            return result
+
+        if media_type == "audio":
+            # Os mesmos bytes vão para o disco (dashboard) e para o modelo
+            try:
+                upload_dir = PROJECT_ROOT / "public" / "uploads" / "audio"
+                upload_dir.mkdir(parents=True, exist_ok=True)
+                filename = f"{media_id}.ogg"  # WhatsApp usually uses OGG/Opus for voice notes
+                await asyncio.to_thread((upload_dir / filename).write_bytes, result["content"])
+                log_info(f"Saved audio to {upload_dir / filename}")
+                result["media_url"] = f"/uploads/audio/{filename}"
+            except OSError as e:
+                log_error(f"Failed to save audio: {e}")
+        return result
+
+    async def _prefetch_media(attachments: list[tuple[str, str]]) -> list[dict]:
+        return list(await asyncio.gather(*(_download_attachment(t, i) for t, i in attachments)))
+
+    # ----------------------------------------------------------------
+
     # Delay curto após trigger (permite chegar última mensagem da mesma "rajada")
     _TRIGGER_FLUSH_SECS: float = 0.8
 
-    async def _schedule_debounced(message: dict):
+    # Quanto esperar por mais mensagens: fixo ou aprendido por usuário (DEBOUNCE_POLICY)
+    if debounce_policy is None:
+        debounce_policy = build_debounce_policy(_DEBOUNCE_SECS, _TRIGGER_FLUSH_SECS)
+
+    def _schedule_debounced(phone_number: str, messages: list[dict]):
         """
-        Adiciona a mensagem ao buffer do usuário e reinicia o timer de debounce.
-        Se a mensagem contém um sinal de fim de pensamento ('?', '!', '.'),
-        o timer é reduzido para _TRIGGER_FLUSH_SECS em vez do debounce completo.
+        Reinicia o timer de debounce do usuário para um lote do webhook que já
+        está gravado na fila persistente (o timer é recriado uma única vez).
+        A espera vem de debounce_policy, que primeiro observa o horário de
+        envio de cada mensagem (modelo de ritmo de digitação do usuário).
         Se já houver um timer rodando, ele é cancelado e recriado.
         """
-        phone_number = message.get("from", "unknown")
-
-        if phone_number not in _msg_buffer:
-            _msg_buffer[phone_number] = []
-        _msg_buffer[phone_number].append(message)
+        now = time.time()
+        for message in messages:
+            debounce_policy.observe(phone_number, message_time(message, now))
+
+        # Resposta ao lote anterior ainda sendo gerada: descarta e refaz com tudo
+        followups.on_followup(phone_number)
+
+        message = messages[-1]
+        wait_secs = debounce_policy.window(phone_number, message)
+        _arm_flush(phone_number, wait_secs)
+        log_info(
+            f"Debounce: {len(messages)} msg de {phone_number} na fila "
+            f"(espera: {wait_secs:.1f}s, última: '{message_text(message)[:40]}')"
+        )
 
+    def _arm_flush(phone_number: str, wait_secs: float):
+        """(Re)inicia o timer que entrega os pendentes do usuário ao scheduler."""
         # Cancela timer anterior se existir
         existing = _debounce_tasks.get(phone_number)
         if existing and not existing.done():
             existing.cancel()
 
-        # Detecta se a mensagem sinaliza fim do pensamento do usuário
-        wait_secs = _DEBOUNCE_SECS
-        msg_text = ""
-        if message.get("type") == "text":
-            msg_text = message.get("text", {}).get("body", "").strip()
-
-        is_end_of_thought = (
-            any(trigger in msg_text for trigger in _FLUSH_TRIGGERS)
-            or (len(msg_text) > 0 and msg_text[-1] in _FLUSH_ENDINGS)
-            or message.get("type") not in ("text",)  # mídia = flush rápido
-        )
-
-        if is_end_of_thought:
-            wait_secs = _TRIGGER_FLUSH_SECS
-            log_info(f"Debounce: fim de pensamento detectado em '{msg_text[:40]}' — flush em {wait_secs}s")
-
-        # Cria novo timer com a janela escolhida
         async def _timed_flush():
             try:
                 await asyncio.sleep(wait_secs)
             except asyncio.CancelledError:
                 return
-            messages = _msg_buffer.pop(phone_number, [])
             _debounce_tasks.pop(phone_number, None)
-            if not messages:
-                return
-            if len(messages) > 1:
-                log_info(f"Debounce: combinando {len(messages)} mensagens de {phone_number}")
-            combined = _combine_messages(messages)
-            await process_message(combined, agent, team)
+            # Só dispara depois que o lote anterior do mesmo usuário terminar
+            scheduler.submit(phone_number, lambda: _process_pending(phone_number))
+
+        _debounce_tasks[phone_number] = asyncio.create_task(_timed_flush())
+
+    async def _process_pending(phone_number: str):
+        """
+        Reivindica (com lease) todas as mensagens pendentes do usuário, processa
+        como um lote e só então as marca como concluídas. Se o processamento
+        falhar, o lote volta para a fila contando a tentativa; se o processo
+        cair no meio, o lease expira e ele também volta (at-least-once).
+        """
+        claimed = await AsyncInboundMessageRepository.claim_batch(phone_number, _WORKER_ID)
+        if claimed is None:
+            # Outro worker está respondendo este usuário; tenta de novo depois
+            if phone_number not in _debounce_tasks:
+                _arm_flush(phone_number, _BUSY_RETRY_SECS)
+            return
+        if not claimed:
+            return
+
+        ids = [row_id for row_id, _ in claimed]
+        messages = [message for _, message in claimed]
+        if len(messages) > 1:
+            log_info(f"Debounce: combinando {len(messages)} mensagens de {phone_number}")
+
+        heartbeat = asyncio.create_task(_keep_lease(ids))
+        # Tarefa própria: um follow-up cancela só a execução, não a fila do usuário
+        run = asyncio.create_task(process_message(_combine_messages(messages), agent, team))
+        try:
+            ok = await run
+        except asyncio.CancelledError:
+            if _stopping.is_set() or not followups.was_superseded(phone_number):
+                raise
+            # O lote volta inteiro para a fila e é reivindicado junto com o follow-up
+            await AsyncInboundMessageRepository.requeue(ids)
+            return
+        finally:
+            heartbeat.cancel()
+            followups.finished(phone_number)
+        if ok:
+            await AsyncInboundMessageRepository.complete(ids)
+        else:
+            # Falhou (o usuário já recebeu o pedido de desculpas): volta para a
+            # fila e conta a tentativa; depois de INBOUND_MAX_ATTEMPTS vira 'failed'
+            await AsyncInboundMessageRepository.release(ids)
+
+    async def _keep_lease(ids: list[int]):
+        while True:
+            await asyncio.sleep(INBOUND_LEASE_SECONDS / 3)
+            await AsyncInboundMessageRepository.renew_lease(ids, _WORKER_ID)
+
+    async def _sweep_inbound():
+        """
+        Retoma lotes órfãos: leases expirados (worker que caiu) e pendentes sem
+        timer — inclusive os que ficaram na fila antes de um restart.
+        """
+        while True:
+            try:
+                recovered = await AsyncInboundMessageRepository.recover_expired()
+                if recovered:
+                    log_info(f"Inbound: {recovered} mensagens com lease expirado voltaram para a fila")
 
-        task = asyncio.create_task(_timed_flush())
-        _debounce_tasks[phone_number] = task
-        log_info(f"Debounce: msg {len(_msg_buffer[phone_number])} de {phone_number} (espera: {wait_secs}s)")
+                cutoff = time.time() - (debounce_policy.max_window + INBOUND_SWEEP_SECONDS)
+                for phone_number in await AsyncInboundMessageRepository.pending_users(cutoff):
+                    if phone_number in _debounce_tasks or scheduler.has_work(phone_number):
+                        continue
+                    log_info(f"Inbound: retomando mensagens pendentes de {phone_number}")
+                    scheduler.submit(phone_number, lambda user=phone_number: _process_pending(user))
+
+                await AsyncInboundMessageRepository.purge_processed(time.time() - INBOUND_RETENTION_HOURS * 3600)
+                await dedup.purge_expired()
+                await debounce_policy.flush()
+            except Exception as e:
+                log_error(f"Inbound sweep failed: {e}")
+            await asyncio.sleep(INBOUND_SWEEP_SECONDS)
+
+    async def _start_inbound_queue():
+        await debounce_policy.load()
+        # Startup: pega imediatamente o que ficou pendente antes do restart
+        _background_tasks.append(asyncio.create_task(_sweep_inbound()))
+
+    async def _stop_inbound_queue():
+        _stopping.set()
+        for task in _background_tasks:
+            task.cancel()
+        _background_tasks.clear()
+        for task in list(_debounce_tasks.values()):
+            task.cancel()
+        await scheduler.close()
+        await debounce_policy.flush()
+        # Dá às respostas já enfileiradas a chance de sair antes de fechar o cliente
+        await dispatcher.close()
+        # Devolve à fila o que este processo tinha reivindicado
+        released = await run_in_db_thread(InboundMessageRepository.release_worker, _WORKER_ID)
+        if released:
+            log_info(f"Inbound: {released} mensagens devolvidas à fila no shutdown")
+
+    router.add_event_handler("startup", _start_inbound_queue)
+    router.add_event_handler("shutdown", _stop_inbound_queue)
     # ----------------------------------------------------------------
 
 
@@ -164,20 +388,21 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
         log_info(f"INTERNAL SEND: {body}")
         try:
              # Log the manual agent message to DB
-            if team and hasattr(team, 'log_message'):
+            if team and hasattr(team, 'alog_message'):
                 try:
                     # Ensure wa: prefix is present but not duplicated
                     log_to = body.to
                     if not log_to.startswith("wa:"):
                         log_to = f"wa:{log_to}"
                         
-                    team.log_message(log_to, "agent", body.message)
+                    await team.alog_message(log_to, "agent", body.message)
                     log_info(f"Logged manual agent message to {log_to}")
                 except Exception as log_err:
                     log_error(f"Failed to log manual message: {log_err}")
 
-            # Send via WhatsApp
-            await _send_whatsapp_message(body.to, body.message)
+            # Send via WhatsApp (aguarda a Graph API aceitar todas as partes)
+            queued = await _send_whatsapp_message(body.to, body.message)
+            await asyncio.gather(*(message.future for message in queued))
             return {"status": "sent"}
         except Exception as e:
             log_error(f"Error sending manual message: {str(e)}")
@@ -239,38 +464,10 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
             elif file_path.suffix.lower() == ".mp3":
                  mime_type = "audio/mpeg"
             
-            with open(file_path, "rb") as f:
-                audio_data = f.read()
-            async def _custom_upload_media(media_data: bytes, mime_type: str, filename: str):
-                from agno.utils.whatsapp import get_access_token, get_phone_number_id
-                import httpx
-                from io import BytesIO
-                
-                phone_number_id = get_phone_number_id()
-                url = f"https://graph.facebook.com/v22.0/{phone_number_id}/media"
-                access_token = get_access_token()
-                headers = {"Authorization": f"Bearer {access_token}"}
-                
-                data = {"messaging_product": "whatsapp", "type": mime_type}
-                
-                file_data = BytesIO(media_data)
-                files = {"file": (filename, file_data, mime_type)}
-                
-                try:
-                    async with httpx.AsyncClient() as client:
-                        response = await client.post(url, headers=headers, data=data, files=files)
-                        if response.status_code >= 400:
-                            log_error(f"Upload failed. Status: {response.status_code}, Body: {response.text}")
-                            return {"error": f"Status {response.status_code}: {response.text}"}
-                            
-                        return response.json().get("id")
-                except Exception as e:
-                    return {"error": str(e)}
-
             with open(file_path, "rb") as f:
                 audio_data = f.read()
                 
-            media_id = await _custom_upload_media(media_data=audio_data, mime_type=mime_type, filename=file_path.name)
+            media_id = await client.upload_media(media_data=audio_data, mime_type=mime_type, filename=file_path.name)
             log_info(f"Manual Audio Uploaded. Media ID: {media_id}")
 
             if not media_id or (isinstance(media_id, dict) and "error" in media_id):
@@ -278,11 +475,11 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                  raise Exception(f"WhatsApp Upload Failed: {media_id}")
 
             log_info(f"Sending Audio to {recipient_number} with Media ID {media_id}")
-            await send_audio_message_async(media_id=media_id, recipient=recipient_number)
+            await dispatcher.send_audio(recipient_number, media_id).future
             log_info("Audio sent successfully via WhatsApp API")
 
             # 5. Log to DB
-            if team and hasattr(team, 'log_message'):
+            if team and hasattr(team, 'alog_message'):
                 try:
                     log_to = body.to
                     if not log_to.startswith("wa:"):
@@ -304,7 +501,7 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                         except:
                             pass
                             
-                    team.log_message(log_to, "agent", "Manual Audio Message", media_type="audio", media_url=media_url)
+                    await team.alog_message(log_to, "agent", "Manual Audio Message", media_type="audio", media_url=media_url)
                 except Exception as log_err:
                     log_error(f"Failed to log manual audio message: {log_err}")
 
@@ -314,10 +511,43 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
             raise HTTPException(status_code=500, detail=str(e))
 
 
+    @router.post("/internal_invalidate_state")
+    async def internal_invalidate_state(body: InternalInvalidateState):
+        """Drop cached ai_status/LGPD state after an external change (e.g. dashboard pausing the AI)"""
+        conversation_state_cache.invalidate(body.to or None)
+        log_info(f"Conversation state cache invalidated for {body.to or 'all users'}")
+        return {"status": "invalidated"}
+
     @router.get("/status")
     async def status():
         return {"status": "available"}
 
+    @router.get("/scheduler_metrics")
+    async def scheduler_metrics():
+        """Queue depth and throughput of the per-user agent run scheduler, follow-up cancellations, time to first reply and history size"""
+        return {
+            **scheduler.metrics(),
+            "followups": followups.metrics(),
+            "first_reply_latency": _first_reply_latency.snapshot(),
+            "history": history_builder.metrics(),
+        }
+
+    @router.get("/outbound_metrics")
+    async def outbound_metrics():
+        """Outbound dispatcher: queued/sent/failed messages, rate-limit waits and delivery/read latency"""
+        return dispatcher.metrics()
+
+    @router.get("/webhook_metrics")
+    async def webhook_metrics():
+        """Webhook volume, status callbacks, duplicates dropped, ack latency and debounce policy"""
+        return {
+            **_webhook_counts,
+            "status_callbacks": dict(_status_counts),
+            "dedup": dedup.metrics(),
+            "ack_latency": _ack_latency.snapshot(),
+            "debounce": debounce_policy.metrics(),
+        }
+
     @router.get("/webhook")
     async def verify_webhook(request: Request):
         """Handle WhatsApp webhook verification"""
@@ -338,7 +568,15 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
 
     @router.post("/webhook")
     async def webhook(request: Request, background_tasks: BackgroundTasks):
-        """Handle incoming WhatsApp messages"""
+        """
+        Handle incoming WhatsApp messages (fast-ack).
+
+        Critical path: raw body → HMAC → a single parse → in-memory dedup →
+        one transaction that dedups against the seen-ids table and queues the
+        messages → 200. Status callbacks and debounce timers run after the
+        response is sent.
+        """
+        started = time.perf_counter()
         try:
             # Get raw payload for signature validation
             payload = await request.body()
@@ -349,101 +587,117 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                 log_warning("Invalid webhook signature")
                 raise HTTPException(status_code=403, detail="Invalid signature")
 
-            body = await request.json()
+            # Mesmos bytes da assinatura, decodificados uma única vez
+            body = loads_body(payload)
 
             # Validate webhook data
             if body.get("object") != "whatsapp_business_account":
                 log_warning(f"Received non-WhatsApp webhook object: {body.get('object')}")
                 return {"status": "ignored"}
 
-            # Process messages in background
-            for entry in body.get("entry", []):
-                for change in entry.get("changes", []):
-                    messages = change.get("value", {}).get("messages", [])
-
-                    if not messages:
-                        print("DEBUG: Webhook hit but no messages found.")
-                        continue
-
-                    message = messages[0]
-                    print(f"DEBUG: Webhook received message: {message}")
-                    await _schedule_debounced(message)
+            batch = parse_webhook_payload(body)
+            _webhook_counts["deliveries"] += 1
+            _webhook_counts["messages"] += batch.message_count
+            _webhook_counts["statuses"] += len(batch.statuses)
+
+            # Todas as mensagens de todas as entries/changes, agrupadas por usuário
+            fresh = dedup.drop_recent(
+                [message for messages in batch.messages_by_user.values() for message in messages]
+            )
+            accepting = None
+            if fresh:
+                # Persiste antes do 200: sobrevive a reload/crash e ignora reentregas
+                accepting = asyncio.ensure_future(AsyncInboundMessageRepository.accept_batch(fresh, dedup.seen_since()))
+                try:
+                    await asyncio.wait_for(asyncio.shield(accepting), WEBHOOK_ACK_BUDGET_MS / 1000)
+                except asyncio.TimeoutError:
+                    # Responde dentro do orçamento; a gravação termina em background
+                    _webhook_counts["ack_budget_exceeded"] += 1
+                    log_warning(f"Webhook: fila não respondeu em {WEBHOOK_ACK_BUDGET_MS} ms — ack antes da gravação")
 
+            background_tasks.add_task(_after_ack, batch, fresh, accepting)
             return {"status": "processing"}
 
+        except HTTPException:
+            raise
         except Exception as e:
             log_error(f"Error processing webhook: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            _ack_latency.observe((time.perf_counter() - started) * 1000)
+
+    async def _after_ack(batch, fresh: list[dict], accepting: Optional[asyncio.Future]):
+        """Trabalho do webhook que não precisa atrasar o 200: status e timers de debounce."""
+        if batch.statuses:
+            _handle_statuses(batch.statuses)
+        if not fresh:
+            if batch.message_count:
+                log_info(f"Webhook: {batch.message_count} mensagens já recebidas (reentrega) — ignoradas")
+            return
+
+        results = await accepting
+        dedup.record(fresh, results)
+        queued = sum(1 for result in results if result)
+        if queued < batch.message_count:
+            log_info(f"Webhook: {batch.message_count - queued} mensagens já recebidas (reentrega) — ignoradas")
+
+        by_user: dict[str, list[dict]] = {}
+        unqueued: dict[str, list[dict]] = {}
+        for message, result in zip(fresh, results):
+            target = by_user if result else unqueued if result is None else None
+            if target is not None:
+                target.setdefault(message.get("from", "unknown"), []).append(message)
+
+        for phone_number, messages in by_user.items():
+            _schedule_debounced(phone_number, messages)
+
+        for phone_number, messages in unqueued.items():
+            # Banco indisponível: processa só em memória, sem durabilidade
+            log_warning(f"Debounce: fila persistente indisponível, processando {len(messages)} mensagens de {phone_number} direto")
+            combined = _combine_messages(messages)
+            scheduler.submit(phone_number, lambda combined=combined: process_message(combined, agent, team))
 
-    async def process_message(message: dict, agent: Optional[Agent], team: Optional[Team]):
-        """Process a single WhatsApp message in the background"""
+    async def process_message(message: dict, agent: Optional[Agent], team: Optional[Team]) -> bool:
+        """
+        Process a single WhatsApp message in the background. Errors are logged
+        and answered with an apology; returns False in that case so the caller
+        can put the inbound batch back in the queue.
+        """
         log_info(message)
 
+        prefetch: Optional[asyncio.Task] = None
         try:
             message_text = ""
-            message_image = None
-            message_video = None
-            message_audio = None
-            message_doc = None
-            
+
             saved_media_type = None
             saved_media_url = None
-            
+
             message_id = message.get("id")
-            await typing_indicator_async(message_id)
 
             match message.get("type"):
                 case "text":
                     message_text = message["text"]["body"]
                 case "image":
-                    try:
-                        message_text = message["image"]["caption"]
-                    except Exception:
-                        message_text = "Describe the image"
-                    finally:
-                        message_image = message["image"]["id"]
+                    message_text = message["image"].get("caption") or "Describe the image"
                 case "video":
-                    try:
-                        message_text = message["video"]["caption"]
-                    except Exception:
-                        message_text = "Describe the video"
-                    finally:
-                        message_video = message["video"]["id"]
+                    message_text = message["video"].get("caption") or "Describe the video"
                 case "audio":
                     message_text = "Audio message received"
-                    message_audio = message["audio"]["id"]
-                    
-                    try:
-                        # Download audio
-                        audio_content = await get_media_async(message_audio)
-                        if audio_content:
-                             # Ensure upload dir exists
-                             upload_dir = PROJECT_ROOT / "public" / "uploads" / "audio"
-                             upload_dir.mkdir(parents=True, exist_ok=True)
-                             
-                             filename = f"{message_audio}.ogg" # WhatsApp usually uses OGG/Opus for voice notes
-                             file_path = upload_dir / filename
-                             
-                             with open(file_path, "wb") as f:
-                                 f.write(audio_content)
-                                 
-                             log_info(f"Saved audio to {file_path}")
-                             
-                             # Set variables for logging
-                             saved_media_type = "audio"
-                             saved_media_url = f"/uploads/audio/{filename}"
-                             
-                    except Exception as e:
-                         log_error(f"Failed to download audio: {e}")
-                         message_text = f"[Audio Download Failed: {e}]"
                 case "document":
                     message_text = "Process the document"
-                    message_doc = message["document"]["id"]
                 case "location":
                     # TODO: Alterar prompt para um mais adequado com armazenamento.
                     message_text = f"""Peça ao Zé da Caderneta que guarde as seguintes coordenadas Lat: {message['location']['latitude']} Long: {message['location']['longitude']}. Em seguida, peça ao Pedrão Agrônomo que gere uma visualização da minha propriedade rural."""
                 case _:
-                    return
+                    await client.typing_indicator(message_id)
+                    return True
+
+            # Downloads começam já, em paralelo entre si e com as checagens de status/LGPD
+            attachments = _collect_attachments(message)
+            if attachments:
+                prefetch = asyncio.create_task(_prefetch_media(attachments))
+
+            await client.typing_indicator(message_id)
 
             phone_number = message["from"]
             log_info(f"Processing message from {phone_number}: {message_text}")
@@ -452,7 +706,7 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
             with open("debug_log.txt", "a") as f:
                 f.write(f"DEBUG: Checking AI status for {phone_number}\n")
             
-            status = get_ai_status(phone_number)
+            status = await get_ai_status(phone_number)
             
             with open("debug_log.txt", "a") as f:
                 f.write(f"DEBUG: Status for {phone_number} is '{status}'\n")
@@ -464,32 +718,25 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                 
                 # Try to log the user message to DB so it appears in history
                 # We assume 'team' is LoggingTeam instance
-                if team and hasattr(team, 'log_message'):
+                if team and hasattr(team, 'alog_message'):
                      try:
                          # log_message(user_id, sender, content, media_type, media_url)
-                         
-                         # Check if we have saved media from the case above
-                         # Note: The logic inside 'case "audio"' needs to set saved_media_type/url
-                         # I need to update the replacement above to set these variables
-                         
-                         media_type = saved_media_type
-                         media_url = saved_media_url
-                         
-                         # Re-infer from message_audio if needed? No, better to set in case.
-                         if message_audio and not media_url: 
-                             # If we failed to download or logic above didn't set it (due to scope issues if I mess up)
-                             pass
-
-                         team.log_message(f"wa:{phone_number}", "user", message_text, media_type, media_url)
+                         # O áudio salvo pelo prefetch aparece no histórico do dashboard
+                         for item in (await prefetch if prefetch else []):
+                             if item["media_url"]:
+                                 saved_media_type, saved_media_url = item["type"], item["media_url"]
+                                 break
+
+                         await team.alog_message(f"wa:{phone_number}", "user", message_text, saved_media_type, saved_media_url)
                          log_info("Logged user message to DB (AI Paused)")
                      except Exception as log_err:
                          log_error(f"Failed to log message during pause: {log_err}")
                 
-                return # Stop processing
+                return True # Stop processing
             # ----------------------
 
             # --- LGPD CONSENT LOGIC ---
-            lgpd_info = LGPDService.get_consent_status(phone_number)
+            lgpd_info = await LGPDService.aget_consent_status(phone_number)
             lgpd_status = lgpd_info["status"]
             lgpd_awaiting = lgpd_info["awaiting_response"]
 
@@ -500,8 +747,8 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                 await _send_whatsapp_message(phone_number, LGPDService.get_reconsideration_message())
                 for policy_msg in LGPDService.get_policy_messages():
                     await _send_whatsapp_message(phone_number, policy_msg)
-                LGPDService.mark_awaiting(phone_number, waiting=True)
-                return
+                await LGPDService.amark_awaiting(phone_number, waiting=True)
+                return True
 
             elif lgpd_status == "accepted":
                 # Tudo certo — prossegue para a IA normalmente
@@ -513,52 +760,99 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                 decision = LGPDService.parse_consent_response(message_text)
 
                 if decision == "accepted":
-                    LGPDService.record_consent(phone_number, "accepted")
+                    await LGPDService.arecord_consent(phone_number, "accepted")
                     log_info(f"LGPD: {phone_number} accepted consent.")
                     await _send_whatsapp_message(phone_number, LGPDService.get_consent_accepted_message())
                 elif decision == "rejected":
-                    LGPDService.record_consent(phone_number, "rejected")
+                    await LGPDService.arecord_consent(phone_number, "rejected")
                     log_info(f"LGPD: {phone_number} rejected consent.")
                     await _send_whatsapp_message(phone_number, LGPDService.get_consent_rejected_message())
                 else:
                     # Resposta não reconhecida — reenvia o pedido
                     log_info(f"LGPD: Unrecognized response from {phone_number}: '{message_text}'")
                     await _send_whatsapp_message(phone_number, LGPDService.get_consent_invalid_message())
-                return  # Não processa como mensagem da IA
+                return True  # Não processa como mensagem da IA
 
             else:
                 # Primeira interação — envia a política e aguarda resposta
                 log_info(f"LGPD: Sending privacy policy to {phone_number}.")
                 for policy_msg in LGPDService.get_policy_messages():
                     await _send_whatsapp_message(phone_number, policy_msg)
-                LGPDService.mark_awaiting(phone_number, waiting=True)
-                return  # Aguarda resposta na próxima mensagem
+                await LGPDService.amark_awaiting(phone_number, waiting=True)
+                return True  # Aguarda resposta na próxima mensagem
             # --------------------------
 
+            # --- MEDIA ---
+            media_inputs = {"image": [], "document": [], "video": [], "audio": []}
+            notes = []
+            for item in (await prefetch if prefetch else []):
+                if item["content"] is None:
+                    notes.append(item["note"])
+                    continue
+                media_inputs[item["type"]].append(item["content"])
+                if item["media_url"] and not saved_media_url:
+                    saved_media_type, saved_media_url = item["type"], item["media_url"]
+            if notes:
+                message_text = "\n".join([message_text, *notes])
+
+            images = [Image(content=c) for c in media_inputs["image"]] or None
+            files = [File(content=c) for c in media_inputs["document"]] or None
+            videos = [Video(content=c) for c in media_inputs["video"]] or None
+            audio = [Audio(content=c) for c in media_inputs["audio"]] or None
+            # --------------
+
+            # Cancelável por um follow-up até a resposta ficar pronta
+            followups.generating(phone_number, message_text)
+            # Parte do texto já foi gravada por uma execução cancelada: grava só o novo
+            log_input = {}
+            superseded_text = followups.take_superseded_text(phone_number)
+            if superseded_text and message_text.startswith(superseded_text):
+                log_input["log_input"] = message_text[len(superseded_text):].lstrip("\n")
+
             # TODO: Só temos Team, não precisa do agent.
             # Generate and send response
-            if agent:
-                response = await agent.arun(
-                    message_text,
-                    user_id=phone_number,
-                    session_id=f"wa:{phone_number}",
-                    images=[Image(content=await get_media_async(message_image))] if message_image else None,
-                    files=[File(content=await get_media_async(message_doc))] if message_doc else None,
-                    videos=[Video(content=await get_media_async(message_video))] if message_video else None,
-                    audio=[Audio(content=await get_media_async(message_audio))] if message_audio else None,
-                )
-            elif team:
-                response = await team.arun(
-                    message_text,
-                    user_id=phone_number,
-                    session_id=f"wa:{phone_number}",
-                    files=[File(content=await get_media_async(message_doc))] if message_doc else None,
-                    images=[Image(content=await get_media_async(message_image))] if message_image else None,
-                    videos=[Video(content=await get_media_async(message_video))] if message_video else None,
-                    audio=[Audio(content=await get_media_async(message_audio))] if message_audio else None,
-                    media_type=saved_media_type,
-                    media_url=saved_media_url,
-                )
+            run_started = time.perf_counter()
+            streamed = 0
+            async with scheduler.run_slot():
+                if agent:
+                    response = await agent.arun(
+                        message_text,
+                        user_id=phone_number,
+                        session_id=f"wa:{phone_number}",
+                        images=images,
+                        files=files,
+                        videos=videos,
+                        audio=audio,
+                    )
+                elif team:
+                    team_kwargs = dict(
+                        user_id=phone_number,
+                        session_id=f"wa:{phone_number}",
+                        files=files,
+                        images=images,
+                        videos=videos,
+                        audio=audio,
+                        media_type=saved_media_type,
+                        media_url=saved_media_url,
+                        # A resposta vai para o histórico: daqui em diante um
+                        # follow-up não cancela mais, senão ela seria gravada sem ser enviada
+                        on_reply_ready=lambda: followups.sending(phone_number),
+                        **log_input,
+                    )
+                    if WHATSAPP_STREAM_RESPONSES and hasattr(team, "arun_stream"):
+                        response, streamed = await _stream_reply(
+                            phone_number,
+                            lambda on_content: team.arun_stream(message_text, on_content, **team_kwargs),
+                            run_started,
+                        )
+                    else:
+                        response = await team.arun(message_text, **team_kwargs)
+            followups.finished(phone_number, response)
+            if streamed:
+                # O texto já foi entregue parágrafo a parágrafo (e gravado no histórico)
+                response.content = ""
+            else:
+                _first_reply_latency.observe((time.perf_counter() - run_started) * 1000)
 
             if response.reasoning_content:
                 await _send_whatsapp_message(phone_number, f"Reasoning: \n{response.reasoning_content}", italics=True)
@@ -579,13 +873,13 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                     elif audio_path.suffix == ".mp3":
                         mime_type = "audio/mpeg"
                     
-                    media_id = await upload_media_async(media_data=audio_data, mime_type=mime_type, filename=f"audio{audio_path.suffix}")
+                    media_id = await client.upload_media(media_data=audio_data, mime_type=mime_type, filename=f"audio{audio_path.suffix}")
                     
                     if not isinstance(media_id, str) and "error" in media_id:
                          log_error(f"Failed to upload audio to WhatsApp: {media_id}")
                          await _send_whatsapp_message(phone_number, response.content)
                     else:
-                        await send_audio_message_async(media_id=media_id, recipient=phone_number)
+                        dispatcher.send_audio(phone_number, media_id)
                         
                 except Exception as e:
                     log_error(f"Failed to send audio response: {e}")
@@ -611,8 +905,8 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                     if "mp3" in mime_type: filename = "audio.mp3"
                     elif "ogg" in mime_type: filename = "audio.ogg"
                     
-                    media_id = await upload_media_async(media_data=audio_content, mime_type=mime_type, filename=filename)
-                    await send_audio_message_async(media_id=media_id, recipient=phone_number)
+                    media_id = await client.upload_media(media_data=audio_content, mime_type=mime_type, filename=filename)
+                    dispatcher.send_audio(phone_number, media_id)
 
                 except Exception as e:
                     log_error(f"Failed to send audio response (obj): {e}")
@@ -640,13 +934,14 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                         log_error(f"Unexpected image content type: {type(image_content)} for user {phone_number}")
 
                     if image_bytes:
-                        media_id = await upload_media_async(media_data=image_bytes, mime_type="image/png", filename="image.png")
-                        await send_image_message_async(media_id=media_id, recipient=phone_number, text=response.content)
+                        media_id = await client.upload_media(media_data=image_bytes, mime_type="image/png", filename="image.png")
+                        dispatcher.send_image(phone_number, media_id, text=response.content)
                     else:
                         log_warning(f"Could not process image content for user {phone_number}. Type: {type(image_content)}")
                         await _send_whatsapp_message(phone_number, response.content)  # type: ignore
             else:
                 await _send_whatsapp_message(phone_number, response.content)  # type: ignore
+            return True
 
         except Exception as e:
             log_error(f"Error processing message: {str(e)}")
@@ -655,46 +950,65 @@ def attach_routes(router: APIRouter, agent: Optional[Agent] = None, team: Option
                 await _send_whatsapp_message(phone_number, "Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente mais tarde.")
             except Exception as send_error:
                 log_error(f"Error sending error message: {str(send_error)}")
+            return False
+        finally:
+            # Respostas antecipadas (LGPD) não usam as mídias
+            if prefetch and not prefetch.done():
+                prefetch.cancel()
 
-    async def _send_whatsapp_message(recipient: str, message: str, italics: bool = False):
+    async def _send_whatsapp_message(recipient: str, message: str, italics: bool = False) -> list:
+        """
+        Enfileira a resposta no dispatcher e retorna as OutboundMessage (quem
+        precisa confirmar o envio aguarda .future). A pausa entre as partes é
+        agendada pelo dispatcher, não segura esta corrotina.
+        """
         # Converte Markdown para formatação compatível com WhatsApp
         message = markdown_to_whatsapp(message)
 
         # Divide em múltiplas mensagens de forma semântica e humanizada
         batches = split_for_whatsapp(message)
 
+        queued = []
         for batch in batches:
             if italics:
                 # Formata cada linha em itálico
-                formatted = "\n".join(f"_{line}_" if line.strip() else "" for line in batch.split("\n"))
-                await whatsapp_tools.send_text_message_async(recipient=recipient, text=formatted)
-            else:
-                await whatsapp_tools.send_text_message_async(recipient=recipient, text=batch)
-
-            # Pequena pausa entre mensagens para simular ritmo humano
-            if len(batches) > 1:
-                await asyncio.sleep(0.6)
-
-    async def send_audio_message_async(media_id: str, recipient: str):
-        """Send an audio message to a WhatsApp user."""
-        log_info(f"Sending WhatsApp audio to {recipient}")
-        
-        # Best approach: Use the access token from whatsapp_tools and make raw call.
-        
-        url = f"{whatsapp_tools.base_url}/{whatsapp_tools.version}/{whatsapp_tools.phone_number_id}/messages"
-        headers = whatsapp_tools._get_headers()
-        
-        data = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": recipient,
-            "type": "audio",
-            "audio": {"id": media_id}
-        }
-        
-        import httpx
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(url, headers=headers, json=data)
-            resp.raise_for_status()
+                batch = "\n".join(f"_{line}_" if line.strip() else "" for line in batch.split("\n"))
+            queued.append(dispatcher.send_text(recipient, batch))
+        return queued
+
+    async def _stream_reply(phone_number: str, run, run_started: float) -> tuple:
+        """
+        Executa run(on_content) entregando ao dispatcher cada mensagem da
+        resposta assim que fica completa (WhatsAppStreamSplitter); ordem e
+        ritmo ficam com o dispatcher, então a geração nunca espera um envio.
+        Trechos com o caminho de um áudio gerado não são enviados: o áudio
+        segue pelo caminho normal depois. Retorna (response, mensagens enviadas).
+        """
+        splitter = WhatsAppStreamSplitter()
+        queued = 0
+
+        def _first_sent(future: asyncio.Future):
+            if not future.cancelled() and future.exception() is None:
+                _first_reply_latency.observe((time.perf_counter() - run_started) * 1000)
+
+        def _enqueue(chunks: list[str]):
+            nonlocal queued
+            for chunk in chunks:
+                if GENERATED_AUDIO_RE.search(chunk):
+                    continue
+                if not queued:
+                    # Algo vai sair para o usuário: não dá mais para cancelar
+                    followups.sending(phone_number)
+                message = dispatcher.send_text(phone_number, chunk)
+                if not queued:
+                    message.future.add_done_callback(_first_sent)
+                queued += 1
+
+        async def _on_content(delta: str):
+            _enqueue(splitter.feed(delta))
+
+        response = await run(_on_content)
+        _enqueue(splitter.flush())
+        return response, queued
 
     return router
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""
+Agendador das execuções do agente por usuário.
+
+Cada usuário tem uma fila FIFO própria, processada por uma única tarefa:
+o próximo lote de mensagens de um usuário só começa depois que o anterior
+terminou. Um semáforo global limita quantas execuções do Team (chamadas ao
+LLM) rodam ao mesmo tempo; o restante espera a vez (deferral). Quando o
+total de trabalhos pendentes ou a fila de um usuário passa do limite, o
+trabalho novo é descartado (shedding) e on_shed é chamado para avisar o
+usuário.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+from agno.utils.log import log_error, log_info, log_warning
+
+from core.config import (
+    WHATSAPP_MAX_CONCURRENT_RUNS,
+    WHATSAPP_MAX_PENDING_PER_USER,
+    WHATSAPP_MAX_PENDING_RUNS,
+)
+
+Job = Callable[[], Awaitable[None]]
+
+
+class UserRunScheduler:
+    """Per-user FIFO work queues sharing a global cap on concurrent agent runs."""
+
+    def __init__(
+        self,
+        max_concurrent_runs: int = WHATSAPP_MAX_CONCURRENT_RUNS,
+        max_pending: int = WHATSAPP_MAX_PENDING_RUNS,
+        max_pending_per_user: int = WHATSAPP_MAX_PENDING_PER_USER,
+        on_shed: Optional[Callable[[str], Awaitable[None]]] = None,
+    ):
+        self.max_concurrent_runs = max(max_concurrent_runs, 1)
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self.on_shed = on_shed
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_runs)
+        # user_id -> deque[(job, enqueued_at)]
+        self._queues: dict[str, deque] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self._pending = 0
+        self._running = 0
+        self._waiting_for_slot = 0
+
+        self._submitted = 0
+        self._started = 0
+        self._completed = 0
+        self._failed = 0
+        self._shed = 0
+        self._max_pending_seen = 0
+        self._max_queue_wait = 0.0
+        self._total_queue_wait = 0.0
+
+    # ------------------------------------------------------------------
+    # Fila por usuário
+    # ------------------------------------------------------------------
+
+    def submit(self, user_id: str, job: Job) -> bool:
+        """
+        Enqueues a job for user_id. Returns False (and calls on_shed) when the
+        job is shed because the global or per-user limit was reached.
+        """
+        queue = self._queues.get(user_id)
+        user_depth = len(queue) if queue else 0
+
+        if self._pending >= self.max_pending or user_depth >= self.max_pending_per_user:
+            self._shed += 1
+            log_warning(
+                f"Scheduler: descartando trabalho de {user_id} "
+                f"(pendentes={self._pending}, fila do usuário={user_depth})"
+            )
+            if self.on_shed:
+                asyncio.create_task(self._notify_shed(user_id))
+            return False
+
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+        queue.append((job, time.monotonic()))
+        self._pending += 1
+        self._submitted += 1
+        self._max_pending_seen = max(self._max_pending_seen, self._pending)
+
+        if user_id not in self._workers:
+            self._workers[user_id] = asyncio.create_task(self._drain(user_id))
+        return True
+
+    def has_work(self, user_id: str) -> bool:
+        """True while user_id has a queued or running job."""
+        return user_id in self._workers
+
+    async def _drain(self, user_id: str) -> None:
+        queue = self._queues[user_id]
+        try:
+            while queue:
+                job, enqueued_at = queue.popleft()
+                self._pending -= 1
+                self._started += 1
+                wait = time.monotonic() - enqueued_at
+                self._total_queue_wait += wait
+                self._max_queue_wait = max(self._max_queue_wait, wait)
+                try:
+                    await job()
+                    self._completed += 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self._failed += 1
+                    log_error(f"Scheduler: trabalho de {user_id} falhou: {e}")
+        finally:
+            # Sem await entre o fim do loop e a remoção: nenhum submit se perde
+            self._pending -= len(queue)
+            self._queues.pop(user_id, None)
+            self._workers.pop(user_id, None)
+
+    async def _notify_shed(self, user_id: str) -> None:
+        try:
+            await self.on_shed(user_id)
+        except Exception as e:
+            log_error(f"Scheduler: falha ao avisar {user_id} sobre sobrecarga: {e}")
+
+    # ------------------------------------------------------------------
+    # Limite global de execuções
+    # ------------------------------------------------------------------
+
+    @asynccontextmanager
+    async def run_slot(self):
+        """Holds one of the max_concurrent_runs slots for an agent/team run."""
+        self._waiting_for_slot += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting_for_slot -= 1
+        self._running += 1
+        try:
+            yield
+        finally:
+            self._running -= 1
+            self._semaphore.release()
+
+    # ------------------------------------------------------------------
+    # Métricas e encerramento
+    # ------------------------------------------------------------------
+
+    def metrics(self) -> dict:
+        depths = [len(q) for q in self._queues.values()]
+        return {
+            "pending": self._pending,
+            "active_users": len(self._workers),
+            "running": self._running,
+            "waiting_for_slot": self._waiting_for_slot,
+            "max_concurrent_runs": self.max_concurrent_runs,
+            "max_user_queue_depth": max(depths, default=0),
+            "max_pending_seen": self._max_pending_seen,
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "shed": self._shed,
+            "avg_queue_wait_seconds": round(self._total_queue_wait / self._started, 3) if self._started else 0.0,
+            "max_queue_wait_seconds": round(self._max_queue_wait, 3),
+        }
+
+    async def close(self) -> None:
+        """Cancels the per-user workers (used on shutdown)."""
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+            log_info(f"Scheduler: {len(workers)} filas de usuário canceladas no shutdown")
@@ -6,6 +6,8 @@ from agno.team import Team
 from agno.agent import Agent
 from agno.os.interfaces.base import BaseInterface
 
+from .client import WhatsAppGraphClient
+from .debounce import DebouncePolicy
 from .router import attach_routes
 
 class Whatsapp(BaseInterface):
@@ -19,17 +21,30 @@ class Whatsapp(BaseInterface):
         team: Optional[Team] = None,
         prefix: str = "/whatsapp",
         tags: Optional[List[str]] = None,
+        client: Optional[WhatsAppGraphClient] = None,
+        debounce_policy: Optional[DebouncePolicy] = None,
     ):
         self.agent = agent
         self.team = team
         self.prefix = prefix
         self.tags = tags or ["Whatsapp"]
+        # Um único cliente HTTP (pool de conexões) por interface, fechado no shutdown
+        self.client = client or WhatsAppGraphClient()
+        # None = política escolhida por DEBOUNCE_POLICY
+        self.debounce_policy = debounce_policy
         if not (self.agent or self.team):
             raise ValueError("Whatsapp requires an agent or a team")
 
     def get_router(self) -> APIRouter:
         self.router = APIRouter(prefix=self.prefix, tags=self.tags)  # type: ignore
 
-        self.router = attach_routes(router=self.router, agent=self.agent, team=self.team)
+        self.router = attach_routes(
+            router=self.router,
+            agent=self.agent,
+            team=self.team,
+            client=self.client,
+            debounce_policy=self.debounce_policy,
+        )
+        self.router.add_event_handler("shutdown", self.client.aclose)
 
         return self.router
\ No newline at end of file